@@ -137,7 +137,7 @@ class BiometricController extends ResourceController
         $result = $this->deepfaceService->recognizeFace($photoBase64);
 
         if (!$result['success']) {
-            return $this->fail($result['error'], 400);
+            return $this->fail($result['error'], !empty($result['spoof_detected']) ? 422 : 400);
         }
 
         if (!$result['recognized']) {
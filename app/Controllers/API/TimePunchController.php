@@ -88,17 +88,21 @@ class TimePunchController extends ResourceController
 
         // Validate facial recognition if method is facial
         if ($method === 'facial' && $photo) {
-            $recognition = $this->deepfaceService->recognizeFace($photo);
+            $verification = $this->deepfaceService->verifyFace($employee->id, $photo);
 
-            if (!$recognition['success'] || !$recognition['recognized']) {
+            if (!empty($verification['spoof_detected'])) {
+                return $this->fail($verification['error'], 422);
+            }
+
+            if (!$verification['success']) {
                 return $this->fail('Rosto não reconhecido.', 400);
             }
 
-            if ($recognition['employee_id'] !== $employee->id) {
+            if (!$verification['verified']) {
                 return $this->fail('A foto não corresponde ao funcionário autenticado.', 403);
             }
 
-            $faceSimilarity = $recognition['similarity'];
+            $faceSimilarity = $verification['similarity'];
         }
 
         // Check for duplicate punch (within 1 minute)
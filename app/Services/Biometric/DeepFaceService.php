@@ -70,9 +70,11 @@ class DeepFaceService
      *
      * @param int $employeeId
      * @param string $photoBase64
+     * @param string|null $partition Company/site key used to scope recognition
+     * @param bool $addTemplate Keep the current enrollment and add this photo as another template
      * @return array
      */
-    public function enrollFace(int $employeeId, string $photoBase64): array
+    public function enrollFace(int $employeeId, string $photoBase64, ?string $partition = null, bool $addTemplate = false): array
     {
         try {
             // Validate employee exists
@@ -88,11 +90,21 @@ class DeepFaceService
             // Call DeepFace API
             $client = \Config\Services::curlrequest();
 
+            $payload = [
+                'employee_id' => $employeeId,
+                'photo' => $photoBase64,
+            ];
+
+            if ($partition !== null) {
+                $payload['partition'] = $partition;
+            }
+
+            if ($addTemplate) {
+                $payload['mode'] = 'add';
+            }
+
             $response = $client->post($this->apiUrl . '/enroll', [
-                'json' => [
-                    'employee_id' => $employeeId,
-                    'photo' => $photoBase64,
-                ],
+                'json' => $payload,
                 'timeout' => $this->timeout,
                 'http_errors' => false,
             ]);
@@ -105,6 +117,8 @@ class DeepFaceService
                     'success' => false,
                     'error' => $result['error'] ?? 'Erro ao processar imagem.',
                     'details' => $result['details'] ?? null,
+                    'reason' => $result['reason'] ?? null,
+                    'quality' => $result['quality'] ?? null,
                 ];
             }
 
@@ -121,6 +135,7 @@ class DeepFaceService
                 'image_hash' => $result['image_hash'],
                 'confidence' => $result['confidence'] ?? 0.95,
                 'facial_area' => $result['facial_area'] ?? null,
+                'templates' => $result['templates'] ?? 1,
             ];
 
         } catch (\Exception $e) {
@@ -139,9 +154,10 @@ class DeepFaceService
      *
      * @param string $photoBase64
      * @param float|null $customThreshold
+     * @param array $scope Optional 'partition' (company/site key) and/or 'candidates' (employee ids)
      * @return array
      */
-    public function recognizeFace(string $photoBase64, ?float $customThreshold = null): array
+    public function recognizeFace(string $photoBase64, ?float $customThreshold = null, array $scope = []): array
     {
         try {
             // Get threshold from settings or use custom
@@ -150,11 +166,22 @@ class DeepFaceService
             // Call DeepFace API
             $client = \Config\Services::curlrequest();
 
+            $payload = [
+                'photo' => $photoBase64,
+                'threshold' => $threshold,
+            ];
+
+            // Restrict the search to a company/site partition or candidate list
+            if (isset($scope['partition'])) {
+                $payload['partition'] = (string) $scope['partition'];
+            }
+
+            if (isset($scope['candidates'])) {
+                $payload['candidates'] = array_map('strval', $scope['candidates']);
+            }
+
             $response = $client->post($this->apiUrl . '/recognize', [
-                'json' => [
-                    'photo' => $photoBase64,
-                    'threshold' => $threshold,
-                ],
+                'json' => $payload,
                 'timeout' => $this->timeout,
                 'http_errors' => false,
             ]);
@@ -162,6 +189,10 @@ class DeepFaceService
             $statusCode = $response->getStatusCode();
             $result = json_decode($response->getBody(), true);
 
+            if ($statusCode === 422) {
+                return $this->spoofResult($result);
+            }
+
             if ($statusCode !== 200) {
                 return [
                     'success' => false,
@@ -235,13 +266,15 @@ class DeepFaceService
                 ];
             }
 
-            // Call DeepFace API
+            $threshold = $this->settingModel->get('deepface_threshold', 0.40);
+
+            // Call DeepFace API (1:1 against the stored template)
             $client = \Config\Services::curlrequest();
 
-            $response = $client->post($this->apiUrl . '/verify', [
+            $response = $client->post($this->apiUrl . '/verify/' . $employeeId, [
                 'json' => [
-                    'employee_id' => $employeeId,
                     'photo' => $photoBase64,
+                    'threshold' => $threshold,
                 ],
                 'timeout' => $this->timeout,
                 'http_errors' => false,
@@ -250,6 +283,10 @@ class DeepFaceService
             $statusCode = $response->getStatusCode();
             $result = json_decode($response->getBody(), true);
 
+            if ($statusCode === 422) {
+                return $this->spoofResult($result);
+            }
+
             if ($statusCode !== 200) {
                 return [
                     'success' => false,
@@ -276,22 +313,139 @@ class DeepFaceService
         }
     }
 
+    /**
+     * Recognize (or verify) a punch photo with a single detection
+     *
+     * Replaces validateImage + analyzeFace + recognizeFace/verifyFace for one punch.
+     *
+     * @param string $photoBase64
+     * @param int|null $employeeId Verify 1:1 against this employee instead of searching
+     * @param array $options Optional 'threshold', 'partition', 'candidates' and 'analyze' (bool)
+     * @return array
+     */
+    public function punchFace(string $photoBase64, ?int $employeeId = null, array $options = []): array
+    {
+        try {
+            $payload = [
+                'photo' => $photoBase64,
+                'threshold' => $options['threshold'] ?? $this->settingModel->get('deepface_threshold', 0.40),
+                'analyze' => (bool) ($options['analyze'] ?? false),
+            ];
+
+            if ($employeeId !== null) {
+                $payload['employee_id'] = (string) $employeeId;
+            }
+
+            if (isset($options['partition'])) {
+                $payload['partition'] = (string) $options['partition'];
+            }
+
+            if (isset($options['candidates'])) {
+                $payload['candidates'] = array_map('strval', $options['candidates']);
+            }
+
+            // Call DeepFace API
+            $client = \Config\Services::curlrequest();
+
+            $response = $client->post($this->apiUrl . '/punch', [
+                'json' => $payload,
+                'timeout' => $this->timeout,
+                'http_errors' => false,
+            ]);
+
+            $statusCode = $response->getStatusCode();
+            $result = json_decode($response->getBody(), true);
+
+            if ($statusCode === 422) {
+                return $this->spoofResult($result);
+            }
+
+            if ($statusCode !== 200) {
+                return [
+                    'success' => false,
+                    'error' => $result['error'] ?? 'Erro ao processar imagem.',
+                    'reason' => $result['reason'] ?? null,
+                    'quality' => $result['quality'] ?? null,
+                ];
+            }
+
+            if (empty($result['recognized'])) {
+                return [
+                    'success' => true,
+                    'recognized' => false,
+                    'message' => 'Nenhum rosto reconhecido.',
+                    'quality' => $result['quality'] ?? null,
+                    'analysis' => $result['analysis'] ?? null,
+                ];
+            }
+
+            return [
+                'success' => true,
+                'recognized' => true,
+                'employee_id' => $result['employee_id'],
+                'employee' => $this->employeeModel->find($result['employee_id']),
+                'similarity' => $result['similarity'],
+                'distance' => $result['distance'],
+                'model' => $result['model'] ?? 'VGG-Face',
+                'threshold_used' => $result['threshold'] ?? $payload['threshold'],
+                'quality' => $result['quality'] ?? null,
+                'analysis' => $result['analysis'] ?? null,
+            ];
+
+        } catch (\Exception $e) {
+            log_message('error', 'DeepFace punch error: ' . $e->getMessage());
+
+            return [
+                'success' => false,
+                'error' => 'Erro ao conectar com serviço de reconhecimento facial.',
+                'details' => $e->getMessage(),
+            ];
+        }
+    }
+
+    /**
+     * Result of a photo rejected by the liveness check (HTTP 422)
+     *
+     * Kept apart from "not recognized" so callers can flag a fraud attempt.
+     *
+     * @param array|null $result
+     * @return array
+     */
+    protected function spoofResult(?array $result): array
+    {
+        log_message('warning', 'DeepFace spoof detected: ' . json_encode($result['liveness'] ?? null));
+
+        return [
+            'success' => false,
+            'spoof_detected' => true,
+            'error' => 'Foto ou tela detectada. Posicione o rosto diretamente em frente à câmera.',
+            'liveness' => $result['liveness'] ?? null,
+        ];
+    }
+
     /**
      * Analyze facial attributes (age, gender, emotion, race)
      *
      * @param string $photoBase64
+     * @param array $actions Attributes to compute (empty = the API default); each one is a separate model
      * @return array
      */
-    public function analyzeFace(string $photoBase64): array
+    public function analyzeFace(string $photoBase64, array $actions = []): array
     {
         try {
+            $payload = [
+                'photo' => $photoBase64,
+            ];
+
+            if (!empty($actions)) {
+                $payload['actions'] = array_values($actions);
+            }
+
             // Call DeepFace API
             $client = \Config\Services::curlrequest();
 
             $response = $client->post($this->apiUrl . '/analyze', [
-                'json' => [
-                    'photo' => $photoBase64,
-                ],
+                'json' => $payload,
                 'timeout' => $this->timeout,
                 'http_errors' => false,
             ]);
@@ -331,6 +485,9 @@ class DeepFaceService
     public function deleteFaceEnrollment(int $employeeId): array
     {
         try {
+            // Drop the template from the API gallery (every worker, no re-indexing)
+            $apiDeleted = $this->deleteApiEnrollment($employeeId);
+
             // Get employee's face templates
             $templates = $this->biometricModel
                 ->where('employee_id', $employeeId)
@@ -340,6 +497,7 @@ class DeepFaceService
             if (empty($templates)) {
                 return [
                     'success' => true,
+                    'api_deleted' => $apiDeleted,
                     'message' => 'Nenhum cadastro facial encontrado.',
                 ];
             }
@@ -367,6 +525,7 @@ class DeepFaceService
 
             return [
                 'success' => true,
+                'api_deleted' => $apiDeleted,
                 'deleted_files' => $deletedCount,
                 'deleted_records' => count($templates),
             ];
@@ -382,6 +541,38 @@ class DeepFaceService
         }
     }
 
+    /**
+     * Delete the enrollment held by the DeepFace API
+     *
+     * Failures are logged and do not block the local deletion.
+     *
+     * @param int $employeeId
+     * @return bool True if the API deleted it or had nothing to delete
+     */
+    protected function deleteApiEnrollment(int $employeeId): bool
+    {
+        try {
+            $client = \Config\Services::curlrequest();
+
+            $response = $client->delete($this->apiUrl . '/enroll/' . $employeeId, [
+                'timeout' => $this->timeout,
+                'http_errors' => false,
+            ]);
+
+            $statusCode = $response->getStatusCode();
+
+            if ($statusCode === 200 || $statusCode === 404) {
+                return true;
+            }
+
+            log_message('warning', "DeepFace API delete enrollment returned {$statusCode} for employee {$employeeId}");
+        } catch (\Exception $e) {
+            log_message('error', 'DeepFace API delete enrollment error: ' . $e->getMessage());
+        }
+
+        return false;
+    }
+
     /**
      * Get DeepFace API statistics
      *
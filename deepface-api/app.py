@@ -4,13 +4,15 @@ Sistema de Ponto Eletrônico Brasileiro
 """
 
 import os
+import json
 import base64
 import logging
 import hashlib
+import time
 from datetime import datetime
 from io import BytesIO
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -19,10 +21,31 @@ from deepface import DeepFace
 import numpy as np
 
 from config import config, Config
+from gallery import FaceGallery
+from index import compute_distances
+from inference import NoFaceDetected, build_models, cascade, detect_faces, embed_faces
+from liveness import LivenessChecker, SpoofDetected
+from quality import REASONS, LowQualityFace, QualityGate
+from attributes import ACTION_MODELS, AttributeModels, describe_analysis, parse_actions
+from batching import BATCH_SIZE_BUCKETS, QUEUE_SECONDS_BUCKETS, MicroBatcher
+from cache import ProbeCache, ResultCache
+from metrics import CONTENT_TYPE, MetricsRegistry
+from preprocessing import ImageRejected, map_faces, prepare_image
+from uploads import MULTIPART_MIMETYPE, RAW_MIMETYPE, UploadRequest, read_parameters, read_photos
+from streaming import StreamSession
+
+# Optional: WebSocket streaming kiosk mode
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 # Initialize Flask app
 app = Flask(__name__)
 
+# Multipart photo parts are buffered in memory, capped at MAX_FILE_SIZE
+app.request_class = UploadRequest
+
 # Load configuration
 env = os.getenv('FLASK_ENV', 'development')
 app.config.from_object(config[env])
@@ -30,6 +53,13 @@ app.config.from_object(config[env])
 # Setup CORS
 CORS(app, resources={r"/*": {"origins": Config.CORS_ORIGINS}})
 
+# Request timing starts before Flask-Limiter's check so its cost is measured too
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+
+app.before_request_funcs.setdefault(None, []).insert(0, start_request_timer)
+
 # Setup rate limiting
 limiter = Limiter(
     app=app,
@@ -49,19 +79,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Metrics (exposed on /metrics)
+metrics = MetricsRegistry()
+REQUEST_SECONDS = metrics.histogram('deepface_request_seconds', 'End-to-end request latency', ['endpoint'])
+STAGE_SECONDS = metrics.histogram('deepface_stage_seconds', 'Latency of each request stage', ['stage'])
+REQUESTS = metrics.counter('deepface_requests_total', 'Requests by endpoint and outcome', ['endpoint', 'outcome'])
+BATCH_ITEMS = metrics.counter('deepface_batch_items_total', 'Photos in /recognize/batch by outcome', ['outcome'])
+STREAM_FRAMES = metrics.counter('deepface_stream_frames_total', 'Frames received on /stream by outcome', ['outcome'])
+STREAM_EVENTS = metrics.counter('deepface_stream_events_total', 'Events pushed on /stream', ['event'])
+
+# Outcome of a response when the endpoint did not set a more specific one
+STATUS_OUTCOMES = {
+    200: 'ok', 400: 'invalid_request', 404: 'not_found', 413: 'too_large', 422: 'spoof_detected',
+    429: 'rate_limited', 500: 'error'
+}
+
 # Ensure directories exist
 os.makedirs(Config.FACES_DB_PATH, exist_ok=True)
 os.makedirs(os.path.dirname(Config.LOG_FILE), exist_ok=True)
 
 
-def decode_base64_image(base64_string):
+@STAGE_SECONDS.time(stage='decode')
+def decode_base64_bytes(base64_string):
     """
-    Decode base64 image string to PIL Image
+    Decode base64 image string to raw image bytes
     """
     try:
         # Remove data:image prefix if present
         if 'base64,' in base64_string:
-            base64_string = base64_string.split('base64,')[1]
+            base64_string = base64_string[base64_string.index('base64,') + 7:]
+
+        # Refuse oversized payloads before decoding them
+        if len(base64_string) * 3 // 4 > Config.MAX_FILE_SIZE + 2:
+            raise ValueError(f'Image size exceeds maximum allowed ({Config.MAX_FILE_SIZE} bytes)')
 
         # Decode base64
         image_data = base64.b64decode(base64_string)
@@ -70,468 +120,1750 @@ def decode_base64_image(base64_string):
         if len(image_data) > Config.MAX_FILE_SIZE:
             raise ValueError(f'Image size exceeds maximum allowed ({Config.MAX_FILE_SIZE} bytes)')
 
-        # Open image
-        image = Image.open(BytesIO(image_data))
-
-        return image
+        return image_data
 
     except Exception as e:
         logger.error(f'Error decoding base64 image: {str(e)}')
         raise
 
 
-def save_temp_image(image, prefix='temp'):
+def decode_image_array(image_data):
+    """
+    Decode raw image bytes straight to the BGR working array, no disk involved
+
+    Returns (array, scale): scale maps working coordinates back to the
+    original photo.
+    """
+    with STAGE_SECONDS.time(stage='decode_image'):
+        return prepare_image(image_data)
+
+
+def request_data():
     """
-    Save PIL Image to temporary file
+    Parameters of the request: the JSON body, or the form fields and query
+    string of a multipart or raw (application/octet-stream) upload
+    """
+    if g.photos or not request.is_json:
+        return read_parameters(request)
+
+    return request.get_json()
+
+
+def has_photo(data, name='photo'):
+    return name in g.photos or (data is not None and data.get(name) is not None)
+
+
+def get_photo(data, name='photo'):
+    """
+    Raw bytes of a photo, sent as a binary part/body or as a base64 field
+    """
+    if name in g.photos:
+        return g.photos[name][0]
+
+    return decode_base64_bytes(data[name])
+
+
+def encode_face_image(image_data):
+    """
+    Bytes to store as <employee_id>_face.jpg
+
+    JPEG uploads are stored as received; other formats are re-encoded once.
+    """
+    image = Image.open(BytesIO(image_data))
+
+    if image.format == 'JPEG':
+        return image_data
+
+    buffer = BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=95)
+
+    return buffer.getvalue()
+
+
+@STAGE_SECONDS.time(stage='hash')
+def calculate_image_hash(image_data):
+    """
+    Calculate SHA-256 hash of raw image bytes
     """
     try:
-        temp_dir = os.path.join(Config.FACES_DB_PATH, 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
+        return hashlib.sha256(image_data).hexdigest()
+    except Exception as e:
+        logger.error(f'Error calculating image hash: {str(e)}')
+        return None
+
+
+# Concurrent /recognize, /verify and /enroll calls share forward passes
+embedder = MicroBatcher(
+    embed_faces,
+    max_batch_size=Config.INFERENCE_BATCH_MAX_SIZE,
+    max_wait_ms=Config.INFERENCE_BATCH_MAX_WAIT_MS,
+    enabled=Config.INFERENCE_BATCHING_ENABLED,
+    batch_histogram=metrics.histogram('deepface_inference_batch_faces', 'Faces per batched forward pass',
+                                      buckets=BATCH_SIZE_BUCKETS),
+    queue_histogram=metrics.histogram('deepface_inference_queue_seconds',
+                                      'Time each request waited in the micro-batching queue',
+                                      buckets=QUEUE_SECONDS_BUCKETS)
+)
+
+
+# Retried photos (same SHA-256) skip detection, embedding and, while still
+# valid, the search
+probe_cache = ProbeCache(
+    model_name=Config.MODEL_NAME,
+    detector_backend=Config.DETECTOR_BACKEND,
+    align=Config.ALIGN,
+    max_entries=Config.CACHE_MAX_ENTRIES,
+    ttl=Config.CACHE_TTL,
+    enabled=Config.CACHE_ENABLED
+)
+result_cache = ResultCache(
+    distance_metric=Config.DISTANCE_METRIC,
+    max_entries=Config.CACHE_MAX_ENTRIES,
+    ttl=Config.CACHE_TTL,
+    enabled=Config.CACHE_ENABLED
+)
+
+
+def load_probe(image_data, image_hash, crops=False):
+    """
+    Detected faces of an upload, decoded and detected only on a cache miss
+
+    Cached probes keep their face crops only until embedded; crops=True
+    detects again when a later stage (analysis, liveness) needs them.
+    """
+    probe = probe_cache.get_probe(image_hash)
+
+    if probe is None or (crops and any('face' not in face for face in probe['faces'])):
+        with STAGE_SECONDS.time(stage='decode_image'):
+            img, scale = prepare_image(image_data)
 
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        filename = f'{prefix}_{timestamp}.jpg'
-        filepath = os.path.join(temp_dir, filename)
+        with STAGE_SECONDS.time(stage='detect'):
+            faces = map_faces(detect_faces(img, scale=scale), scale)
 
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        # Measured while the crops exist; the metrics stay cached with the faces
+        with STAGE_SECONDS.time(stage='quality'):
+            faces = quality_gate.measure(faces)
 
-        image.save(filepath, 'JPEG', quality=95)
+        if probe is not None:
+            return {'faces': faces, 'embedding': probe['embedding']}
 
-        return filepath
+        probe = probe_cache.put_faces(image_hash, faces)
+
+    return probe
+
+
+def embed_probe(image_hash, probe):
+    """
+    Embedding of the first face of a probe, computed once per upload
+    """
+    if probe['embedding'] is None:
+        if not probe['faces']:
+            raise NoFaceDetected('No face detected in the image')
+
+        with STAGE_SECONDS.time(stage='embed'):
+            embedding = embedder.embed(probe['faces'][:1])[0]
+        probe = probe_cache.put_embedding(image_hash, probe['faces'], embedding, probe.get('liveness'))
+
+    return probe['embedding']
+
+
+liveness = LivenessChecker.from_config()
+quality_gate = QualityGate.from_config()
+
+
+def check_quality(probe, profile='verify'):
+    """
+    Quality metrics of the probe's face under a profile; raises LowQualityFace
+
+    A probe without faces is returned unchecked, for the caller to report
+    the missing face.
+    """
+    if not probe['faces']:
+        return None
+
+    return quality_gate.check(probe['faces'][0], profile)
+
+
+def quality_response(error):
+    """
+    400 response of a face that failed the quality gate
+    """
+    logger.info(f'Low quality face: {error.reason} {error.metrics}')
+    g.outcome = error.reason
+
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        'reason': error.reason,
+        'quality': error.metrics
+    }), 400
+
+
+def liveness_requested(data):
+    """
+    Whether to run the liveness check: ANTI_SPOOFING_ENABLED, unless the request sends "liveness": false
+    """
+    return Config.ANTI_SPOOFING_ENABLED and str(data.get('liveness', True)).lower() not in ('false', '0')
+
+
+def check_liveness(image_data, image_hash, probe):
+    """
+    Liveness verdict of the probe's face, computed once per upload
+
+    Returns (probe, result); raises SpoofDetected. A probe without faces is
+    returned unchecked, for the caller to report the missing face.
+    """
+    result = probe.get('liveness')
+
+    if result is None:
+        if probe['faces'] and 'face' not in probe['faces'][0]:
+            probe = load_probe(image_data, image_hash, crops=True)
+
+        if not probe['faces']:
+            return probe, None
+
+        with STAGE_SECONDS.time(stage='liveness'):
+            result = liveness.check(probe['faces'][0]['face'])
+
+        probe = probe_cache.put_liveness(image_hash, probe, result)
+
+    if not result['live']:
+        raise SpoofDetected(result)
+
+    return probe, result
+
+
+def spoof_response(error):
+    """
+    422 response of a face that failed the liveness check
+    """
+    logger.warning(f'Spoof detected: {error.result}')
+    g.outcome = 'spoof_detected'
+
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        'reason': 'spoof_detected',
+        'liveness': error.result
+    }), 422
+
+
+def error_outcome(error):
+    """
+    Metrics outcome of a validation error
+    """
+    if isinstance(error, LowQualityFace):
+        return error.reason
 
+    if isinstance(error, NoFaceDetected):
+        return 'no_face'
+
+    return 'rejected_image' if isinstance(error, ImageRejected) else 'invalid_request'
+
+
+def cached_response(response):
+    """
+    Replay a cached response body, flagged as such
+    """
+    return jsonify({**response, 'cached': True}), 200
+
+
+def parse_search_scope(data):
+    """
+    Read the optional partition key and candidate list of a search request
+    """
+    partition = data.get('partition')
+    candidates = data.get('candidates')
+
+    if partition is not None:
+        partition = str(partition)
+
+    if candidates is not None:
+        if not isinstance(candidates, list):
+            raise ValueError('candidates must be a list of employee ids')
+        candidates = [str(candidate) for candidate in candidates]
+
+    return partition, candidates
+
+
+def parse_top_k(data):
+    """
+    Read the optional top_k and min_margin parameters of a search request
+    """
+    top_k = int(data.get('top_k', Config.RECOGNITION_TOP_K))
+    min_margin = float(data.get('min_margin', Config.MIN_MATCH_MARGIN))
+
+    if top_k < 1:
+        raise ValueError('top_k must be at least 1')
+
+    return top_k, min_margin
+
+
+def describe_matches(matches, top_k):
+    """
+    Top-k candidate list and best-vs-runner-up margin of a sorted match list
+
+    The margin is None when there is no runner-up to compare with.
+    """
+    margin = matches[1][1] - matches[0][1] if len(matches) > 1 else None
+
+    return [
+        {
+            'employee_id': employee_id,
+            'distance': distance,
+            'similarity': float(1 - distance)
+        }
+        for employee_id, distance in matches[:top_k]
+    ], margin
+
+
+def represent_face(img_path):
+    """
+    Compute the embedding of the first face found in an image file
+
+    The file goes through the same preprocessing as uploads, so rebuilt
+    templates match the ones computed at enrollment.
+    """
+    with open(img_path, 'rb') as f:
+        img, scale = prepare_image(f.read())
+
+    faces = detect_faces(img, scale=scale)
+
+    if not faces:
+        raise NoFaceDetected('No face detected in the image')
+
+    return embedder.embed(faces[:1])[0]
+
+
+def verify_pair(img1, img2):
+    """
+    DeepFace.verify through this service's detector and inference backend
+
+    Used with the onnx and stub backends, which never build the TensorFlow model.
+    """
+    faces = [detect_faces(img)[0] for img in (img1, img2)]
+    embeddings = embedder.embed(faces)
+    distance = float(compute_distances(embeddings[:1], embeddings[1], Config.DISTANCE_METRIC)[0])
+    threshold = Config.get_threshold()
+
+    return {'verified': distance <= threshold, 'distance': distance, 'threshold': threshold}
+
+
+def preload_models():
+    """
+    Build the recognition model and the face detector
+
+    Called at import time so that, with gunicorn preload_app, the weights are
+    loaded once in the master and shared copy-on-write by every worker.
+    """
+    start = time.perf_counter()
+
+    build_models()
+
+    startup_stats['models_loaded'] = True
+    startup_stats['model_load_seconds'] = time.perf_counter() - start
+
+    logger.info(f'Models preloaded in {startup_stats["model_load_seconds"]:.2f}s')
+
+
+def warmup():
+    """
+    Run one dummy detection + embedding so no request pays cold-start cost
+
+    Runs inside each gunicorn worker (post_fork), never in the master:
+    TensorFlow thread pools are not fork-safe, so inference started
+    before the fork can hang the workers.
+    """
+    start = time.perf_counter()
+
+    try:
+        embed_faces(detect_faces(np.zeros((224, 224, 3), dtype=np.uint8), enforce_detection=False))
+        startup_stats['warmed_up'] = True
     except Exception as e:
-        logger.error(f'Error saving temp image: {str(e)}')
-        raise
+        logger.warning(f'Warm-up inference failed: {str(e)}')
+
+    logger.info(f'Warm-up inference finished in {time.perf_counter() - start:.2f}s (pid {os.getpid()})')
+
+
+startup_stats = {
+    'models_loaded': False,
+    'model_load_seconds': None,
+    'warmed_up': False
+}
+
+if Config.PRELOAD_MODELS:
+    preload_models()
+
+# Load the resident embedding gallery once per process
+gallery = FaceGallery(
+    model_name=Config.MODEL_NAME,
+    detector_backend=Config.DETECTOR_BACKEND,
+    align=Config.ALIGN,
+    distance_metric=Config.DISTANCE_METRIC,
+    ann_min_size=Config.ANN_MIN_GALLERY_SIZE,
+    ann_n_lists=Config.ANN_N_LISTS,
+    ann_n_probe=Config.ANN_N_PROBE,
+    store_enabled=Config.EMBEDDING_STORE_ENABLED,
+    store_dtype=Config.EMBEDDING_STORE_DTYPE,
+    compact_every=Config.EMBEDDING_STORE_COMPACT_EVERY,
+    max_templates=Config.MAX_TEMPLATES_PER_EMPLOYEE,
+    rerank_candidates=Config.TEMPLATE_RERANK_CANDIDATES
+)
+gallery.load(Config.FACES_DB_PATH, represent_face)
+
+
+def gallery_changed(op, employee_id, embedding, partition):
+    """
+    Drop cached results an enrollment or deletion made by another worker could change
+    """
+    if op == 'reload':
+        result_cache.clear()
+    elif op == 'delete':
+        result_cache.invalidate_removal(employee_id)
+    else:
+        result_cache.invalidate_enrollment(employee_id, embedding, partition)
+
+
+@app.before_request
+def rate_limit_checked():
+    """
+    Runs after Flask-Limiter's check (registered later), closing the rate_limit stage
+    """
+    if 'request_started_at' in g:
+        STAGE_SECONDS.observe(time.perf_counter() - g.request_started_at, stage='rate_limit')
+
+
+@app.before_request
+def sync_gallery():
+    """
+    Apply enrollments and deletions other workers made (one memory read when there are none)
+    """
+    gallery.sync(gallery_changed)
+
+
+@app.before_request
+def read_binary_upload():
+    """
+    Buffer multipart and raw photo uploads before the view runs
+
+    Registered after Flask-Limiter, so a rate-limited client never has its
+    body read; an oversized photo is refused with 413 while streaming.
+    """
+    g.photos = {}
+
+    if request.method == 'POST' and request.mimetype in (RAW_MIMETYPE, MULTIPART_MIMETYPE):
+        with STAGE_SECONDS.time(stage='upload'):
+            g.photos = read_photos(request)
+
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Count every response by endpoint and outcome and time it end to end
+    """
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    outcome = g.get('outcome') or STATUS_OUTCOMES.get(response.status_code, str(response.status_code))
+
+    REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+
+    # A WebSocket "request" lasts as long as the connection
+    if 'request_started_at' in g and not g.get('websocket'):
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started_at, endpoint=endpoint)
+
+    return response
+
+
+def cache_metric(field):
+    return lambda: {
+        (name,): cache.stats()[field]
+        for name, cache in (('probes', probe_cache), ('results', result_cache))
+    }
+
+
+# Read at scrape time
+metrics.gauge('deepface_gallery_size', 'Enrolled embeddings in the resident gallery', callback=lambda: len(gallery))
+metrics.gauge('deepface_gallery_partitions', 'Gallery partitions', callback=lambda: gallery.stats()['partitions'])
+metrics.gauge('deepface_gallery_generation', 'Last gallery journal generation applied by this process',
+              callback=lambda: gallery.generation)
+metrics.counter('deepface_gallery_synced_changes_total', 'Enrollments and deletions replayed from other workers',
+                callback=lambda: gallery.stats()['synced_changes'])
+metrics.counter('deepface_gallery_compactions_total', 'Embedding store rewrites done by this process',
+                callback=lambda: gallery.stats()['compactions'])
+metrics.gauge('deepface_model_load_seconds', 'Time spent preloading the model and detector',
+              callback=lambda: startup_stats['model_load_seconds'])
+metrics.gauge('deepface_warmed_up', 'Whether this process ran its warm-up inference',
+              callback=lambda: int(startup_stats['warmed_up']))
+metrics.gauge('deepface_cache_entries', 'Entries held by each cache', ['cache'], callback=cache_metric('size'))
+metrics.counter('deepface_cache_hits_total', 'Cache hits', ['cache'], callback=cache_metric('hits'))
+metrics.counter('deepface_cache_misses_total', 'Cache misses', ['cache'], callback=cache_metric('misses'))
+metrics.counter('deepface_cache_evictions_total', 'LRU evictions', ['cache'], callback=cache_metric('evictions'))
+metrics.counter('deepface_cache_expirations_total', 'Entries expired by TTL', ['cache'],
+                callback=cache_metric('expirations'))
+metrics.counter('deepface_cache_invalidations_total', 'Entries dropped by enroll or removal', ['cache'],
+                callback=cache_metric('invalidations'))
+metrics.counter('deepface_detector_resolved_total', 'Detection requests settled by each detector cascade stage',
+                ['detector'], callback=lambda: {(key,): value for key, value in cascade.stats()['resolved'].items()})
+metrics.counter('deepface_detector_escalations_total', 'Detector cascade escalations to the next stage',
+                ['detector', 'reason'], callback=lambda: cascade.stats()['escalations'])
+metrics.counter('deepface_detector_calls_total', 'Detector passes by backend',
+                ['detector'], callback=lambda: {(key,): value for key, value in cascade.stats()['calls'].items()})
+metrics.counter('deepface_detector_seconds_total', 'Time spent in each detector backend',
+                ['detector'], callback=lambda: {(key,): value for key, value in cascade.stats()['seconds'].items()})
+metrics.counter('deepface_liveness_checks_total', 'Liveness checks', callback=lambda: liveness.stats()['checks'])
+metrics.counter('deepface_liveness_spoofs_total', 'Faces rejected as spoofs by reason', ['reason'],
+                callback=lambda: {(key,): value for key, value in liveness.stats()['spoofs'].items()})
+metrics.counter('deepface_liveness_cnn_runs_total', 'Borderline faces sent to the liveness CNN',
+                callback=lambda: liveness.stats()['cnn_runs'])
+metrics.counter('deepface_liveness_seconds_total', 'Time spent in liveness checks',
+                callback=lambda: liveness.stats()['seconds'])
+metrics.counter('deepface_quality_checks_total', 'Faces checked by the quality gate by profile', ['profile'],
+                callback=lambda: {(key,): value for key, value in quality_gate.stats()['checks'].items()})
+metrics.counter('deepface_quality_rejections_total', 'Faces rejected by the quality gate', ['profile', 'reason'],
+                callback=lambda: quality_gate.stats()['rejections'])
+metrics.gauge('deepface_attribute_model_loaded', 'Whether this process holds each attribute model', ['action'],
+              callback=lambda: {(action,): int(action in attribute_models.loaded()) for action in ACTION_MODELS})
+metrics.counter('deepface_attribute_model_loads_total', 'Attribute model builds', ['action'],
+                callback=lambda: {(key,): value for key, value in attribute_models.stats()['loads'].items()})
+metrics.counter('deepface_attribute_model_unloads_total', 'Attribute models released (idle or memory pressure)',
+                ['action'], callback=lambda: {(key,): value for key, value in attribute_models.stats()['unloads'].items()})
+metrics.counter('deepface_inference_batches_total', 'Batched forward passes',
+                callback=lambda: embedder.stats()['batches'])
+metrics.counter('deepface_inference_faces_total', 'Faces embedded by batched forward passes',
+                callback=lambda: embedder.stats()['faces'])
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Health check endpoint
+    """
+    return jsonify({
+        'status': 'ok',
+        'service': 'deepface-api',
+        'version': '1.0.0',
+        'model': Config.MODEL_NAME,
+        'detector': Config.DETECTOR_BACKEND,
+        'gallery_size': len(gallery),
+        'gallery_index': gallery.stats(),
+        'models_loaded': startup_stats['models_loaded'],
+        'warmed_up': startup_stats['warmed_up'],
+        'inference_batching': embedder.stats(),
+        'detector_cascade': cascade.backends,
+        'attribute_models': attribute_models.stats(),
+        'cache': {
+            'enabled': Config.CACHE_ENABLED,
+            'probes': probe_cache.stats(),
+            'results': result_cache.stats()
+        },
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    """
+    Prometheus text exposition of this process' metrics
+    """
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/enroll', methods=['POST'])
+@limiter.limit("20 per minute")
+def enroll():
+    """
+    Enroll a new face
+    Expected JSON:
+    {
+        "employee_id": "123",
+        "photo": "base64_encoded_image",
+        "partition": "company-1" (optional, company/site key),
+        "mode": "replace" (default) or "add" (keep the current templates)
+    }
+    or the same fields as multipart/form-data (photo as a file part), or the
+    photo as an application/octet-stream body with ?employee_id=123
+    """
+    try:
+        data = request_data()
+
+        # Validate input
+        if not data or 'employee_id' not in data or not has_photo(data):
+            return jsonify({
+                'success': False,
+                'error': 'Missing required fields: employee_id, photo'
+            }), 400
+
+        employee_id = str(data['employee_id'])
+        partition = str(data['partition']) if data.get('partition') is not None else None
+        mode = str(data.get('mode') or 'replace').lower()
+
+        if mode not in ('replace', 'add'):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid mode. Allowed: replace, add'
+            }), 400
+
+        # Adding to an employee not yet enrolled is a plain enrollment
+        append = mode == 'add' and employee_id in gallery
+
+        logger.info(f'Enrolling face for employee {employee_id} ({mode})')
+
+        # Decode and detect (a retried upload reuses its cached detection)
+        image_data = get_photo(data)
+        upload_hash = calculate_image_hash(image_data)
+        probe = load_probe(image_data, upload_hash)
+        faces = probe['faces']
+
+        # Validate face count
+        if len(faces) == 0:
+            g.outcome = 'no_face'
+            return jsonify({
+                'success': False,
+                'error': 'No face detected in the image'
+            }), 400
+
+        if len(faces) > 1:
+            g.outcome = 'multiple_faces'
+            return jsonify({
+                'success': False,
+                'error': f'Multiple faces detected ({len(faces)}). Please use a photo with only one face'
+            }), 400
+
+        face = faces[0]
+
+        # Check face size
+        face_region = face['facial_area']
+        face_width = face_region['w']
+        face_height = face_region['h']
+
+        if face_width < Config.MIN_FACE_SIZE or face_height < Config.MIN_FACE_SIZE:
+            g.outcome = 'face_too_small'
+            return jsonify({
+                'success': False,
+                'error': f'Face too small. Minimum size: {Config.MIN_FACE_SIZE}x{Config.MIN_FACE_SIZE} pixels'
+            }), 400
+
+        # Enrollment uses the stricter quality profile
+        quality = check_quality(probe, 'enroll')
+
+        # Create employee directory
+        employee_dir = os.path.join(Config.FACES_DB_PATH, employee_id)
+        os.makedirs(employee_dir, exist_ok=True)
+
+        # Save face image
+        face_filename = f'{employee_id}_face.jpg'
+        face_path = os.path.join(employee_dir, face_filename)
+
+        # Write the gallery image (JPEG uploads are stored untouched); the
+        # atomic replace keeps a re-enrollment from exposing a partial file.
+        # An added template keeps the enrolled image, only its embedding is stored
+        with STAGE_SECONDS.time(stage='write'):
+            face_data = encode_face_image(image_data)
+
+            if not append:
+                with open(f'{face_path}.tmp', 'wb') as f:
+                    f.write(face_data)
+
+                os.replace(f'{face_path}.tmp', face_path)
+
+        # Calculate hash
+        image_hash = calculate_image_hash(face_data)
+
+        # Persist the embedding next to the image and update the gallery
+        embedding = embed_probe(upload_hash, probe)
+
+        with STAGE_SECONDS.time(stage='write'):
+            embedding_path = gallery.enroll(Config.FACES_DB_PATH, employee_id, embedding, image_hash, partition,
+                                            on_change=gallery_changed, append=append)
+
+        # An added template keeps the employee's partition when the request names none
+        partition = gallery.partition_of(employee_id)
+
+        # Cached answers this template could change are no longer valid
+        result_cache.invalidate_enrollment(employee_id, embedding, partition)
+
+        # Get face confidence
+        confidence = face.get('confidence', 0)
+
+        logger.info(f'Face enrolled successfully for employee {employee_id}')
+        g.outcome = 'enrolled'
+
+        return jsonify({
+            'success': True,
+            'employee_id': employee_id,
+            'face_path': face_path,
+            'embedding_path': embedding_path,
+            'partition': partition,
+            'image_hash': image_hash,
+            'mode': mode,
+            'templates': gallery.template_count(employee_id),
+            'quality': quality,
+            'confidence': float(confidence),
+            'facial_area': face_region,
+            'message': 'Face enrolled successfully'
+        }), 200
+
+    except LowQualityFace as e:
+        return quality_response(e)
+
+    except ValueError as e:
+        logger.error(f'Validation error in enroll: {str(e)}')
+        g.outcome = error_outcome(e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    except Exception as e:
+        logger.error(f'Error in enroll: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/enroll/<employee_id>', methods=['DELETE'])
+@limiter.limit("20 per minute")
+def delete_enrollment(employee_id):
+    """
+    Delete an enrollment: the gallery image, its template and the in-memory entry
+
+    Other workers drop the employee on their next request through the
+    gallery journal; nothing is re-indexed.
+    """
+    try:
+        employee_id = str(employee_id)
+
+        if employee_id in ('.', '..'):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid employee_id'
+            }), 400
+
+        with STAGE_SECONDS.time(stage='write'):
+            deleted = gallery.delete(Config.FACES_DB_PATH, employee_id, on_change=gallery_changed)
+
+        if not deleted:
+            g.outcome = 'not_enrolled'
+            return jsonify({
+                'success': False,
+                'error': f'Employee {employee_id} not enrolled'
+            }), 404
+
+        # Cached answers that ranked or verified this employee are no longer valid
+        result_cache.invalidate_removal(employee_id)
+
+        logger.info(f'Face enrollment deleted for employee {employee_id}')
+        g.outcome = 'deleted'
+
+        return jsonify({
+            'success': True,
+            'employee_id': employee_id,
+            'generation': gallery.generation,
+            'message': 'Face enrollment deleted successfully'
+        }), 200
+
+    except Exception as e:
+        logger.error(f'Error in delete enrollment: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/recognize', methods=['POST'])
+@limiter.limit("10 per minute")
+def recognize():
+    """
+    Recognize a face from the database
+    Expected JSON:
+    {
+        "photo": "base64_encoded_image",
+        "threshold": 0.40 (optional),
+        "partition": "company-1" (optional, search only this company/site),
+        "candidates": ["123", "456"] (optional, search only these employees),
+        "top_k": 3 (optional, candidates returned in "matches"),
+        "min_margin": 0.05 (optional, reject if the runner-up is this close),
+        "liveness": true (optional, false skips the anti-spoofing check)
+    }
+    or multipart/form-data / application/octet-stream (other fields in the
+    form or query string; candidates repeated or comma-separated)
+    """
+    try:
+        data = request_data()
+
+        # Validate input
+        if not has_photo(data):
+            return jsonify({
+                'success': False,
+                'error': 'Missing required field: photo'
+            }), 400
+
+        threshold = float(data.get('threshold', Config.get_threshold()))
+        partition, candidates = parse_search_scope(data)
+        top_k, min_margin = parse_top_k(data)
+        check = liveness_requested(data)
+
+        logger.info(f'Recognizing face with threshold {threshold}')
+
+        # Decode image
+        image_data = get_photo(data)
+        image_hash = calculate_image_hash(image_data)
+
+        cache_key = (
+            'recognize', image_hash, Config.MODEL_NAME, Config.DETECTOR_BACKEND, threshold,
+            partition, tuple(candidates) if candidates is not None else None, top_k, min_margin, check
+        )
+        cached = result_cache.get(cache_key)
+
+        if cached is not None:
+            logger.info('Recognition served from cache')
+            g.outcome = recognition_outcome(cached['response'])
+            return cached_response(cached['response'])
+
+        probe = load_probe(image_data, image_hash)
+        liveness_result = None
+
+        # Reject faces that cannot match before the liveness check and the embedding
+        check_quality(probe)
+
+        if check:
+            probe, liveness_result = check_liveness(image_data, image_hash, probe)
+
+        # Embed the probe and search the resident gallery (scoped if requested);
+        # at least two candidates are needed to measure the margin
+        embedding = embed_probe(image_hash, probe)
+        k = max(top_k, 2)
+
+        with STAGE_SECONDS.time(stage='search'):
+            ranked = gallery.search_top_k(embedding, k, partition=partition, candidates=candidates)
+
+        response = recognition_response(ranked, top_k, threshold, min_margin)
+        g.outcome = recognition_outcome(response)
+
+        if liveness_result is not None:
+            response['liveness'] = liveness_result
+
+        result_cache.put_recognition(cache_key, response, embedding, ranked, k, partition, candidates)
+
+        return jsonify(response), 200
+
+    except SpoofDetected as e:
+        return spoof_response(e)
+
+    except LowQualityFace as e:
+        return quality_response(e)
+
+    except ValueError as e:
+        logger.error(f'Validation error in recognize: {str(e)}')
+        g.outcome = error_outcome(e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    except Exception as e:
+        logger.error(f'Error in recognize: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+def recognition_outcome(response):
+    """
+    Metrics outcome of a /recognize response body
+    """
+    if response['recognized']:
+        return 'recognized'
+
+    return 'ambiguous' if 'min_margin' in response else 'not_recognized'
+
+
+def recognition_response(ranked, top_k, threshold, min_margin):
+    """
+    /recognize response body for a ranked (employee_id, distance) list
+    """
+    matches, margin = describe_matches(ranked, top_k)
+
+    # Check if any matches found
+    if not ranked:
+        logger.info('No matching face found')
+        return {
+            'success': True,
+            'recognized': False,
+            'message': 'No matching face found'
+        }
+
+    employee_id, distance = ranked[0]
+
+    # Check if distance is below threshold
+    if distance > threshold:
+        logger.info(f'Match found but distance ({distance}) exceeds threshold ({threshold})')
+        return {
+            'success': True,
+            'recognized': False,
+            'message': 'Face found but similarity too low',
+            'distance': distance,
+            'threshold': threshold,
+            'margin': margin,
+            'matches': matches
+        }
+
+    # Two enrolled faces almost equally close: refuse to pick one
+    if min_margin > 0 and margin is not None and margin < min_margin:
+        logger.info(f'Ambiguous match: margin ({margin}) below minimum ({min_margin})')
+        return {
+            'success': True,
+            'recognized': False,
+            'message': 'Ambiguous match: top candidates are too close',
+            'distance': distance,
+            'threshold': threshold,
+            'margin': margin,
+            'min_margin': min_margin,
+            'matches': matches
+        }
+
+    # Calculate similarity percentage (inverse of distance)
+    similarity = 1 - distance
+
+    logger.info(f'Face recognized: employee {employee_id}, distance {distance}, similarity {similarity}')
+
+    return {
+        'success': True,
+        'recognized': True,
+        'employee_id': employee_id,
+        'distance': distance,
+        'similarity': float(similarity),
+        'threshold': threshold,
+        'margin': margin,
+        'matches': matches,
+        'partition': gallery.partition_of(employee_id) or None,
+        'model': Config.MODEL_NAME,
+        'detector': Config.DETECTOR_BACKEND,
+        'message': 'Face recognized successfully'
+    }
+
+
+@app.route('/recognize/batch', methods=['POST'])
+@limiter.limit("10 per minute")
+def recognize_batch():
+    """
+    Recognize several faces with one batched forward pass
+    Expected JSON:
+    {
+        "photos": [
+            {"photo": "base64_encoded_image", "employee_id": "123" (optional)},
+            ...
+        ],
+        "threshold": 0.40 (optional),
+        "partition": "company-1" (optional),
+        "candidates": ["123", "456"] (optional),
+        "min_margin": 0.05 (optional)
+    }
+    or multipart/form-data with one "photos" file part per photo and,
+    optionally, one "employee_id" field per photo in the same order
+    """
+    try:
+        data = request_data()
+
+        # Uploaded file bytes stay out of the items, so a JSON client can only send "photo"
+        uploads = dict(enumerate(g.photos.get('photos') or []))
+
+        if uploads:
+            expected = request.form.getlist('employee_id')
+            data['photos'] = [
+                {'employee_id': expected[position] if position < len(expected) else None}
+                for position in range(len(uploads))
+            ]
+
+        # Validate input
+        if not data or not isinstance(data.get('photos'), list) or len(data['photos']) == 0:
+            return jsonify({
+                'success': False,
+                'error': 'Missing required field: photos'
+            }), 400
+
+        items = data['photos']
+        threshold = float(data.get('threshold', Config.get_threshold()))
+        partition, candidates = parse_search_scope(data)
+        _, min_margin = parse_top_k(data)
+
+        if len(items) > Config.BATCH_MAX_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f'Too many photos ({len(items)}). Maximum per batch: {Config.BATCH_MAX_SIZE}'
+            }), 400
+
+        logger.info(f'Recognizing batch of {len(items)} photos with threshold {threshold}')
+
+        results = []
+        embeddings = {}
+        pending = []
+
+        # Detection runs per image (retried photos come from the cache);
+        # failures are reported per item
+        for index, item in enumerate(items):
+            result = {'index': index}
+
+            if not isinstance(item, dict) or ('photo' not in item and index not in uploads):
+                result.update({'success': False, 'error': 'Missing required field: photo'})
+                BATCH_ITEMS.inc(outcome='invalid_request')
+                results.append(result)
+                continue
+
+            if item.get('employee_id') is not None:
+                result['expected_employee_id'] = str(item['employee_id'])
+
+            try:
+                image_data = uploads[index] if index in uploads else decode_base64_bytes(item['photo'])
+                image_hash = calculate_image_hash(image_data)
+                probe = load_probe(image_data, image_hash)
+
+                if not probe['faces']:
+                    raise NoFaceDetected('No face detected in the image')
+
+                check_quality(probe)
+
+                if probe['embedding'] is not None:
+                    embeddings[index] = probe['embedding']
+                else:
+                    pending.append((index, image_hash, probe))
+            except LowQualityFace as e:
+                result.update({'success': False, 'error': str(e), 'reason': e.reason, 'quality': e.metrics})
+                BATCH_ITEMS.inc(outcome=e.reason)
+            except (ValueError, OSError) as e:
+                result.update({'success': False, 'error': str(e)})
+                BATCH_ITEMS.inc(outcome=error_outcome(e))
+
+            results.append(result)
+
+        # One forward pass for every uncached crop, one matrix operation for every match
+        with STAGE_SECONDS.time(stage='embed'):
+            computed = embedder.embed([probe['faces'][0] for _, _, probe in pending])
+
+        for (index, image_hash, probe), embedding in zip(pending, computed):
+            embeddings[index] = probe_cache.put_embedding(
+                image_hash, probe['faces'], embedding, probe.get('liveness')
+            )['embedding']
+
+        face_rows = sorted(embeddings)
+
+        with STAGE_SECONDS.time(stage='search'):
+            ranked_lists = gallery.search_top_k_batch(
+                np.vstack([embeddings[index] for index in face_rows]), 2, partition=partition, candidates=candidates
+            ) if face_rows else []
+
+        for index, ranked in zip(face_rows, ranked_lists):
+            result = results[index]
+            result['success'] = True
+
+            if not ranked:
+                result.update({'recognized': False, 'message': 'No matching face found'})
+                BATCH_ITEMS.inc(outcome='not_recognized')
+                continue
+
+            employee_id, distance = ranked[0]
+            _, margin = describe_matches(ranked, 1)
+            ambiguous = min_margin > 0 and margin is not None and margin < min_margin
+            recognized = distance <= threshold and not ambiguous
+
+            result.update({
+                'recognized': bool(recognized),
+                'employee_id': employee_id if recognized else None,
+                'distance': distance,
+                'similarity': float(1 - distance),
+                'threshold': threshold,
+                'margin': margin
+            })
+
+            if ambiguous:
+                result['message'] = 'Ambiguous match: top candidates are too close'
 
+            BATCH_ITEMS.inc(outcome='recognized' if recognized else 'ambiguous' if ambiguous else 'not_recognized')
 
-def cleanup_temp_file(filepath):
-    """
-    Remove temporary file
-    """
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-    except Exception as e:
-        logger.warning(f'Error removing temp file {filepath}: {str(e)}')
+            if 'expected_employee_id' in result:
+                result['matches_expected'] = bool(recognized) and employee_id == result['expected_employee_id']
 
+        recognized_count = sum(1 for result in results if result.get('recognized'))
 
-def calculate_image_hash(filepath):
-    """
-    Calculate SHA-256 hash of image file
-    """
-    try:
-        with open(filepath, 'rb') as f:
-            return hashlib.sha256(f.read()).hexdigest()
-    except Exception as e:
-        logger.error(f'Error calculating image hash: {str(e)}')
-        return None
+        logger.info(f'Batch recognized {recognized_count} of {len(items)} photos')
 
+        return jsonify({
+            'success': True,
+            'results': results,
+            'count': len(items),
+            'recognized_count': recognized_count,
+            'model': Config.MODEL_NAME,
+            'detector': Config.DETECTOR_BACKEND,
+            'message': 'Batch processed successfully'
+        }), 200
 
-@app.route('/health', methods=['GET'])
-def health():
-    """
-    Health check endpoint
-    """
-    return jsonify({
-        'status': 'ok',
-        'service': 'deepface-api',
-        'version': '1.0.0',
-        'model': Config.MODEL_NAME,
-        'detector': Config.DETECTOR_BACKEND,
-        'timestamp': datetime.now().isoformat()
-    }), 200
+    except ValueError as e:
+        logger.error(f'Validation error in recognize_batch: {str(e)}')
+        g.outcome = error_outcome(e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    except Exception as e:
+        logger.error(f'Error in recognize_batch: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
 
 
-@app.route('/enroll', methods=['POST'])
+@app.route('/verify', methods=['POST'])
 @limiter.limit("20 per minute")
-def enroll():
+def verify():
     """
-    Enroll a new face
+    Verify if two faces are the same person
     Expected JSON:
+    {
+        "photo1": "base64_encoded_image",
+        "photo2": "base64_encoded_image"
+    }
+    or, to verify against a stored template:
     {
         "employee_id": "123",
         "photo": "base64_encoded_image"
     }
+    Photos may also be sent as multipart/form-data file parts
     """
     try:
-        data = request.get_json()
+        data = request_data()
+
+        if data and 'employee_id' in data and has_photo(data):
+            return verify_against_template(str(data['employee_id']))
 
         # Validate input
-        if not data or 'employee_id' not in data or 'photo' not in data:
+        if not has_photo(data, 'photo1') or not has_photo(data, 'photo2'):
             return jsonify({
                 'success': False,
-                'error': 'Missing required fields: employee_id, photo'
+                'error': 'Missing required fields: photo1, photo2'
             }), 400
 
-        employee_id = str(data['employee_id'])
-        photo_base64 = data['photo']
-
-        logger.info(f'Enrolling face for employee {employee_id}')
-
-        # Decode image
-        image = decode_base64_image(photo_base64)
-
-        # Save temporary image
-        temp_path = save_temp_image(image, f'enroll_{employee_id}')
-
-        try:
-            # Extract faces using DeepFace
-            faces = DeepFace.extract_faces(
-                img_path=temp_path,
-                detector_backend=Config.DETECTOR_BACKEND,
-                enforce_detection=Config.ENFORCE_DETECTION,
-                align=Config.ALIGN
-            )
-
-            # Validate face count
-            if len(faces) == 0:
-                cleanup_temp_file(temp_path)
-                return jsonify({
-                    'success': False,
-                    'error': 'No face detected in the image'
-                }), 400
-
-            if len(faces) > 1:
-                cleanup_temp_file(temp_path)
-                return jsonify({
-                    'success': False,
-                    'error': f'Multiple faces detected ({len(faces)}). Please use a photo with only one face'
-                }), 400
-
-            face = faces[0]
-
-            # Check face size
-            face_region = face['facial_area']
-            face_width = face_region['w']
-            face_height = face_region['h']
-
-            if face_width < Config.MIN_FACE_SIZE or face_height < Config.MIN_FACE_SIZE:
-                cleanup_temp_file(temp_path)
-                return jsonify({
-                    'success': False,
-                    'error': f'Face too small. Minimum size: {Config.MIN_FACE_SIZE}x{Config.MIN_FACE_SIZE} pixels'
-                }), 400
-
-            # Create employee directory
-            employee_dir = os.path.join(Config.FACES_DB_PATH, employee_id)
-            os.makedirs(employee_dir, exist_ok=True)
-
-            # Save face image
-            face_filename = f'{employee_id}_face.jpg'
-            face_path = os.path.join(employee_dir, face_filename)
-
-            # Copy temp file to employee directory
-            image.save(face_path, 'JPEG', quality=95)
-
-            # Calculate hash
-            image_hash = calculate_image_hash(face_path)
-
-            # Get face confidence
-            confidence = face.get('confidence', 0)
-
-            logger.info(f'Face enrolled successfully for employee {employee_id}')
+        logger.info('Verifying two faces')
 
-            return jsonify({
-                'success': True,
-                'employee_id': employee_id,
-                'face_path': face_path,
-                'image_hash': image_hash,
-                'confidence': float(confidence),
-                'facial_area': face_region,
-                'message': 'Face enrolled successfully'
-            }), 200
+        # Decode images
+        img1, _ = decode_image_array(get_photo(data, 'photo1'))
+        img2, _ = decode_image_array(get_photo(data, 'photo2'))
+
+        # Verify faces
+        with STAGE_SECONDS.time(stage='verify'):
+            if Config.INFERENCE_BACKEND == 'deepface':
+                result = DeepFace.verify(
+                    img1_path=img1,
+                    img2_path=img2,
+                    model_name=Config.MODEL_NAME,
+                    detector_backend=Config.DETECTOR_BACKEND,
+                    distance_metric=Config.DISTANCE_METRIC,
+                    enforce_detection=Config.ENFORCE_DETECTION,
+                    align=Config.ALIGN
+                )
+            else:
+                result = verify_pair(img1, img2)
+
+        verified = result['verified']
+        distance = result['distance']
+        g.outcome = 'verified' if verified else 'not_verified'
+        threshold = result['threshold']
+
+        similarity = 1 - distance
+
+        logger.info(f'Verification result: {verified}, distance: {distance}')
 
-        finally:
-            cleanup_temp_file(temp_path)
+        return jsonify({
+            'success': True,
+            'verified': bool(verified),
+            'distance': float(distance),
+            'similarity': float(similarity),
+            'threshold': float(threshold),
+            'model': Config.MODEL_NAME,
+            'message': 'Faces verified successfully'
+        }), 200
 
     except ValueError as e:
-        logger.error(f'Validation error in enroll: {str(e)}')
+        logger.error(f'Validation error in verify: {str(e)}')
+        g.outcome = error_outcome(e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
 
     except Exception as e:
-        logger.error(f'Error in enroll: {str(e)}')
+        logger.error(f'Error in verify: {str(e)}')
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
 
-@app.route('/recognize', methods=['POST'])
-@limiter.limit("10 per minute")
-def recognize():
+@app.route('/verify/<employee_id>', methods=['POST'])
+@limiter.limit("20 per minute")
+def verify_employee(employee_id):
     """
-    Recognize a face from the database
+    Verify a face against the stored template of one employee (1:1)
     Expected JSON:
     {
         "photo": "base64_encoded_image",
-        "threshold": 0.40 (optional)
+        "threshold": 0.40 (optional),
+        "liveness": true (optional, false skips the anti-spoofing check)
     }
+    or multipart/form-data / application/octet-stream (?threshold=0.40)
+    """
+    return verify_against_template(employee_id)
+
+
+def verify_against_template(employee_id):
+    """
+    Body of the 1:1 verification, shared by /verify/<employee_id> and /verify
+    with an employee_id (a plain function, so the rate limit counts once)
     """
     try:
-        data = request.get_json()
+        data = request_data()
 
         # Validate input
-        if not data or 'photo' not in data:
+        if not has_photo(data):
             return jsonify({
                 'success': False,
                 'error': 'Missing required field: photo'
             }), 400
 
-        photo_base64 = data['photo']
         threshold = float(data.get('threshold', Config.get_threshold()))
+        check = liveness_requested(data)
 
-        logger.info(f'Recognizing face with threshold {threshold}')
+        templates = gallery.templates(employee_id)
+
+        if templates is None:
+            g.outcome = 'not_enrolled'
+            return jsonify({
+                'success': False,
+                'error': f'Employee {employee_id} has no enrolled face'
+            }), 404
+
+        logger.info(f'Verifying face against template of employee {employee_id}')
 
         # Decode image
-        image = decode_base64_image(photo_base64)
+        image_data = get_photo(data)
+        image_hash = calculate_image_hash(image_data)
 
-        # Save temporary image
-        temp_path = save_temp_image(image, 'recognize')
+        cache_key = ('verify', image_hash, Config.MODEL_NAME, Config.DETECTOR_BACKEND, threshold, employee_id, check)
+        cached = result_cache.get(cache_key)
 
-        try:
-            # Find matching faces
-            result = DeepFace.find(
-                img_path=temp_path,
-                db_path=Config.FACES_DB_PATH,
-                model_name=Config.MODEL_NAME,
-                detector_backend=Config.DETECTOR_BACKEND,
-                distance_metric=Config.DISTANCE_METRIC,
-                enforce_detection=Config.ENFORCE_DETECTION,
-                align=Config.ALIGN,
-                silent=True
-            )
-
-            # Check if any matches found
-            if result is None or len(result) == 0 or len(result[0]) == 0:
-                logger.info('No matching face found')
-                return jsonify({
-                    'success': True,
-                    'recognized': False,
-                    'message': 'No matching face found'
-                }), 200
-
-            # Get the best match (first result)
-            matches = result[0]
-            best_match = matches.iloc[0]
-
-            distance = float(best_match['distance'])
-            identity = best_match['identity']
-
-            # Check if distance is below threshold
-            if distance > threshold:
-                logger.info(f'Match found but distance ({distance}) exceeds threshold ({threshold})')
-                return jsonify({
-                    'success': True,
-                    'recognized': False,
-                    'message': 'Face found but similarity too low',
-                    'distance': distance,
-                    'threshold': threshold
-                }), 200
-
-            # Extract employee_id from identity path
-            # Format: ../storage/faces/employee_id/employee_id_face.jpg
-            employee_id = os.path.basename(os.path.dirname(identity))
-
-            # Calculate similarity percentage (inverse of distance)
-            similarity = 1 - distance
-
-            logger.info(f'Face recognized: employee {employee_id}, distance {distance}, similarity {similarity}')
+        if cached is not None:
+            logger.info('Verification served from cache')
+            g.outcome = 'verified' if cached['response']['verified'] else 'not_verified'
+            return cached_response(cached['response'])
 
-            return jsonify({
-                'success': True,
-                'recognized': True,
-                'employee_id': employee_id,
-                'distance': distance,
-                'similarity': float(similarity),
-                'threshold': threshold,
-                'model': Config.MODEL_NAME,
-                'detector': Config.DETECTOR_BACKEND,
-                'message': 'Face recognized successfully'
-            }), 200
+        probe = load_probe(image_data, image_hash)
+        liveness_result = None
+        check_quality(probe)
+
+        if check:
+            probe, liveness_result = check_liveness(image_data, image_hash, probe)
+
+        # Only the probe is embedded; the templates are already in memory and
+        # the closest one decides
+        embedding = np.asarray(embed_probe(image_hash, probe), dtype=np.float32)
+
+        with STAGE_SECONDS.time(stage='search'):
+            distance = float(compute_distances(templates, embedding, Config.DISTANCE_METRIC).min())
 
-        finally:
-            cleanup_temp_file(temp_path)
+        verified = distance <= threshold
+        g.outcome = 'verified' if verified else 'not_verified'
+        similarity = 1 - distance
+
+        logger.info(f'Verification result for employee {employee_id}: {verified}, distance: {distance}')
+
+        response = {
+            'success': True,
+            'verified': bool(verified),
+            'employee_id': employee_id,
+            'distance': distance,
+            'similarity': float(similarity),
+            'threshold': threshold,
+            'model': Config.MODEL_NAME,
+            'message': 'Face verified successfully'
+        }
+
+        if liveness_result is not None:
+            response['liveness'] = liveness_result
+
+        result_cache.put_verification(cache_key, response, employee_id)
+
+        return jsonify(response), 200
+
+    except SpoofDetected as e:
+        return spoof_response(e)
+
+    except LowQualityFace as e:
+        return quality_response(e)
 
     except ValueError as e:
-        logger.error(f'Validation error in recognize: {str(e)}')
+        logger.error(f'Validation error in verify_employee: {str(e)}')
+        g.outcome = error_outcome(e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
 
     except Exception as e:
-        logger.error(f'Error in recognize: {str(e)}')
+        logger.error(f'Error in verify_employee: {str(e)}')
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
 
-@app.route('/verify', methods=['POST'])
+@app.route('/analyze', methods=['POST'])
 @limiter.limit("20 per minute")
-def verify():
+def analyze():
     """
-    Verify if two faces are the same person
+    Analyze face attributes (age, gender, emotion, race)
     Expected JSON:
     {
-        "photo1": "base64_encoded_image",
-        "photo2": "base64_encoded_image"
+        "photo": "base64_encoded_image",
+        "actions": ["age", "gender"] (optional, default ANALYZE_DEFAULT_ACTIONS)
     }
+    or the photo as multipart/form-data or an application/octet-stream body
+    (?actions=age,gender)
     """
     try:
-        data = request.get_json()
+        data = request_data()
 
         # Validate input
-        if not data or 'photo1' not in data or 'photo2' not in data:
+        if not has_photo(data):
             return jsonify({
                 'success': False,
-                'error': 'Missing required fields: photo1, photo2'
+                'error': 'Missing required field: photo'
             }), 400
 
-        photo1_base64 = data['photo1']
-        photo2_base64 = data['photo2']
-
-        logger.info('Verifying two faces')
-
-        # Decode images
-        image1 = decode_base64_image(photo1_base64)
-        image2 = decode_base64_image(photo2_base64)
-
-        # Save temporary images
-        temp_path1 = save_temp_image(image1, 'verify1')
-        temp_path2 = save_temp_image(image2, 'verify2')
+        actions = parse_actions(data.get('actions'))
 
-        try:
-            # Verify faces
-            result = DeepFace.verify(
-                img1_path=temp_path1,
-                img2_path=temp_path2,
-                model_name=Config.MODEL_NAME,
-                detector_backend=Config.DETECTOR_BACKEND,
-                distance_metric=Config.DISTANCE_METRIC,
-                enforce_detection=Config.ENFORCE_DETECTION,
-                align=Config.ALIGN
-            )
+        logger.info(f'Analyzing face attributes: {", ".join(actions)}')
 
-            verified = result['verified']
-            distance = result['distance']
-            threshold = result['threshold']
+        # Decode and detect once (shared with /recognize through the probe cache)
+        image_data = get_photo(data)
+        image_hash = calculate_image_hash(image_data)
+        faces = load_probe(image_data, image_hash, crops=True)['faces']
 
-            similarity = 1 - distance
+        if not faces:
+            raise NoFaceDetected('No face detected in the image')
 
-            logger.info(f'Verification result: {verified}, distance: {distance}')
+        # Analyze the first face
+        result = {
+            **analyze_face_crop(faces[0], actions),
+            'actions': actions,
+            'facial_area': faces[0]['facial_area']
+        }
 
-            return jsonify({
-                'success': True,
-                'verified': bool(verified),
-                'distance': float(distance),
-                'similarity': float(similarity),
-                'threshold': float(threshold),
-                'model': Config.MODEL_NAME,
-                'message': 'Faces verified successfully'
-            }), 200
+        logger.info(f'Face analyzed: {result}')
 
-        finally:
-            cleanup_temp_file(temp_path1)
-            cleanup_temp_file(temp_path2)
+        return jsonify({
+            'success': True,
+            **result,
+            'message': 'Face analyzed successfully'
+        }), 200
 
     except ValueError as e:
-        logger.error(f'Validation error in verify: {str(e)}')
+        logger.error(f'Validation error in analyze: {str(e)}')
+        g.outcome = error_outcome(e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
 
     except Exception as e:
-        logger.error(f'Error in verify: {str(e)}')
+        logger.error(f'Error in analyze: {str(e)}')
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
 
-@app.route('/analyze', methods=['POST'])
-@limiter.limit("20 per minute")
-def analyze():
+attribute_models = AttributeModels(
+    idle_seconds=Config.ATTRIBUTE_MODEL_IDLE_SECONDS,
+    memory_limit_mb=Config.ATTRIBUTE_MEMORY_LIMIT_MB
+)
+
+
+def analyze_face_crop(face, actions):
     """
-    Analyze face attributes (age, gender, emotion, race)
+    Attribute analysis of an already detected and aligned face, without detecting again
+
+    Only the models of the requested actions are built (on first use) and run.
+    """
+    # Crops are RGB in [0, 1]; analyze expects a BGR image
+    crop = np.ascontiguousarray(face['face'][:, :, ::-1] * 255).astype(np.uint8)
+
+    attribute_models.ensure_loaded(actions)
+
+    with STAGE_SECONDS.time(stage='analyze'):
+        analysis = DeepFace.analyze(
+            img_path=crop,
+            actions=actions,
+            detector_backend='skip',
+            enforce_detection=False,
+            silent=True
+        )
+
+    attribute_models.release(keep=actions)
+
+    return describe_analysis(analysis[0] if isinstance(analysis, list) else analysis, actions)
+
+
+def requested_actions(value):
+    """
+    Analyze actions asked for by a /punch request: None, true (default actions) or a list
+    """
+    if value is None or str(value).lower() in ('false', '0', ''):
+        return None
+
+    return parse_actions(None if str(value).lower() in ('true', '1') else value)
+
+
+def face_quality_report(faces, profile='verify'):
+    """
+    Quality checks of a punch photo: (report, rejection reason or None)
+    """
+    report = {'faces': len(faces)}
+
+    if not faces:
+        return report, 'no_face'
+
+    if len(faces) > 1:
+        return report, 'multiple_faces'
+
+    area = faces[0]['facial_area']
+    report.update({
+        'face_width': area['w'],
+        'face_height': area['h'],
+        'min_face_size': Config.MIN_FACE_SIZE,
+        'confidence': float(faces[0].get('confidence') or 0)
+    })
+
+    if area['w'] < Config.MIN_FACE_SIZE or area['h'] < Config.MIN_FACE_SIZE:
+        return report, 'face_too_small'
+
+    # Sharpness, exposure and pose of the crop (confidence is already reported)
+    metrics, rejection = quality_gate.assess(faces[0], profile)
+    report.update({key: value for key, value in metrics.items() if key != 'confidence'})
+
+    return report, rejection
+
+
+QUALITY_ERRORS = {
+    'no_face': 'No face detected in the image',
+    'multiple_faces': 'Multiple faces detected. Please use a photo with only one face',
+    'face_too_small': f'Face too small. Minimum size: {Config.MIN_FACE_SIZE}x{Config.MIN_FACE_SIZE} pixels',
+    **REASONS
+}
+
+
+@app.route('/punch', methods=['POST'])
+@limiter.limit("10 per minute")
+def punch():
+    """
+    Everything a facial punch needs from one decode and one detection
     Expected JSON:
     {
-        "photo": "base64_encoded_image"
+        "photo": "base64_encoded_image",
+        "employee_id": "123" (optional, verify 1:1 instead of searching),
+        "threshold": 0.40 (optional),
+        "partition": "company-1" (optional),
+        "candidates": ["123", "456"] (optional),
+        "top_k": 3 (optional),
+        "min_margin": 0.05 (optional),
+        "analyze": false (optional, true or a list of actions such as ["age"]),
+        "liveness": true (optional, false skips the anti-spoofing check)
     }
+    or multipart/form-data / application/octet-stream (other fields in the
+    form or query string)
     """
     try:
-        data = request.get_json()
+        data = request_data()
 
         # Validate input
-        if not data or 'photo' not in data:
+        if not has_photo(data):
             return jsonify({
                 'success': False,
                 'error': 'Missing required field: photo'
             }), 400
 
-        photo_base64 = data['photo']
+        threshold = float(data.get('threshold', Config.get_threshold()))
+        partition, candidates = parse_search_scope(data)
+        top_k, min_margin = parse_top_k(data)
+        employee_id = str(data['employee_id']) if data.get('employee_id') is not None else None
+        actions = requested_actions(data.get('analyze'))
+        check = liveness_requested(data)
+
+        if employee_id is not None and gallery.get(employee_id) is None:
+            g.outcome = 'not_enrolled'
+            return jsonify({
+                'success': False,
+                'error': f'Employee {employee_id} has no enrolled face'
+            }), 404
+
+        # Decode and detect once; every later stage reuses this crop
+        image_data = get_photo(data)
+        image_hash = calculate_image_hash(image_data)
+        probe = load_probe(image_data, image_hash, crops=actions is not None)
+        faces = probe['faces']
+
+        quality, rejection = face_quality_report(faces)
+
+        if rejection is not None:
+            g.outcome = rejection
+            return jsonify({
+                'success': False,
+                'error': QUALITY_ERRORS[rejection],
+                'reason': rejection,
+                'quality': quality
+            }), 400
+
+        liveness_result = None
 
-        logger.info('Analyzing face attributes')
+        # Reject spoofs before paying for the embedding
+        if check:
+            probe, liveness_result = check_liveness(image_data, image_hash, probe)
+            faces = probe['faces']
 
-        # Decode image
-        image = decode_base64_image(photo_base64)
+        embedding = np.asarray(embed_probe(image_hash, probe), dtype=np.float32)
 
-        # Save temporary image
-        temp_path = save_temp_image(image, 'analyze')
+        if employee_id is not None:
+            templates = gallery.templates(employee_id)
 
-        try:
-            # Analyze face
-            analysis = DeepFace.analyze(
-                img_path=temp_path,
-                actions=['age', 'gender', 'emotion', 'race'],
-                detector_backend=Config.DETECTOR_BACKEND,
-                enforce_detection=Config.ENFORCE_DETECTION,
-                silent=True
-            )
-
-            # Extract results (first face)
-            if isinstance(analysis, list):
-                analysis = analysis[0]
-
-            result = {
-                'age': int(analysis['age']),
-                'gender': analysis['dominant_gender'],
-                'emotion': analysis['dominant_emotion'],
-                'race': analysis['dominant_race'],
-                'facial_area': analysis['region']
+            with STAGE_SECONDS.time(stage='search'):
+                distance = float(compute_distances(templates, embedding, Config.DISTANCE_METRIC).min())
+
+            verified = distance <= threshold
+            g.outcome = 'verified' if verified else 'not_verified'
+            response = {
+                'success': True,
+                'recognized': bool(verified),
+                'verified': bool(verified),
+                'employee_id': employee_id,
+                'distance': distance,
+                'similarity': float(1 - distance),
+                'threshold': threshold,
+                'message': 'Face verified successfully' if verified else 'Face does not match the employee'
             }
+        else:
+            k = max(top_k, 2)
 
-            logger.info(f'Face analyzed: {result}')
+            with STAGE_SECONDS.time(stage='search'):
+                ranked = gallery.search_top_k(embedding, k, partition=partition, candidates=candidates)
 
-            return jsonify({
-                'success': True,
-                **result,
-                'message': 'Face analyzed successfully'
-            }), 200
+            response = recognition_response(ranked, top_k, threshold, min_margin)
+            g.outcome = recognition_outcome(response)
+
+        response.update({
+            'facial_area': faces[0]['facial_area'],
+            'quality': quality,
+            'liveness': liveness_result,
+            'image_hash': image_hash,
+            'model': Config.MODEL_NAME
+        })
 
-        finally:
-            cleanup_temp_file(temp_path)
+        if actions is not None:
+            response['analysis'] = analyze_face_crop(faces[0], actions)
+
+        return jsonify(response), 200
+
+    except SpoofDetected as e:
+        return spoof_response(e)
 
     except ValueError as e:
-        logger.error(f'Validation error in analyze: {str(e)}')
+        logger.error(f'Validation error in punch: {str(e)}')
+        g.outcome = error_outcome(e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
 
     except Exception as e:
-        logger.error(f'Error in analyze: {str(e)}')
+        logger.error(f'Error in punch: {str(e)}')
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
 
+def stream_detect(frame):
+    """
+    Faces of one kiosk frame, found by the cheap stream detector
+    """
+    with STAGE_SECONDS.time(stage='stream_decode'):
+        img, scale = prepare_image(frame, Config.STREAM_MAX_SIDE)
+
+    with STAGE_SECONDS.time(stage='stream_detect'):
+        try:
+            faces = detect_faces(img, enforce_detection=True, detector_backend=Config.STREAM_DETECTOR_BACKEND)
+        except NoFaceDetected:
+            return []
+
+    return map_faces(faces, scale)
+
+
+def stream_recognizer(settings):
+    """
+    Recognition callback of a stream session: one forward pass and one search for all faces
+    """
+    threshold = float(settings.get('threshold', Config.get_threshold()))
+    partition, candidates = parse_search_scope(settings)
+    _, min_margin = parse_top_k(settings)
+
+    def recognize(faces):
+        with STAGE_SECONDS.time(stage='embed'):
+            embeddings = embedder.embed(faces)
+
+        # A stream outlives many enrollments; follow them like a request would
+        gallery.sync(gallery_changed)
+
+        with STAGE_SECONDS.time(stage='search'):
+            ranked_lists = gallery.search_top_k_batch(embeddings, 2, partition=partition, candidates=candidates)
+
+        results = []
+
+        for ranked in ranked_lists:
+            response = recognition_response(ranked, 1, threshold, min_margin)
+            results.append({key: value for key, value in response.items() if key not in ('success', 'matches')})
+
+        return results
+
+    return recognize
+
+
+def stream_screen(settings):
+    """
+    Screen callback of a stream session: the checks a /recognize probe goes through
+
+    A crop that fails the verify quality profile, or the liveness check
+    when it is requested, is reported as not recognized instead of embedded.
+    """
+    check_live = liveness_requested(settings)
+
+    def screen(face):
+        metrics, reason = quality_gate.assess(quality_gate.measure([face])[0], 'verify')
+
+        if reason is not None:
+            return {'recognized': False, 'reason': reason, 'quality': metrics}
+
+        if check_live:
+            with STAGE_SECONDS.time(stage='liveness'):
+                result = liveness.check(face['face'])
+
+            if not result['live']:
+                logger.warning(f'Spoof detected in stream: {result}')
+                return {'recognized': False, 'reason': 'spoof_detected', 'liveness': result}
+
+        return None
+
+    return screen
+
+
+def open_stream_session(settings):
+    return StreamSession(
+        stream_detect,
+        stream_recognizer(settings),
+        iou_threshold=Config.STREAM_IOU_THRESHOLD,
+        max_missed=Config.STREAM_MAX_MISSED_FRAMES,
+        min_quality_gain=Config.STREAM_MIN_QUALITY_GAIN,
+        max_embeds_per_track=Config.STREAM_MAX_EMBEDS_PER_TRACK,
+        screen=stream_screen(settings)
+    )
+
+
+def read_stream_message(message):
+    """
+    (frame bytes or None, settings dict or None) of a WebSocket message
+
+    Binary messages are frames; text messages are JSON with settings
+    (threshold, partition, candidates, min_margin) and/or a base64 "frame".
+    """
+    if isinstance(message, (bytes, bytearray)):
+        return bytes(message), None
+
+    data = json.loads(message)
+
+    if not isinstance(data, dict):
+        raise ValueError('Stream messages must be JSON objects')
+
+    frame = data.pop('frame', None)
+
+    return (decode_base64_bytes(frame) if frame is not None else None), (data or None)
+
+
+def send_stream_events(ws, events):
+    for event in events:
+        STREAM_EVENTS.inc(event=event['event'])
+        ws.send(json.dumps(event))
+
+
+open_streams = set()
+
+
+def stream(ws):
+    """
+    Serve one kiosk connection until it closes
+
+    A frame is skipped when a newer one is already waiting, so a slow CPU
+    falls behind by dropping frames instead of queueing latency.
+    """
+    g.websocket = True
+    g.outcome = 'closed'
+    session = open_stream_session({})
+    open_streams.add(ws)
+
+    try:
+        serve_stream(ws, session)
+    finally:
+        open_streams.discard(ws)
+
+
+def serve_stream(ws, session):
+    """
+    Receive loop of a kiosk connection: settings messages and frames
+    """
+    message = ws.receive()
+
+    while message is not None:
+        newer = ws.receive(timeout=0)
+
+        if newer is not None and isinstance(message, (bytes, bytearray)) and isinstance(newer, (bytes, bytearray)):
+            STREAM_FRAMES.inc(outcome='dropped')
+            message = newer
+            continue
+
+        try:
+            frame, settings = read_stream_message(message)
+
+            if settings:
+                session = open_stream_session(settings)
+                send_stream_events(ws, [{'event': 'configured', **settings}])
+
+            if frame is not None:
+                with STAGE_SECONDS.time(stage='stream_frame'):
+                    events = session.process_frame(frame)
+                STREAM_FRAMES.inc(outcome='processed')
+                send_stream_events(ws, events)
+        except ValueError as e:
+            STREAM_FRAMES.inc(outcome='error')
+            send_stream_events(ws, [{'event': 'error', 'error': str(e)}])
+
+        message = newer if newer is not None else ws.receive()
+
+
+metrics.gauge('deepface_stream_sessions', 'Open /stream connections', callback=lambda: len(open_streams))
+
+if Sock is not None and Config.STREAM_ENABLED:
+    app.config['SOCK_SERVER_OPTIONS'] = {'max_message_size': Config.MAX_FILE_SIZE, 'ping_interval': 25}
+    Sock(app).route('/stream')(stream)
+
+
 @app.errorhandler(429)
 def ratelimit_error(e):
     """Rate limit exceeded handler"""
@@ -541,6 +1873,15 @@ def ratelimit_error(e):
     }), 429
 
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Upload over MAX_FILE_SIZE handler"""
+    return jsonify({
+        'success': False,
+        'error': e.description
+    }), 413
+
+
 @app.errorhandler(404)
 def not_found(e):
     """404 handler"""
@@ -565,6 +1906,10 @@ if __name__ == '__main__':
     logger.info(f'Model: {Config.MODEL_NAME}, Detector: {Config.DETECTOR_BACKEND}')
     logger.info(f'Faces DB: {Config.FACES_DB_PATH}')
 
+    # Under gunicorn the warm-up runs in each worker (post_fork), never in the master
+    if Config.PRELOAD_MODELS and Config.WARMUP_ENABLED:
+        warmup()
+
     app.run(
         host=Config.HOST,
         port=Config.PORT,
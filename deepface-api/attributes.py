@@ -0,0 +1,185 @@
+"""
+Attributes - Lazily loaded facial attribute models for /analyze
+Sistema de Ponto Eletrônico Brasileiro
+
+Age, gender, emotion and race are four separate CNNs. Each one is built
+the first time a request asks for its action, so a worker that never
+serves /analyze never holds their weights, and none of them is built
+before gunicorn forks. Models idle for ATTRIBUTE_MODEL_IDLE_SECONDS, or
+the least recently used ones while the process is above
+ATTRIBUTE_MEMORY_LIMIT_MB, are dropped from DeepFace's model registry and
+rebuilt on their next use.
+"""
+
+import gc
+import os
+import time
+import logging
+import threading
+
+from deepface import DeepFace
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# DeepFace model name of each analyze action
+ACTION_MODELS = {
+    'age': 'Age',
+    'gender': 'Gender',
+    'emotion': 'Emotion',
+    'race': 'Race'
+}
+
+
+def parse_actions(value, default=None):
+    """
+    Validated list of analyze actions from a list or a comma-separated string
+    """
+    if value is None or value == '' or value is True:
+        value = default if default is not None else Config.ANALYZE_DEFAULT_ACTIONS
+
+    if isinstance(value, str):
+        value = value.split(',')
+
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f'actions must be a list of: {", ".join(ACTION_MODELS)}')
+
+    actions = []
+
+    for action in value:
+        action = str(action).strip().lower()
+
+        if action not in ACTION_MODELS:
+            raise ValueError(f'Invalid action: {action}. Allowed: {", ".join(ACTION_MODELS)}')
+
+        if action not in actions:
+            actions.append(action)
+
+    if not actions:
+        raise ValueError(f'At least one action is required: {", ".join(ACTION_MODELS)}')
+
+    return actions
+
+
+def process_rss_mb():
+    """
+    Resident memory of this process in MB (Linux), or None
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _registry():
+    """
+    DeepFace's built-model cache (absent until the first model is built)
+    """
+    from deepface.modules import modeling
+    return getattr(modeling, 'model_obj', {})
+
+
+class AttributeModels:
+    """
+    Tracks which attribute models this process holds and releases them when asked
+    """
+
+    def __init__(self, idle_seconds=0, memory_limit_mb=0):
+        self.idle_seconds = idle_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {'loads': {}, 'unloads': {}}
+
+    def ensure_loaded(self, actions):
+        """
+        Build the models of these actions once (serialized, so concurrent first calls build once)
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            for action in actions:
+                name = ACTION_MODELS[action]
+
+                if name not in _registry():
+                    start = time.perf_counter()
+                    DeepFace.build_model(name)
+                    logger.info(f'Attribute model {name} loaded in {time.perf_counter() - start:.2f}s')
+                    self._stats['loads'][action] = self._stats['loads'].get(action, 0) + 1
+
+                self._last_used[action] = now
+
+    def _unload(self, action, reason):
+        name = ACTION_MODELS[action]
+
+        if _registry().pop(name, None) is not None:
+            self._stats['unloads'][action] = self._stats['unloads'].get(action, 0) + 1
+            logger.info(f'Attribute model {name} unloaded ({reason})')
+
+        self._last_used.pop(action, None)
+
+    def release(self, keep=()):
+        """
+        Unload idle models, then least recently used ones while over the memory limit
+
+        Models in keep (those the current request uses) are never unloaded.
+        """
+        released = False
+
+        with self._lock:
+            now = time.monotonic()
+
+            if self.idle_seconds:
+                for action, last_used in list(self._last_used.items()):
+                    if action not in keep and now - last_used > self.idle_seconds:
+                        self._unload(action, 'idle')
+                        released = True
+
+            if self.memory_limit_mb:
+                for action in sorted(self._last_used, key=self._last_used.get):
+                    rss = process_rss_mb()
+
+                    if rss is None or rss <= self.memory_limit_mb:
+                        break
+
+                    if action not in keep:
+                        self._unload(action, f'memory {rss:.0f}MB > {self.memory_limit_mb}MB')
+                        gc.collect()
+
+        if released:
+            gc.collect()
+
+    def loaded(self):
+        """
+        Actions whose model is currently held by this process
+        """
+        registry = _registry()
+        return [action for action, name in ACTION_MODELS.items() if name in registry]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self.loaded(),
+                'loads': dict(self._stats['loads']),
+                'unloads': dict(self._stats['unloads'])
+            }
+
+
+def describe_analysis(analysis, actions):
+    """
+    Dominant value of each requested attribute from one DeepFace.analyze result
+    """
+    result = {}
+
+    if 'age' in actions:
+        result['age'] = int(analysis['age'])
+
+    for action in ('gender', 'emotion', 'race'):
+        if action in actions:
+            result[action] = analysis[f'dominant_{action}']
+
+    return result
@@ -0,0 +1,230 @@
+"""
+Micro-batching - Dynamic batching of concurrent inference requests
+Sistema de Ponto Eletrônico Brasileiro
+
+Request threads hand their face crops to a single inference thread, which
+waits a few milliseconds for other requests, runs them as one batched
+forward pass and fans the embeddings back out to each caller. No forward
+pass holds more than max_batch_size faces: a request that would overflow
+the batch waits for the next one, and a request larger than the cap on
+its own is embedded in several passes.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# Upper bounds in seconds of the queue time histogram buckets
+QUEUE_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class _PendingRequest:
+    """
+    Faces submitted by one caller, waiting for their embeddings
+    """
+
+    def __init__(self, faces):
+        self.faces = faces
+        self.submitted_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Collects concurrent embedding requests into batched forward passes
+    """
+
+    def __init__(self, embed_func, max_batch_size=16, max_wait_ms=5, enabled=True, batch_histogram=None,
+                 queue_histogram=None):
+        self.embed_func = embed_func
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.enabled = enabled
+
+        # Optional metrics Histograms observing faces per forward pass and seconds each request queued
+        self.batch_histogram = batch_histogram
+        self.queue_histogram = queue_histogram
+
+        self._pid = None
+        self._queue = None
+        self._held = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {
+            'batches': 0,
+            'requests': 0,
+            'faces': 0,
+            'max_batch_faces': 0,
+            'queue_seconds_total': 0.0,
+            'queue_seconds_max': 0.0,
+            'batch_size_histogram': {str(bucket): 0 for bucket in BATCH_SIZE_BUCKETS},
+            'queue_seconds_histogram': {str(bucket): 0 for bucket in QUEUE_SECONDS_BUCKETS},
+        }
+        self._stats['batch_size_histogram']['+Inf'] = 0
+        self._stats['queue_seconds_histogram']['+Inf'] = 0
+
+    def _ensure_worker(self):
+        """
+        Start the inference thread lazily, once per process
+
+        Threads do not survive fork, so a gunicorn worker that inherited a
+        batcher from the master starts its own thread on first use.
+        """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._held = None
+            self._reset_stats()
+            self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+            self._thread.start()
+
+    def embed(self, faces):
+        """
+        Embed faces, sharing a forward pass with concurrent callers
+
+        Blocks until this caller's embeddings are ready.
+        """
+        if not faces:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        if not self.enabled:
+            return self.embed_func(faces)
+
+        self._ensure_worker()
+
+        pending = _PendingRequest(faces)
+        self._queue.put(pending)
+        pending.done.wait()
+
+        if pending.error is not None:
+            raise pending.error
+
+        return pending.result
+
+    def _collect(self):
+        """
+        Wait for the first request, then gather more until the batch is full
+        or the oldest request has waited max_wait (queued requests join while
+        they fit; the first one that does not opens the next batch)
+        """
+        first, self._held = (self._held, None) if self._held is not None else (self._queue.get(), None)
+        batch = [first]
+        size = len(first.faces)
+        deadline = first.submitted_at + self.max_wait
+
+        while size < self.max_batch_size:
+            try:
+                # Requests already queued join without waiting
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.perf_counter()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if size + len(pending.faces) > self.max_batch_size:
+                self._held = pending
+                break
+
+            batch.append(pending)
+            size += len(pending.faces)
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started_at = time.perf_counter()
+            faces = [face for pending in batch for face in pending.faces]
+
+            # Only a single request larger than the cap needs more than one pass
+            passes = [faces[start:start + self.max_batch_size] for start in range(0, len(faces), self.max_batch_size)]
+
+            try:
+                embeddings = [self.embed_func(chunk) for chunk in passes]
+                embeddings = embeddings[0] if len(embeddings) == 1 else np.vstack(embeddings)
+                offset = 0
+
+                for pending in batch:
+                    pending.result = embeddings[offset:offset + len(pending.faces)]
+                    offset += len(pending.faces)
+            except Exception as e:
+                logger.error(f'Batched inference failed for {len(faces)} faces: {str(e)}')
+
+                for pending in batch:
+                    pending.error = e
+
+            self._record(batch, [len(chunk) for chunk in passes], started_at)
+
+            for pending in batch:
+                pending.done.set()
+
+    def _record(self, batch, pass_sizes, started_at):
+        queue_times = [started_at - pending.submitted_at for pending in batch]
+
+        with self._stats_lock:
+            self._stats['batches'] += len(pass_sizes)
+            self._stats['requests'] += len(batch)
+            self._stats['faces'] += sum(pass_sizes)
+            self._stats['max_batch_faces'] = max(self._stats['max_batch_faces'], max(pass_sizes))
+            self._stats['queue_seconds_total'] += sum(queue_times)
+            self._stats['queue_seconds_max'] = max(self._stats['queue_seconds_max'], max(queue_times))
+
+            for face_count in pass_sizes:
+                bucket = next((str(b) for b in BATCH_SIZE_BUCKETS if face_count <= b), '+Inf')
+                self._stats['batch_size_histogram'][bucket] += 1
+
+            for queue_time in queue_times:
+                bucket = next((str(b) for b in QUEUE_SECONDS_BUCKETS if queue_time <= b), '+Inf')
+                self._stats['queue_seconds_histogram'][bucket] += 1
+
+        if self.batch_histogram is not None:
+            for face_count in pass_sizes:
+                self.batch_histogram.observe(face_count)
+
+        if self.queue_histogram is not None:
+            for queue_time in queue_times:
+                self.queue_histogram.observe(queue_time)
+
+    def stats(self):
+        """
+        Batch size and queue time metrics for this process
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['batch_size_histogram'] = dict(self._stats['batch_size_histogram'])
+            stats['queue_seconds_histogram'] = dict(self._stats['queue_seconds_histogram'])
+
+        stats['enabled'] = self.enabled
+        stats['max_batch_size'] = self.max_batch_size
+        stats['max_wait_ms'] = self.max_wait * 1000
+        stats['avg_batch_faces'] = stats['faces'] / stats['batches'] if stats['batches'] else 0.0
+        stats['avg_queue_seconds'] = stats['queue_seconds_total'] / stats['requests'] if stats['requests'] else 0.0
+
+        return stats
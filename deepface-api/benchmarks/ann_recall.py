@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+ANN Recall Benchmark - IVF index against exact search
+Sistema de Ponto Eletrônico Brasileiro
+
+Builds a synthetic clustered gallery, queries it with noisy copies of
+enrolled embeddings and reports recall@1 / recall@k of IVFIndex against
+BruteForceIndex, with per-query latency, for several n_probe values.
+
+Usage:
+    python benchmarks/ann_recall.py --size 20000 --dim 512 --n-probe 1,4,8,16
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import BruteForceIndex, IVFIndex  # noqa: E402
+
+
+def synthetic_gallery(size, dim, n_identities_clusters, seed=0):
+    """
+    Embeddings grouped around cluster centers, like faces of similar people
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_identities_clusters, dim)).astype(np.float32)
+    labels = rng.integers(n_identities_clusters, size=size)
+    gallery = centers[labels] + 1.0 * rng.normal(size=(size, dim)).astype(np.float32)
+
+    return gallery.astype(np.float32), [str(i) for i in range(size)]
+
+
+def noisy_queries(gallery, n_queries, noise, seed=1):
+    """
+    Probes that are perturbed copies of enrolled embeddings
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(gallery), n_queries, replace=False)
+    probes = gallery[rows] + noise * rng.normal(size=(n_queries, gallery.shape[1])).astype(np.float32)
+
+    return probes.astype(np.float32)
+
+
+def timed_search(index, probes, k):
+    start = time.perf_counter()
+    results = [index.search(probe, k=k)[0] for probe in probes]
+    elapsed = time.perf_counter() - start
+
+    return results, elapsed / len(probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IVF recall/latency against exact search')
+    parser.add_argument('--size', type=int, default=20000, help='Gallery size')
+    parser.add_argument('--dim', type=int, default=512, help='Embedding dimension')
+    parser.add_argument('--queries', type=int, default=200, help='Number of probes')
+    parser.add_argument('--k', type=int, default=5, help='Top-k for recall@k')
+    parser.add_argument('--n-lists', type=int, default=0, help='IVF lists (0 = sqrt(size))')
+    parser.add_argument('--n-probe', default='1,4,8,16,32', help='Comma-separated n_probe values')
+    parser.add_argument('--metric', default='cosine', choices=['cosine', 'euclidean', 'euclidean_l2'])
+    parser.add_argument('--noise', type=float, default=0.8, help='Probe noise level')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    gallery, keys = synthetic_gallery(args.size, args.dim, max(1, args.size // 50))
+    probes = noisy_queries(gallery, args.queries, args.noise)
+
+    exact = BruteForceIndex(metric=args.metric)
+    exact.build(gallery, keys)
+    exact_results, exact_latency = timed_search(exact, probes, args.k)
+
+    ivf = IVFIndex(metric=args.metric, n_lists=args.n_lists)
+    start = time.perf_counter()
+    ivf.build(gallery, keys)
+    build_seconds = time.perf_counter() - start
+
+    report = {
+        'size': args.size,
+        'dim': args.dim,
+        'queries': args.queries,
+        'metric': args.metric,
+        'k': args.k,
+        'n_lists': ivf.stats()['n_lists'],
+        'ivf_build_seconds': build_seconds,
+        'exact_latency_ms': exact_latency * 1000,
+        'runs': []
+    }
+
+    print(f'Gallery: {args.size} x {args.dim}, {report["n_lists"]} lists, built in {build_seconds:.2f}s')
+    print(f'Exact search: {exact_latency * 1000:.3f} ms/query')
+    print(f'{"n_probe":>8} {"recall@1":>9} {"recall@k":>9} {"ms/query":>9} {"speedup":>8}')
+
+    for n_probe in [int(value) for value in args.n_probe.split(',')]:
+        ivf.n_probe = n_probe
+        ivf_results, ivf_latency = timed_search(ivf, probes, args.k)
+
+        recall_1 = np.mean([
+            bool(approx) and approx[0][0] == truth[0][0]
+            for approx, truth in zip(ivf_results, exact_results)
+        ])
+        recall_k = np.mean([
+            len({key for key, _ in approx} & {key for key, _ in truth}) / len(truth)
+            for approx, truth in zip(ivf_results, exact_results)
+        ])
+
+        run = {
+            'n_probe': n_probe,
+            'recall_at_1': float(recall_1),
+            'recall_at_k': float(recall_k),
+            'latency_ms': ivf_latency * 1000,
+            'speedup': exact_latency / ivf_latency
+        }
+        report['runs'].append(run)
+
+        print(f'{n_probe:>8} {recall_1:>9.3f} {recall_k:>9.3f} {ivf_latency * 1000:>9.3f} {run["speedup"]:>7.1f}x')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results saved: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+Load Benchmark - Throughput, latency and memory against gallery size and workers
+Sistema de Ponto Eletrônico Brasileiro
+
+For every gallery size and worker count, generates (or reuses) a synthetic
+gallery of enrolled employees, starts the service under gunicorn with the
+stub inference backend, drives /recognize, /verify/<employee_id> and
+/enroll concurrently at fixed request rates (open loop) and records
+throughput, latency percentiles and the memory of the server processes.
+Results are saved as JSON and can be compared with a previous run.
+
+With --url an already running service is benchmarked instead (its own
+backend and gallery; use --gallery-sizes with the size it was built from).
+
+Usage:
+    python benchmarks/bench_load.py --gallery-sizes 100,10000,100000 --workers 1,2,4 \\
+        --rates recognize=20,verify=10,enroll=2 --duration 30 --output load.json
+    python benchmarks/bench_load.py --baseline load_old.json --output load_new.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import base64
+import shutil
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from config import Config  # noqa: E402
+from gallery import file_hash, save_template, template_path  # noqa: E402
+from inference_stub import detect_faces, embed_faces  # noqa: E402
+
+OPERATIONS = ('recognize', 'verify', 'enroll')
+
+# Photos are upscaled blocks of random colour: cheap to encode, well above
+# MIN_FACE_SIZE and distinct for every employee
+PHOTO_BLOCKS = 8
+PHOTO_SIZE = 96
+
+
+def synthetic_photo(seed):
+    """
+    RGB pixels of the photo of synthetic employee number seed
+    """
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=(PHOTO_BLOCKS, PHOTO_BLOCKS, 3), dtype=np.uint8)
+
+    return np.asarray(Image.fromarray(blocks).resize((PHOTO_SIZE, PHOTO_SIZE), Image.NEAREST))
+
+
+def jpeg_bytes(pixels, quality=90):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=quality)
+
+    return buffer.getvalue()
+
+
+def probe_photo(seed, rng):
+    """
+    Base64 JPEG of a slightly perturbed photo: new bytes (no cache hit), nearby embedding
+    """
+    pixels = synthetic_photo(seed).astype(np.int16) + rng.integers(-3, 4, size=(PHOTO_SIZE, PHOTO_SIZE, 3))
+
+    return base64.b64encode(jpeg_bytes(np.clip(pixels, 0, 255).astype(np.uint8))).decode()
+
+
+def employee_id(number):
+    return f'bench-{number}'
+
+
+def build_gallery(path, size, chunk=1000):
+    """
+    Write size enrolled employees (photo + current template) under path
+
+    Reused as long as a previous run built the same size with the same settings.
+    """
+    marker_path = os.path.join(path, '.bench_gallery.json')
+    marker = {
+        'size': size,
+        'model_name': Config.MODEL_NAME,
+        'detector_backend': Config.DETECTOR_BACKEND,
+        'align': Config.ALIGN,
+        'embedding_dim': Config.STUB_EMBEDDING_DIM
+    }
+
+    if os.path.isfile(marker_path):
+        with open(marker_path) as f:
+            if json.load(f) == marker:
+                return path
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    start = time.perf_counter()
+
+    for offset in range(0, size, chunk):
+        numbers = range(offset, min(offset + chunk, size))
+        face_paths = []
+
+        for number in numbers:
+            employee_dir = os.path.join(path, employee_id(number))
+            os.makedirs(employee_dir)
+            face_path = os.path.join(employee_dir, f'{employee_id(number)}_face.jpg')
+
+            with open(face_path, 'wb') as f:
+                f.write(jpeg_bytes(synthetic_photo(number)))
+
+            face_paths.append(face_path)
+
+        # Embedded exactly as the started servers (stub backend) embed the stored photo
+        embeddings = embed_faces([detect_faces(face_path)[0] for face_path in face_paths])
+
+        for number, face_path, embedding in zip(numbers, face_paths, embeddings):
+            save_template(
+                template_path(path, employee_id(number)), embedding, Config.MODEL_NAME,
+                Config.DETECTOR_BACKEND, Config.ALIGN, file_hash(face_path)
+            )
+
+    with open(marker_path, 'w') as f:
+        json.dump(marker, f)
+
+    print(f'Generated gallery of {size} in {time.perf_counter() - start:.1f}s at {path}')
+
+    return path
+
+
+def remove_enrollments(path):
+    """
+    Delete employees enrolled by a previous run, so every run starts from the same gallery
+    """
+    for entry in os.listdir(path):
+        if entry.startswith('bench-new-'):
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+
+def http_post(url, payload, timeout=60):
+    """
+    POST JSON; returns (status, body) without raising on HTTP errors
+    """
+    data = json.dumps(payload).encode()
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read())
+        except ValueError:
+            return e.code, {}
+    except (urllib.error.URLError, OSError):
+        return 0, {}
+
+
+def wait_for_health(url, timeout):
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f'{url}/health', timeout=5) as response:
+                return json.loads(response.read())
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+
+    raise RuntimeError(f'Service at {url} did not become healthy within {timeout}s')
+
+
+def process_tree(pid):
+    """
+    pid and every descendant process (Linux /proc)
+    """
+    children = {}
+
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+
+        children.setdefault(parent, []).append(int(entry))
+
+    tree = [pid]
+
+    for current in tree:
+        tree.extend(children.get(current, []))
+
+    return tree
+
+
+def memory_usage(pid):
+    """
+    Summed RSS and PSS (MB) of a process tree; PSS splits copy-on-write pages
+    shared by gunicorn workers, so it is the honest total
+    """
+    if not os.path.isdir('/proc'):
+        return None
+
+    totals = {'rss_mb': 0.0, 'pss_mb': 0.0, 'processes': 0}
+
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/smaps_rollup') as f:
+                for line in f:
+                    field, value = line.split(':', 1)[0], line.split()[1:2]
+
+                    if field == 'Rss':
+                        totals['rss_mb'] += int(value[0]) / 1024
+                    elif field == 'Pss':
+                        totals['pss_mb'] += int(value[0]) / 1024
+        except (OSError, IndexError, ValueError):
+            continue
+
+        totals['processes'] += 1
+
+    return totals
+
+
+class MemorySampler(threading.Thread):
+    """
+    Tracks peak memory of the server process tree while the load runs
+    """
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            sample = memory_usage(self.pid)
+
+            if sample and (self.peak is None or sample['pss_mb'] > self.peak['pss_mb']):
+                self.peak = sample
+
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def server_env(gallery_dir, workers, port, threads, log_dir):
+    """
+    Environment of the benchmarked server
+
+    The quality gate and the liveness check judge real camera photos; the
+    synthetic block photos fail them (sharpness about 5-12), so both are off
+    and every request measures recognition itself.
+    """
+    env = dict(os.environ)
+    env.update({
+        'INFERENCE_BACKEND': 'stub',
+        'FACES_DB_PATH': gallery_dir,
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_THREADS': str(threads),
+        'HOST': '127.0.0.1',
+        'PORT': str(port),
+        'RATELIMIT_ENABLED': 'False',
+        'ANTI_SPOOFING_ENABLED': 'False',
+        'QUALITY_GATE_ENABLED': 'False',
+        'LOG_LEVEL': 'WARNING',
+        'LOG_FILE': os.path.join(log_dir, 'deepface_api.log')
+    })
+
+    return env
+
+
+def start_server(gallery_dir, workers, port, threads, log_dir):
+    """
+    Start gunicorn with the stub backend; returns (process, startup seconds, health)
+    """
+    env = server_env(gallery_dir, workers, port, threads, log_dir)
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            'gunicorn', '--config', 'gunicorn.conf.py',
+            '--access-logfile', os.path.join(log_dir, 'access.log'),
+            '--error-logfile', os.path.join(log_dir, 'error.log'),
+            'app:app'
+        ],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    try:
+        health = wait_for_health(f'http://127.0.0.1:{port}', timeout=600)
+    except RuntimeError:
+        stop_server(process)
+        raise
+
+    return process, time.perf_counter() - start, health
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def build_payloads(operation, count, gallery_size, seed):
+    """
+    Pre-encoded requests, so client-side JPEG work stays out of the timings
+    """
+    rng = np.random.default_rng(seed)
+    payloads = []
+
+    for n in range(count):
+        if operation == 'enroll':
+            number = gallery_size + seed * 100000 + n
+            payloads.append(('/enroll', {
+                'employee_id': f'bench-new-{seed}-{n}',
+                'photo': base64.b64encode(jpeg_bytes(synthetic_photo(number))).decode()
+            }, None))
+        else:
+            number = int(rng.integers(gallery_size))
+            path = '/recognize' if operation == 'recognize' else f'/verify/{employee_id(number)}'
+            payloads.append((path, {'photo': probe_photo(number, rng)}, employee_id(number)))
+
+    return payloads
+
+
+def run_load(url, rates, duration, gallery_size, concurrency, seed=0):
+    """
+    Fire every operation at its own fixed rate for duration seconds
+
+    Latency is measured from each request's scheduled send time, so client
+    queueing under overload shows up instead of being hidden.
+    """
+    payloads = {
+        operation: build_payloads(operation, max(1, int(rate * duration) + 1), gallery_size, seed + i)
+        for i, (operation, rate) in enumerate(rates.items())
+    }
+    samples = {operation: [] for operation in rates}
+    lock = threading.Lock()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def send(operation, scheduled_at, path, payload, expected):
+        status, body = http_post(f'{url}{path}', payload)
+        latency = time.perf_counter() - scheduled_at
+        ok = status == 200 and body.get('success', False)
+
+        if operation == 'recognize':
+            correct = ok and body.get('employee_id') == expected
+        elif operation == 'verify':
+            correct = ok and body.get('verified', False)
+        else:
+            correct = ok
+
+        with lock:
+            samples[operation].append((latency, status, ok, correct))
+
+    def schedule(operation, rate):
+        interval = 1.0 / rate
+        next_at = started_at
+
+        for path, payload, expected in payloads[operation]:
+            if next_at - started_at >= duration:
+                break
+
+            delay = next_at - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            pool.submit(send, operation, next_at, path, payload, expected)
+            next_at += interval
+
+    started_at = time.perf_counter()
+    schedulers = [
+        threading.Thread(target=schedule, args=(operation, rate), daemon=True)
+        for operation, rate in rates.items() if rate > 0
+    ]
+
+    for scheduler in schedulers:
+        scheduler.start()
+
+    for scheduler in schedulers:
+        scheduler.join()
+
+    pool.shutdown(wait=True)
+    elapsed = time.perf_counter() - started_at
+
+    return {operation: summarize(samples[operation], elapsed) for operation in rates}
+
+
+def summarize(samples, elapsed):
+    """
+    Throughput, error count and latency percentiles of one operation
+    """
+    if not samples:
+        return {'requests': 0}
+
+    latencies = np.array([latency for latency, _, _, _ in samples]) * 1000
+    ok = sum(1 for _, _, success, _ in samples if success)
+    statuses = {}
+
+    for _, status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        'requests': len(samples),
+        'ok': ok,
+        'errors': len(samples) - ok,
+        'correct': sum(1 for _, _, _, correct in samples if correct),
+        'statuses': statuses,
+        'throughput_rps': ok / elapsed,
+        'latency_ms': {
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(latencies.max())
+        }
+    }
+
+
+def parse_rates(text):
+    rates = {}
+
+    for part in text.split(','):
+        operation, rate = part.split('=')
+
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation {operation} (use {", ".join(OPERATIONS)})')
+
+        rates[operation] = float(rate)
+
+    return rates
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=API_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run):
+    for operation, summary in run['operations'].items():
+        if not summary.get('requests'):
+            continue
+
+        latency = summary['latency_ms']
+        memory = run.get('memory_peak') or {}
+        print(
+            f"{run['gallery_size']:>8} {run['workers'] or '-':>7} {operation:>9} "
+            f"{summary['throughput_rps']:>8.1f} {latency['p50']:>8.1f} {latency['p95']:>8.1f} "
+            f"{latency['p99']:>8.1f} {summary['errors']:>6} {memory.get('pss_mb', 0):>8.0f}"
+        )
+
+
+def compare(results, baseline):
+    """
+    p95 latency and throughput change of every run also present in the baseline
+    """
+    previous = {
+        (run['gallery_size'], run['workers'], operation): summary
+        for run in baseline['runs'] for operation, summary in run['operations'].items()
+        if summary.get('requests')
+    }
+
+    print(f"\nAgainst baseline {baseline['meta'].get('commit')}:")
+    print(f"{'gallery':>8} {'workers':>7} {'op':>9} {'p95 change':>11} {'rps change':>11}")
+
+    for run in results['runs']:
+        for operation, summary in run['operations'].items():
+            old = previous.get((run['gallery_size'], run['workers'], operation))
+
+            if not old or not summary.get('requests'):
+                continue
+
+            p95 = summary['latency_ms']['p95'] / old['latency_ms']['p95'] - 1
+            rps = summary['throughput_rps'] / old['throughput_rps'] - 1 if old['throughput_rps'] else 0.0
+            print(f"{run['gallery_size']:>8} {run['workers'] or '-':>7} {operation:>9} {p95:>+10.1%} {rps:>+10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Service throughput/latency/memory against gallery size and workers')
+    parser.add_argument('--gallery-sizes', default='100,1000,10000', help='Comma-separated gallery sizes')
+    parser.add_argument('--workers', default='1,2', help='Comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker')
+    parser.add_argument('--rates', type=parse_rates, default=parse_rates('recognize=20,verify=10,enroll=1'),
+                        help='Requests per second per operation, e.g. recognize=20,verify=10,enroll=1')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of load per run')
+    parser.add_argument('--concurrency', type=int, default=64, help='Client threads')
+    parser.add_argument('--port', type=int, default=5055, help='Port of the started servers')
+    parser.add_argument('--gallery-dir', default=os.path.join(tempfile.gettempdir(), 'deepface_bench'),
+                        help='Where synthetic galleries are generated (reused between runs)')
+    parser.add_argument('--url', help='Benchmark an already running service instead of starting one')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--baseline', help='Previous JSON results to compare against')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.gallery_sizes.split(',')]
+    worker_counts = [int(workers) for workers in args.workers.split(',')] if not args.url else [None]
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'backend': 'external' if args.url else 'stub',
+            'stub_detect_ms': Config.STUB_DETECT_MS,
+            'stub_embed_ms': Config.STUB_EMBED_MS,
+            'rates': args.rates,
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'threads': args.threads
+        },
+        'runs': []
+    }
+
+    print(f"{'gallery':>8} {'workers':>7} {'op':>9} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'errors':>6} {'pss MB':>8}")
+
+    for size in sizes:
+        gallery_dir = None if args.url else build_gallery(os.path.join(args.gallery_dir, f'gallery_{size}'), size)
+
+        for workers in worker_counts:
+            run = {'gallery_size': size, 'workers': workers}
+            process = None
+
+            if args.url:
+                url = args.url.rstrip('/')
+                wait_for_health(url, timeout=30)
+            else:
+                remove_enrollments(gallery_dir)
+                log_dir = tempfile.mkdtemp(prefix='deepface_bench_logs_')
+                url = f'http://127.0.0.1:{args.port}'
+                process, startup, health = start_server(gallery_dir, workers, args.port, args.threads, log_dir)
+                run['startup_seconds'] = startup
+                run['memory_idle'] = memory_usage(process.pid)
+                run['gallery_index'] = health.get('gallery_index')
+
+            sampler = MemorySampler(process.pid) if process else None
+
+            if sampler:
+                sampler.start()
+
+            try:
+                run['operations'] = run_load(url, args.rates, args.duration, size, args.concurrency)
+            finally:
+                if sampler:
+                    sampler.stop()
+                    run['memory_peak'] = sampler.peak
+
+                if process:
+                    stop_server(process)
+                    remove_enrollments(gallery_dir)
+                    shutil.rmtree(log_dir, ignore_errors=True)
+
+            results['runs'].append(run)
+            print_run(run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        print(f'\nResults written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+ONNX Inference Benchmark - TensorFlow against ONNX Runtime (float32 and int8)
+Sistema de Ponto Eletrônico Brasileiro
+
+Runs every backend in its own process, so startup time and memory are
+measured in isolation: time to build the model and embed the first face,
+resident memory after loading and at peak, per-batch latency percentiles
+and throughput for several batch sizes. Every backend embeds the same
+seeded face crops; the embeddings of the ONNX backends are compared with
+TensorFlow's (worst cosine distance). Export the models first with
+export_onnx.py (and --quantize for onnx-int8).
+
+Usage:
+    python benchmarks/onnx_inference.py --backends deepface,onnx,onnx-int8 --batch-sizes 1,4,16
+    python benchmarks/onnx_inference.py --intra-op-threads 2 --iterations 50 --output onnx.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+# Environment of the process that runs each backend
+BACKENDS = {
+    'deepface': {'INFERENCE_BACKEND': 'deepface'},
+    'onnx': {'INFERENCE_BACKEND': 'onnx', 'ONNX_QUANTIZED': 'False'},
+    'onnx-int8': {'INFERENCE_BACKEND': 'onnx', 'ONNX_QUANTIZED': 'True'}
+}
+
+
+def rss_mb():
+    """
+    Current resident memory of this process in MB (Linux)
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def face_crops(count, seed=0):
+    """
+    Seeded RGB face-like crops in [0, 1] at the model input shape, as detect_faces returns them
+    """
+    from inference import model_input_shape
+
+    height, width = model_input_shape()[:2]
+    rng = np.random.default_rng(seed)
+
+    return [{'face': rng.random((height, width, 3), dtype=np.float32)} for _ in range(count)]
+
+
+def run_backend(batch_sizes, iterations, reference_count, embeddings_path):
+    """
+    Benchmark the backend selected by the environment; returns a result dict
+    """
+    start = time.perf_counter()
+    baseline_rss = rss_mb()
+
+    from inference import build_models, embed_faces
+
+    build_models()
+    faces = face_crops(max(max(batch_sizes), reference_count))
+    embed_faces(faces[:1])
+    startup = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    np.save(embeddings_path, embed_faces(faces[:reference_count]))
+
+    batches = []
+
+    for batch_size in batch_sizes:
+        batch = faces[:batch_size]
+        embed_faces(batch)
+        latencies = []
+
+        for _ in range(iterations):
+            start = time.perf_counter()
+            embed_faces(batch)
+            latencies.append(time.perf_counter() - start)
+
+        latencies = np.array(latencies) * 1000
+        batches.append({
+            'batch_size': batch_size,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'faces_per_second': float(batch_size * 1000 / latencies.mean())
+        })
+
+    return {
+        'startup_seconds': startup,
+        'rss_baseline_mb': baseline_rss,
+        'rss_loaded_mb': loaded_rss,
+        'rss_peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'batches': batches
+    }
+
+
+def spawn(backend, args, embeddings_path):
+    """
+    Run one backend in a fresh process and read back its result
+    """
+    env = {**os.environ, **BACKENDS[backend], 'PRELOAD_MODELS': 'False'}
+
+    if args.intra_op_threads is not None:
+        env['ONNX_INTRA_OP_THREADS'] = str(args.intra_op_threads)
+
+    if args.inter_op_threads is not None:
+        env['ONNX_INTER_OP_THREADS'] = str(args.inter_op_threads)
+
+    command = [
+        sys.executable, os.path.abspath(__file__), '--run', backend, '--batch-sizes', args.batch_sizes,
+        '--iterations', str(args.iterations), '--reference-faces', str(args.reference_faces),
+        '--embeddings', embeddings_path
+    ]
+    completed = subprocess.run(command, env=env, cwd=API_DIR, capture_output=True, text=True)
+
+    if completed.returncode != 0:
+        raise RuntimeError(f'{backend} failed:\n{completed.stderr[-2000:]}')
+
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embedding latency, throughput and memory per inference backend')
+    parser.add_argument('--backends', default='deepface,onnx', help=f'Comma-separated: {", ".join(BACKENDS)}')
+    parser.add_argument('--batch-sizes', default='1,4,16', help='Comma-separated faces per forward pass')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed forward passes per batch size')
+    parser.add_argument('--reference-faces', type=int, default=16, help='Faces compared between backends')
+    parser.add_argument('--intra-op-threads', type=int, help='ONNX_INTRA_OP_THREADS of the ONNX backends')
+    parser.add_argument('--inter-op-threads', type=int, help='ONNX_INTER_OP_THREADS of the ONNX backends')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--run', choices=tuple(BACKENDS), help=argparse.SUPPRESS)
+    parser.add_argument('--embeddings', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+
+    if args.run:
+        result = run_backend(batch_sizes, args.iterations, args.reference_faces, args.embeddings)
+        print(json.dumps(result))
+        return 0
+
+    from config import Config
+
+    backends = [backend.strip() for backend in args.backends.split(',')]
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'model': Config.MODEL_NAME,
+            'cpus': os.cpu_count(),
+            'intra_op_threads': args.intra_op_threads,
+            'inter_op_threads': args.inter_op_threads,
+            'iterations': args.iterations
+        },
+        'backends': {}
+    }
+    embeddings = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in backends:
+            embeddings_path = os.path.join(directory, f'{backend}.npy')
+            results['backends'][backend] = spawn(backend, args, embeddings_path)
+            embeddings[backend] = np.load(embeddings_path)
+
+    # Worst cosine distance of each backend's embeddings to TensorFlow's
+    if 'deepface' in embeddings:
+        reference = embeddings['deepface']
+
+        for backend, candidate in embeddings.items():
+            dot = (reference * candidate).sum(axis=1)
+            norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1) + 1e-10
+            results['backends'][backend]['max_distance_to_tf'] = float((1 - dot / norms).max())
+
+    print(f"{'backend':>10} {'startup s':>9} {'rss MB':>8} {'peak MB':>8} {'batch':>5} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'faces/s':>8} {'max dist':>9}")
+
+    for backend, result in results['backends'].items():
+        distance = result.get('max_distance_to_tf')
+
+        for batch in result['batches']:
+            print(f"{backend:>10} {result['startup_seconds']:>9.2f} {result['rss_loaded_mb']:>8.0f} "
+                  f"{result['rss_peak_mb']:>8.0f} {batch['batch_size']:>5} {batch['p50_ms']:>8.1f} "
+                  f"{batch['p95_ms']:>8.1f} {batch['faces_per_second']:>8.1f} "
+                  f"{'-' if distance is None else f'{distance:.6f}':>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        print(f'\nResults written to {args.output}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Cache - LRU + TTL caches for retried photos
+Sistema de Ponto Eletrônico Brasileiro
+
+Kiosks and the PWA resend the same photo after a timeout. Uploads are keyed
+by their SHA-256 plus the settings that shape the answer, so a retry skips
+detection, embedding and (while the gallery has not changed in a way that
+matters) the search itself.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from index import compute_distance_matrix
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry and expires
+    entries older than ttl seconds
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, enabled=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled and max_entries > 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Cached value of a key, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+
+            expires_at, value = entry
+
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+
+            return value
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries when full
+        """
+        if not self.enabled:
+            return value
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+        return value
+
+    def values(self):
+        """
+        Snapshot of (key, value) pairs, oldest first
+        """
+        with self._lock:
+            return [(key, value) for key, (_, value) in self._entries.items()]
+
+    def discard(self, keys):
+        """
+        Drop the given keys; returns how many were present
+        """
+        removed = 0
+
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    removed += 1
+
+            self._counters['invalidations'] += removed
+
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+
+        return stats
+
+
+class ProbeCache(LRUCache):
+    """
+    Detections and embedding of an upload, keyed by image hash and the
+    model, detector and alignment settings
+
+    Face crops are kept only until the embedding is computed; after that the
+    entry holds the face metadata and the embedding, a few KB per photo.
+    """
+
+    def __init__(self, model_name, detector_backend, align, **kwargs):
+        super().__init__(**kwargs)
+        self.settings = (model_name, detector_backend, bool(align))
+
+    def key(self, image_hash):
+        return (image_hash,) + self.settings
+
+    def get_probe(self, image_hash):
+        """
+        {'faces': [...], 'embedding': array or None, 'liveness': ...} of an upload, or None
+        """
+        return self.get(self.key(image_hash))
+
+    def put_faces(self, image_hash, faces):
+        return self.put(self.key(image_hash), {'faces': faces, 'embedding': None})
+
+    def put_embedding(self, image_hash, faces, embedding, liveness=None):
+        # Replace the entry rather than mutate it: other threads may hold it
+        metadata = [{key: value for key, value in face.items() if key != 'face'} for face in faces]
+
+        return self.put(self.key(image_hash), {'faces': metadata, 'embedding': embedding, 'liveness': liveness})
+
+    def put_liveness(self, image_hash, probe, liveness):
+        """
+        Remember the liveness verdict of an upload (crops are kept only until embedded)
+        """
+        faces = probe['faces']
+
+        if probe['embedding'] is not None:
+            faces = [{key: value for key, value in face.items() if key != 'face'} for face in faces]
+
+        self.put(self.key(image_hash), {'faces': faces, 'embedding': probe['embedding'], 'liveness': liveness})
+
+        return {**probe, 'liveness': liveness}
+
+
+class ResultCache(LRUCache):
+    """
+    Final /recognize and /verify/<employee_id> responses
+
+    Every entry remembers the probe embedding and the candidates it ranked,
+    so enrolling or deleting an employee drops exactly the entries whose
+    answer could change.
+    """
+
+    def __init__(self, distance_metric='cosine', **kwargs):
+        super().__init__(**kwargs)
+        self.distance_metric = distance_metric
+
+    def put_recognition(self, key, response, probe, ranked, k, partition=None, candidates=None):
+        """
+        Cache a recognition response and the ranked (employee_id, distance) list behind it
+        """
+        return self.put(key, {
+            'kind': 'recognize',
+            'response': response,
+            'probe': np.asarray(probe, dtype=np.float32),
+            'ranked': list(ranked),
+            'has_room': len(ranked) < k,
+            'partition': partition,
+            'candidates': frozenset(candidates) if candidates is not None else None
+        })
+
+    def put_verification(self, key, response, employee_id):
+        return self.put(key, {'kind': 'verify', 'response': response, 'employee_id': str(employee_id)})
+
+    def _references(self, entry, employee_id):
+        if entry['kind'] == 'verify':
+            return entry['employee_id'] == employee_id
+
+        return any(ranked_id == employee_id for ranked_id, _ in entry['ranked'])
+
+    def _in_scope(self, entry, employee_id, partition):
+        if entry['partition'] is not None and entry['partition'] != (partition or ''):
+            return False
+
+        return entry['candidates'] is None or employee_id in entry['candidates']
+
+    def invalidate_enrollment(self, employee_id, embedding, partition=None):
+        """
+        Drop entries a new or replaced template could change
+
+        A recognition result changes if it ranked this employee, or if the new
+        template is in its scope and closer to its probe than its worst ranked
+        candidate (or the ranking had room left). embedding may also be the
+        (templates, dimensions) matrix of an employee with several templates.
+        """
+        if not self.enabled:
+            return 0
+
+        employee_id = str(employee_id)
+        stale = []
+        to_check = []
+
+        for key, entry in self.values():
+            if self._references(entry, employee_id):
+                stale.append(key)
+            elif entry['kind'] == 'recognize' and self._in_scope(entry, employee_id, partition):
+                to_check.append((key, entry))
+
+        if to_check:
+            probes = np.vstack([entry['probe'] for _, entry in to_check])
+            templates = np.asarray(embedding, dtype=np.float32)
+            distances = compute_distance_matrix(
+                templates.reshape(-1, templates.shape[-1]), probes, self.distance_metric
+            ).min(axis=1)
+
+            for (key, entry), distance in zip(to_check, distances):
+                if entry['has_room'] or distance <= entry['ranked'][-1][1]:
+                    stale.append(key)
+
+        return self.discard(stale)
+
+    def invalidate_removal(self, employee_id):
+        """
+        Drop entries that ranked or verified a removed employee
+        """
+        if not self.enabled:
+            return 0
+
+        employee_id = str(employee_id)
+
+        return self.discard([key for key, entry in self.values() if self._references(entry, employee_id)])
@@ -23,6 +23,9 @@ class Config:
     # DeepFace Settings
     MODEL_NAME = os.getenv('MODEL_NAME', 'VGG-Face')  # VGG-Face, Facenet, Facenet512, OpenFace, DeepFace, DeepID, ArcFace, Dlib
     DETECTOR_BACKEND = os.getenv('DETECTOR_BACKEND', 'opencv')  # opencv, ssd, dlib, mtcnn, retinaface, mediapipe
+    DETECTOR_CASCADE = [b.strip() for b in os.getenv('DETECTOR_CASCADE', '').split(',') if b.strip()]  # e.g. opencv:4.0,retinaface (empty = DETECTOR_BACKEND only)
+    DETECTOR_CASCADE_MIN_CONFIDENCE = float(os.getenv('DETECTOR_CASCADE_MIN_CONFIDENCE', 0.9))  # Escalate below this confidence (stages without their own ":value")
+    DETECTOR_CASCADE_SIZE_MARGIN = float(os.getenv('DETECTOR_CASCADE_SIZE_MARGIN', 1.25))  # Escalate when the face is smaller than MIN_FACE_SIZE times this
     DISTANCE_METRIC = os.getenv('DISTANCE_METRIC', 'cosine')  # cosine, euclidean, euclidean_l2
     ENFORCE_DETECTION = os.getenv('ENFORCE_DETECTION', 'True').lower() == 'true'
     ALIGN = os.getenv('ALIGN', 'True').lower() == 'true'
@@ -43,6 +46,60 @@ class Config:
         'DeepID': {'cosine': 0.015, 'euclidean': 45, 'euclidean_l2': 0.17}
     }
 
+    # Top-k Recognition
+    RECOGNITION_TOP_K = int(os.getenv('RECOGNITION_TOP_K', 3))  # Candidates returned by /recognize (matches list)
+    MIN_MATCH_MARGIN = float(os.getenv('MIN_MATCH_MARGIN', 0.0))  # Reject matches whose runner-up is closer than this (0 = disabled)
+
+    # Inference Backend
+    INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'deepface')  # deepface, onnx (export_onnx.py first), stub (deterministic, no model weights - benchmarks only)
+    ONNX_MODEL_PATH = os.getenv('ONNX_MODEL_PATH', '')  # Exported model (empty = models/<MODEL_NAME>.onnx, or .int8.onnx when quantized)
+    ONNX_QUANTIZED = os.getenv('ONNX_QUANTIZED', 'False').lower() == 'true'  # Use the int8 export (export_onnx.py --quantize)
+    ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', 0))  # Threads inside one operator (0 = one per core)
+    ONNX_INTER_OP_THREADS = int(os.getenv('ONNX_INTER_OP_THREADS', 1))  # Operators run in parallel (sequential graphs need 1)
+    STUB_EMBEDDING_DIM = int(os.getenv('STUB_EMBEDDING_DIM', 512))  # Embedding size of the stub backend
+    STUB_DETECT_MS = float(os.getenv('STUB_DETECT_MS', 0))  # Simulated detection time per image (stub backend)
+    STUB_EMBED_MS = float(os.getenv('STUB_EMBED_MS', 0))  # Simulated time per forward pass (stub backend)
+
+    # Model Preloading
+    PRELOAD_MODELS = os.getenv('PRELOAD_MODELS', 'True').lower() == 'true'  # Build model, detector and gallery at import (before gunicorn forks)
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'True').lower() == 'true'  # Run one dummy inference per process at boot
+
+    # Batch Recognition
+    BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 32))  # Maximum photos per /recognize/batch request
+
+    # Inference Micro-batching (concurrent requests share one forward pass)
+    INFERENCE_BATCHING_ENABLED = os.getenv('INFERENCE_BATCHING_ENABLED', 'True').lower() == 'true'
+    INFERENCE_BATCH_MAX_SIZE = int(os.getenv('INFERENCE_BATCH_MAX_SIZE', 16))  # Faces per forward pass
+    INFERENCE_BATCH_MAX_WAIT_MS = float(os.getenv('INFERENCE_BATCH_MAX_WAIT_MS', 5))  # Max time a request waits for others
+
+    # Gallery Search Index
+    ANN_MIN_GALLERY_SIZE = int(os.getenv('ANN_MIN_GALLERY_SIZE', 5000))  # Switch from exact to IVF search at this size (0 = always exact)
+    ANN_N_LISTS = int(os.getenv('ANN_N_LISTS', 0))  # IVF clusters (0 = sqrt of gallery size)
+    ANN_N_PROBE = int(os.getenv('ANN_N_PROBE', 8))  # IVF clusters scanned per search (higher = better recall, slower)
+
+    # Embedding Store (memory-mapped gallery snapshot shared by the workers)
+    EMBEDDING_STORE_ENABLED = os.getenv('EMBEDDING_STORE_ENABLED', 'True').lower() == 'true'
+    EMBEDDING_STORE_DTYPE = os.getenv('EMBEDDING_STORE_DTYPE', 'float32')  # float32 (shared mapping) or float16 (half the file, per-worker float32 copy)
+    EMBEDDING_STORE_COMPACT_EVERY = int(os.getenv('EMBEDDING_STORE_COMPACT_EVERY', 1000))  # Journal entries before the store is rewritten (0 = only at startup)
+
+    # Multiple Templates per Employee (/enroll with "mode": "add")
+    MAX_TEMPLATES_PER_EMPLOYEE = int(os.getenv('MAX_TEMPLATES_PER_EMPLOYEE', 5))  # Templates kept per employee (the most redundant one is replaced)
+    TEMPLATE_RERANK_CANDIDATES = int(os.getenv('TEMPLATE_RERANK_CANDIDATES', 10))  # Centroid matches re-ranked against the individual templates
+
+    # Attribute Analysis (/analyze)
+    ANALYZE_DEFAULT_ACTIONS = os.getenv('ANALYZE_DEFAULT_ACTIONS', 'age,gender,emotion,race')  # Actions run when a request does not choose
+    ATTRIBUTE_MODEL_IDLE_SECONDS = int(os.getenv('ATTRIBUTE_MODEL_IDLE_SECONDS', 0))  # Unload attribute models unused this long (0 = keep)
+    ATTRIBUTE_MEMORY_LIMIT_MB = int(os.getenv('ATTRIBUTE_MEMORY_LIMIT_MB', 0))  # Unload least recently used attribute models above this RSS (0 = no limit)
+
+    # Streaming Kiosk Mode (WebSocket /stream, requires flask-sock)
+    STREAM_ENABLED = os.getenv('STREAM_ENABLED', 'True').lower() == 'true'
+    STREAM_DETECTOR_BACKEND = os.getenv('STREAM_DETECTOR_BACKEND', 'opencv')  # Cheap detector run on every frame
+    STREAM_MAX_SIDE = int(os.getenv('STREAM_MAX_SIDE', 640))  # Frames are downscaled to this before detection
+    STREAM_IOU_THRESHOLD = float(os.getenv('STREAM_IOU_THRESHOLD', 0.3))  # Box overlap that continues a face track
+    STREAM_MAX_MISSED_FRAMES = int(os.getenv('STREAM_MAX_MISSED_FRAMES', 5))  # Frames without the face before a track is dropped
+    STREAM_MIN_QUALITY_GAIN = float(os.getenv('STREAM_MIN_QUALITY_GAIN', 0.25))  # Re-recognize an unrecognized track once its face is this much better
+    STREAM_MAX_EMBEDS_PER_TRACK = int(os.getenv('STREAM_MAX_EMBEDS_PER_TRACK', 3))  # Recognition attempts per track
+
     # Face Database
     FACES_DB_PATH = os.getenv('FACES_DB_PATH', '../storage/faces')
 
@@ -50,9 +107,40 @@ class Config:
     MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 5 * 1024 * 1024))  # 5MB
     ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
 
+    # Image Preprocessing (before detection)
+    WORKING_MAX_SIDE = int(os.getenv('WORKING_MAX_SIDE', 1280))  # Downscale the longest side to this before detection (0 = full resolution)
+    MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 40_000_000))  # Reject larger images (40MP) before decoding
+    MIN_IMAGE_SIDE = int(os.getenv('MIN_IMAGE_SIDE', os.getenv('MIN_FACE_SIZE', 80)))  # Reject images whose shorter side cannot hold a face
+
     # Anti-Spoofing
-    ANTI_SPOOFING_ENABLED = os.getenv('ANTI_SPOOFING_ENABLED', 'True').lower() == 'true'
+    ANTI_SPOOFING_ENABLED = os.getenv('ANTI_SPOOFING_ENABLED', 'False').lower() == 'true'  # Off until the thresholds are calibrated on kiosk photos
     MIN_FACE_SIZE = int(os.getenv('MIN_FACE_SIZE', 80))  # Minimum face size in pixels
+    LIVENESS_TEXTURE_MIN = float(os.getenv('LIVENESS_TEXTURE_MIN', 0.55))  # Minimum micro-texture (LBP entropy, 0-1) of a live face
+    LIVENESS_MOIRE_MAX = float(os.getenv('LIVENESS_MOIRE_MAX', 3.0))  # Maximum high-frequency peak (screen/print pattern)
+    LIVENESS_CNN_MARGIN = float(os.getenv('LIVENESS_CNN_MARGIN', 0.15))  # Borderline band around the thresholds sent to the CNN
+    LIVENESS_MODEL_PATH = os.getenv('LIVENESS_MODEL_PATH', '')  # Optional ONNX anti-spoofing CNN (requires onnxruntime)
+    LIVENESS_MODEL_INPUT = int(os.getenv('LIVENESS_MODEL_INPUT', 80))  # CNN input side in pixels
+    LIVENESS_MODEL_LIVE_INDEX = int(os.getenv('LIVENESS_MODEL_LIVE_INDEX', 1))  # Output class meaning "live"
+    LIVENESS_CNN_THRESHOLD = float(os.getenv('LIVENESS_CNN_THRESHOLD', 0.5))  # Minimum CNN live probability
+
+    # Face Quality Gate (on the detection crop, before embedding)
+    QUALITY_GATE_ENABLED = os.getenv('QUALITY_GATE_ENABLED', 'True').lower() == 'true'
+    QUALITY_MIN_CONFIDENCE = float(os.getenv('QUALITY_MIN_CONFIDENCE', 0.0))  # Minimum detector confidence (0 = not checked)
+    QUALITY_MAX_ROLL = float(os.getenv('QUALITY_MAX_ROLL', 30))  # Maximum head tilt in degrees (from the eyes)
+    QUALITY_MAX_YAW = float(os.getenv('QUALITY_MAX_YAW', 0.35))  # Maximum eye offset from the face center (0-1, turned head)
+    QUALITY_MIN_BRIGHTNESS = float(os.getenv('QUALITY_MIN_BRIGHTNESS', 40))  # Minimum mean gray level of the face (0-255)
+    QUALITY_MAX_BRIGHTNESS = float(os.getenv('QUALITY_MAX_BRIGHTNESS', 220))  # Maximum mean gray level of the face (0-255)
+    QUALITY_MIN_CONTRAST = float(os.getenv('QUALITY_MIN_CONTRAST', 15))  # Minimum gray level standard deviation
+    QUALITY_MIN_SHARPNESS = float(os.getenv('QUALITY_MIN_SHARPNESS', 15))  # Minimum variance of the Laplacian (blur)
+
+    # Stricter profile for /enroll: a poor enrollment photo hurts every later punch
+    ENROLL_QUALITY_MIN_CONFIDENCE = float(os.getenv('ENROLL_QUALITY_MIN_CONFIDENCE', 0.9))
+    ENROLL_QUALITY_MAX_ROLL = float(os.getenv('ENROLL_QUALITY_MAX_ROLL', 15))
+    ENROLL_QUALITY_MAX_YAW = float(os.getenv('ENROLL_QUALITY_MAX_YAW', 0.2))
+    ENROLL_QUALITY_MIN_BRIGHTNESS = float(os.getenv('ENROLL_QUALITY_MIN_BRIGHTNESS', 60))
+    ENROLL_QUALITY_MAX_BRIGHTNESS = float(os.getenv('ENROLL_QUALITY_MAX_BRIGHTNESS', 200))
+    ENROLL_QUALITY_MIN_CONTRAST = float(os.getenv('ENROLL_QUALITY_MIN_CONTRAST', 25))
+    ENROLL_QUALITY_MIN_SHARPNESS = float(os.getenv('ENROLL_QUALITY_MIN_SHARPNESS', 40))
 
     # CORS
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:8000,http://localhost:8080').split(',')
@@ -69,6 +157,7 @@ class Config:
     # Cache
     CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'True').lower() == 'true'
     CACHE_TTL = int(os.getenv('CACHE_TTL', 300))  # 5 minutes
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))  # Per cache (probes and results), least recently used evicted
 
     @staticmethod
     def get_threshold():
@@ -143,31 +143,10 @@ echo -e "   Timeout: ${TIMEOUT}s"
 # 8. Run health check on startup (optional)
 # ========================================
 
-# Pre-load DeepFace models for faster first request
-echo -e "${YELLOW}Pre-loading DeepFace models (this may take a minute)...${NC}"
-
-python -c "
-try:
-    from deepface import DeepFace
-    import os
-
-    # Pre-build models
-    model_name = os.getenv('MODEL_NAME', 'VGG-Face')
-    detector = os.getenv('DETECTOR_BACKEND', 'opencv')
-
-    print(f'Loading model: {model_name}')
-    print(f'Loading detector: {detector}')
-
-    # This will download and cache models
-    DeepFace.build_model(model_name)
-
-    print('✓ Models loaded successfully')
-except Exception as e:
-    print(f'WARNING: Failed to pre-load models: {e}')
-    print('Models will be loaded on first request')
-" || echo -e "${YELLOW}⚠ Model pre-loading skipped${NC}"
-
-echo -e "${GREEN}✓${NC} Pre-loading complete"
+# Models, detector and embedding gallery are preloaded by the gunicorn
+# master (preload_app in gunicorn.conf.py) and shared by all workers;
+# each worker runs a warm-up inference before accepting requests.
+echo -e "${GREEN}✓${NC} Models will be preloaded by the gunicorn master before forking"
 
 # ========================================
 # 9. Start Gunicorn
@@ -186,13 +165,8 @@ echo ""
 
 # Start gunicorn
 exec gunicorn \
+    --config gunicorn.conf.py \
     --bind "$HOST:$PORT" \
     --workers "$WORKERS" \
-    --worker-class sync \
     --timeout "$TIMEOUT" \
-    --access-logfile logs/access.log \
-    --error-logfile logs/error.log \
-    --log-level info \
-    --capture-output \
-    --enable-stdio-inheritance \
     app:app
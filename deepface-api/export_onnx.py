@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Export ONNX - Convert the recognition model for INFERENCE_BACKEND=onnx
+Sistema de Ponto Eletrônico Brasileiro
+
+Builds the Keras model of MODEL_NAME through DeepFace, converts it with
+tf2onnx and, with --quantize, also writes an int8 copy with ONNX Runtime
+dynamic quantization (8-bit weights, activations quantized per call).
+Each file is checked against the TensorFlow embeddings of the same face
+crops (real faces from --samples, otherwise random crops): an export
+whose worst cosine distance exceeds its tolerance is deleted and the
+script fails. The result is recorded in a JSON sidecar that the service
+reads when it loads the model.
+
+Requires tensorflow, tf2onnx and onnxruntime (tf2onnx is only needed here).
+
+Usage:
+    python export_onnx.py
+    python export_onnx.py --quantize --samples ../storage/faces
+    MODEL_NAME=Facenet512 python export_onnx.py --output-dir /opt/models
+"""
+
+import os
+import sys
+import json
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+# The reference embeddings must come from TensorFlow
+os.environ['INFERENCE_BACKEND'] = 'deepface'
+
+from config import Config  # noqa: E402
+from inference import detect_faces  # noqa: E402
+from inference_onnx import metadata_path, model_path  # noqa: E402
+
+# Photo files considered as samples
+SAMPLE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def reference_batch(samples_dir, max_samples, input_shape, seed=0):
+    """
+    BGR float32 face crops to compare the exports on: detected faces of sample photos, or random crops
+    """
+    crops = []
+
+    for root, _, files in os.walk(samples_dir or ''):
+        for name in sorted(files):
+            if len(crops) >= max_samples:
+                break
+
+            if name.lower().endswith(SAMPLE_EXTENSIONS):
+                try:
+                    crops.append(detect_faces(os.path.join(root, name))[0]['face'][:, :, ::-1])
+                except ValueError:
+                    continue
+
+    if crops:
+        return np.stack(crops).astype(np.float32), 'faces'
+
+    rng = np.random.default_rng(seed)
+
+    return rng.random((max_samples, *input_shape), dtype=np.float32), 'random'
+
+
+def normalize(embeddings):
+    """
+    What embed_faces returns for the raw model outputs (VGG-Face is l2-normalized outside the network)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    if Config.MODEL_NAME == 'VGG-Face':
+        embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10)
+
+    return embeddings
+
+
+def compare(reference, candidate):
+    """
+    Worst cosine distance and absolute difference between matching rows
+    """
+    dot = (reference * candidate).sum(axis=1)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1) + 1e-10
+
+    return float((1 - dot / norms).max()), float(np.abs(reference - candidate).max())
+
+
+def onnx_embeddings(path, batch):
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+    return normalize(session.run(None, {session.get_inputs()[0].name: batch})[0])
+
+
+def check_export(path, reference, batch, tolerance, metadata):
+    """
+    Record the distance of an export to TensorFlow in its sidecar; delete it if out of tolerance
+    """
+    max_distance, max_abs_diff = compare(reference, onnx_embeddings(path, batch))
+    metadata = {**metadata, 'max_distance': max_distance, 'max_abs_diff': max_abs_diff, 'tolerance': tolerance}
+    print(f'{path}: max cosine distance {max_distance:.6f}, max abs diff {max_abs_diff:.6f} '
+          f'(tolerance {tolerance}) - {os.path.getsize(path) / 1024 / 1024:.1f} MB')
+
+    if max_distance > tolerance:
+        os.remove(path)
+        print(f'{path} is out of tolerance and was removed', file=sys.stderr)
+        return False
+
+    with open(metadata_path(path), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the recognition model to ONNX for INFERENCE_BACKEND=onnx')
+    parser.add_argument('--output-dir', help='Directory of the exported files (default: models/)')
+    parser.add_argument('--opset', type=int, default=13, help='ONNX opset')
+    parser.add_argument('--quantize', action='store_true', help='Also write an int8 dynamically quantized model')
+    parser.add_argument('--weight-type', choices=('uint8', 'int8'), default='uint8',
+                        help='Quantized weight type (uint8 runs Conv layers on every ONNX Runtime CPU build)')
+    parser.add_argument('--samples', default=Config.FACES_DB_PATH,
+                        help='Photos whose faces the exports are checked on (random crops if none)')
+    parser.add_argument('--max-samples', type=int, default=32, help='Faces used for the check')
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='Maximum cosine distance to TensorFlow')
+    parser.add_argument('--int8-tolerance', type=float, default=0.02,
+                        help='Maximum cosine distance to TensorFlow of the quantized model')
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    client = DeepFace.build_model(Config.MODEL_NAME)
+    model = getattr(client, 'model', None)
+
+    if not hasattr(model, 'predict_on_batch'):
+        print(f'{Config.MODEL_NAME} is not a Keras model and cannot be exported', file=sys.stderr)
+        return 1
+
+    path = model_path(Config.MODEL_NAME, quantized=False)
+
+    if args.output_dir:
+        path = os.path.join(args.output_dir, os.path.basename(path))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Keras layout (batch, height, width, channels) with a dynamic batch axis
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=args.opset, output_path=path)
+
+    batch, source = reference_batch(args.samples, args.max_samples, model.input_shape[1:])
+    reference = normalize(model(batch, training=False))
+    print(f'Checking against TensorFlow on {len(batch)} {source} crops')
+
+    metadata = {
+        'model_name': Config.MODEL_NAME,
+        'input_shape': list(client.input_shape),
+        'opset': args.opset,
+        'quantized': False,
+        'samples': len(batch),
+        'sample_source': source,
+        'tensorflow': tf.__version__,
+        'exported_at': datetime.now().isoformat()
+    }
+
+    if not check_export(path, reference, batch, args.tolerance, metadata):
+        return 1
+
+    if args.quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = model_path(Config.MODEL_NAME, quantized=True)
+
+        if args.output_dir:
+            quantized_path = os.path.join(args.output_dir, os.path.basename(quantized_path))
+
+        weight_type = QuantType.QUInt8 if args.weight_type == 'uint8' else QuantType.QInt8
+        quantize_dynamic(path, quantized_path, weight_type=weight_type)
+
+        quantized = {**metadata, 'quantized': True, 'weight_type': args.weight_type}
+
+        if not check_export(quantized_path, reference, batch, args.int8_tolerance, quantized):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1135 @@
+"""
+Face Gallery - In-memory embedding store
+Sistema de Ponto Eletrônico Brasileiro
+
+Keeps every enrolled embedding resident in memory behind a search index
+(exact for small galleries, IVF approximate search for large ones), so
+recognition never scans the faces directory. Enrollments and deletions
+update the index in place and are appended to a journal in the faces
+directory; the other workers notice them through a shared generation
+counter and replay only the new entries. With the embedding store
+enabled, the gallery is served from a memory-mapped snapshot that the
+journal is periodically compacted into.
+
+An employee can have several templates (photos with and without glasses,
+different lighting). The index holds one centroid per employee, so search
+cost does not grow with the number of templates; only the best centroid
+candidates are re-ranked by their closest individual template.
+"""
+
+import os
+import json
+import mmap
+import fcntl
+import struct
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from index import BruteForceIndex, compute_distance_matrix, create_index, prepare_vectors
+from store import EmbeddingStore, write_store
+
+logger = logging.getLogger(__name__)
+
+
+def template_path(db_path, employee_id):
+    """
+    Path of the persisted embedding, stored next to <employee_id>_face.jpg
+    """
+    return os.path.join(db_path, employee_id, f'{employee_id}_embedding.npz')
+
+
+def save_template(path, embedding, model_name, detector_backend, align, image_hash, partition=''):
+    """
+    Persist the templates of an employee with the settings that produced them
+
+    embedding is one vector or a (templates, dims) matrix; the first row
+    is the template of the enrolled photo (image_hash).
+    """
+    embeddings = np.asarray(embedding, dtype=np.float32)
+    embeddings = embeddings.reshape(-1, embeddings.shape[-1])
+    temp_path = f'{path}.tmp'
+
+    with open(temp_path, 'wb') as f:
+        np.savez(
+            f,
+            embedding=embeddings[0],
+            embeddings=embeddings,
+            model_name=model_name,
+            detector_backend=detector_backend,
+            align=bool(align),
+            image_hash=image_hash or '',
+            partition=partition or ''
+        )
+
+    # Atomic replace so a crash never leaves a truncated template behind
+    os.replace(temp_path, path)
+
+
+def load_template(path):
+    """
+    Load a persisted embedding and its metadata
+    """
+    with np.load(path, allow_pickle=False) as data:
+        embedding = data['embedding'].astype(np.float32)
+
+        return {
+            'embedding': embedding,
+            'embeddings': (
+                data['embeddings'].astype(np.float32) if 'embeddings' in data.files else embedding.reshape(1, -1)
+            ),
+            'model_name': str(data['model_name']),
+            'detector_backend': str(data['detector_backend']),
+            'align': bool(data['align']),
+            'image_hash': str(data['image_hash']),
+            'partition': str(data['partition']) if 'partition' in data.files else ''
+        }
+
+
+def store_path(db_path):
+    """
+    Path of the memory-mapped embedding store of a faces directory
+    """
+    return os.path.join(db_path, '.gallery_store')
+
+
+def face_path(db_path, employee_id):
+    """
+    Path of the gallery image of an employee
+    """
+    return os.path.join(db_path, employee_id, f'{employee_id}_face.jpg')
+
+
+def file_hash(path):
+    """
+    SHA-256 of a file on disk
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class GalleryJournal:
+    """
+    Append-only log of gallery changes shared by every worker of a faces directory
+
+    Each change is one JSON line, appended under an exclusive flock, after
+    which the generation counter (a memory-mapped file next to the journal)
+    is incremented. Checking for changes made by other workers is a single
+    memory read; only when the counter moved does a worker read the
+    journal, from the offset it had reached.
+
+    The counter file also holds the epoch: the generation the embedding
+    store was last compacted at. Each epoch has its own journal file with
+    only the changes made after it; the previous one is kept for workers
+    that have not caught up yet.
+    """
+
+    JOURNAL_FILE = '.gallery_journal'
+    GENERATION_FILE = '.gallery_generation'
+
+    # generation, epoch
+    COUNTER = struct.Struct('<QQ')
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.generation_path = os.path.join(db_path, self.GENERATION_FILE)
+        self.epoch = 0
+        self.offset = 0
+        self.generation = 0
+        self._counter = None
+
+        # flock conflicts between two opens of the same file, even in one
+        # process, so nested locked() calls reuse the outer lock
+        self._local_lock = threading.RLock()
+        self._depth = 0
+
+    def journal_path(self, epoch):
+        return os.path.join(self.db_path, f'{self.JOURNAL_FILE}.{epoch}')
+
+    @property
+    def path(self):
+        return self.journal_path(self.epoch)
+
+    def open(self):
+        """
+        Create the counter if needed and start following the journal from its current end
+        """
+        os.makedirs(self.db_path, exist_ok=True)
+
+        with self.locked():
+            if os.path.getsize(self.generation_path) < self.COUNTER.size:
+                with open(self.generation_path, 'r+b') as f:
+                    f.write(self.COUNTER.pack(0, 0))
+
+            with open(self.generation_path, 'r+b') as f:
+                self._counter = mmap.mmap(f.fileno(), self.COUNTER.size)
+
+            self.generation, self.epoch = self.counters()
+            self.offset = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+
+    def follow(self, generation):
+        """
+        Replay the current journal from its start, skipping entries up to generation
+        """
+        _, self.epoch = self.counters()
+        self.offset = 0
+        self.generation = generation
+
+    def counters(self):
+        """
+        (latest generation written by any worker, current epoch)
+        """
+        return self.COUNTER.unpack_from(self._counter, 0) if self._counter is not None else (0, 0)
+
+    def current(self):
+        return self.counters()[0]
+
+    @contextmanager
+    def locked(self):
+        """
+        Exclusive lock across processes, held while a change is appended
+        """
+        with self._local_lock:
+            if self._depth:
+                self._depth += 1
+
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+
+                return
+
+            with open(self.generation_path, 'a+b') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                self._depth = 1
+
+                try:
+                    yield
+                finally:
+                    self._depth = 0
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _read(self, path, offset):
+        """
+        (entries, bytes consumed) of the complete lines after offset, or None if the file is gone
+        """
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        end = data.rfind(b'\n') + 1
+        entries = []
+
+        for line in data[:end].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning(f'Skipping corrupted gallery journal entry: {line[:80]!r}')
+
+        return entries, end
+
+    def read_new(self):
+        """
+        Complete entries newer than the last one applied (a partial last line is left for later)
+
+        After a compaction the rest of the previous journal is read first,
+        then the new one from its start. Returns None when entries were lost
+        (the previous journal is gone): the gallery must reload the store.
+        """
+        _, epoch = self.counters()
+        entries = []
+
+        if epoch != self.epoch:
+            drained = self._read(self.path, self.offset)
+            entries += drained[0] if drained is not None else []
+            newest = max([self.generation] + [int(entry.get('generation', 0)) for entry in entries])
+
+            if newest < epoch:
+                return None
+
+            self.epoch = epoch
+            self.offset = 0
+
+        current = self._read(self.path, self.offset)
+
+        if current is not None:
+            entries += current[0]
+            self.offset += current[1]
+
+        entries = [entry for entry in entries if int(entry.get('generation', 0)) > self.generation]
+
+        if entries:
+            self.generation = max(int(entry['generation']) for entry in entries)
+
+        return entries
+
+    def append(self, op, employee_id, partition=None):
+        """
+        Record a change and publish its generation; call with locked() held
+        """
+        generation = self.current() + 1
+        line = json.dumps({'generation': generation, 'op': op, 'employee_id': employee_id,
+                           'partition': partition or ''}) + '\n'
+
+        with open(self.path, 'ab') as f:
+            f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Published after the entry is on disk, so readers always find it
+        struct.pack_into('<Q', self._counter, 0, generation)
+        self.offset = os.path.getsize(self.path)
+        self.generation = generation
+
+        return generation
+
+    def rotate(self, generation):
+        """
+        Start the journal epoch of a store compacted at generation; call with locked() held
+
+        Entries newer than generation are carried over to the new journal,
+        and journals older than the previous epoch are deleted.
+        """
+        _, epoch = self.counters()
+        carried = self._read(self.journal_path(epoch), 0)
+        lines = [json.dumps(entry) + '\n' for entry in (carried[0] if carried else [])
+                 if int(entry.get('generation', 0)) > generation]
+
+        temp_path = f'{self.journal_path(generation)}.tmp'
+
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, self.journal_path(generation))
+        struct.pack_into('<Q', self._counter, 8, generation)
+
+        for name in os.listdir(self.db_path):
+            prefix, _, suffix = name.rpartition('.')
+
+            if prefix == self.JOURNAL_FILE and suffix.isdigit() and int(suffix) < epoch:
+                os.remove(os.path.join(self.db_path, name))
+
+
+def select_templates(templates, embedding, max_templates, metric):
+    """
+    Templates after adding one; when full, the new one replaces the most redundant extra template
+
+    The first template (the enrolled photo) is always kept. The extra
+    template closest to the new one is dropped, so the set stays as varied
+    as possible. With max_templates of 1 there is no room for extras.
+    """
+    templates = np.asarray(templates, dtype=np.float32).reshape(-1, len(embedding))
+    embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+
+    if max_templates < 2:
+        return templates[:1]
+
+    # A lowered limit drops the extras past it
+    templates = templates[:max_templates]
+
+    if len(templates) < max_templates:
+        return np.vstack([templates, embedding])
+
+    distances = compute_distance_matrix(templates[1:], embedding, metric)[0]
+    keep = np.delete(templates, 1 + int(np.argmin(distances)), axis=0)
+
+    return np.vstack([keep, embedding])
+
+
+def merge_matches(match_lists, k):
+    """
+    Merge per-partition (key, distance) lists into one sorted top-k list
+    """
+    merged = [match for matches in match_lists for match in matches]
+    merged.sort(key=lambda match: match[1])
+
+    return merged[:k]
+
+
+class FaceGallery:
+    """
+    Resident gallery of enrolled face embeddings (one or more templates per employee)
+
+    Each employee is indexed by one vector: its template, or the centroid
+    of its templates when several were added. Embeddings are split into
+    partitions (a company or site key given at enrollment). Each partition
+    has its own search index, so a scoped search costs as much as that
+    partition and never matches another one.
+    """
+
+    DEFAULT_PARTITION = ''
+
+    def __init__(self, model_name, detector_backend, align=True, distance_metric='cosine',
+                 ann_min_size=0, ann_n_lists=0, ann_n_probe=8, store_enabled=False, store_dtype='float32',
+                 compact_every=1000, max_templates=1, rerank_candidates=10):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.align = align
+        self.distance_metric = distance_metric
+        self.ann_min_size = ann_min_size
+        self.ann_n_lists = ann_n_lists
+        self.ann_n_probe = ann_n_probe
+        self.store_enabled = store_enabled
+        self.store_dtype = store_dtype
+        self.compact_every = compact_every
+        self.max_templates = max(1, max_templates)
+        self.rerank_candidates = rerank_candidates
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.db_path = None
+        self.journal = None
+        self.store = None
+        self._compacting = threading.Lock()
+        self._stats = {'synced_changes': 0, 'compactions': 0}
+
+        # partition -> index, employee_id -> partition, and employee_id ->
+        # prepared templates of employees that have more than one
+        self._indexes = {}
+        self._partition_of = {}
+        self._templates = {}
+
+    def __len__(self):
+        return len(self._partition_of)
+
+    def __contains__(self, employee_id):
+        return str(employee_id) in self._partition_of
+
+    def _create_index(self, size):
+        return create_index(size, self.distance_metric, self.ann_min_size, self.ann_n_lists, self.ann_n_probe)
+
+    def _maybe_switch_index(self, partition):
+        """
+        Move a partition to IVF once it reaches ann_min_size, and back to exact
+        search once it shrinks below half of it (hysteresis avoids flapping)
+        """
+        index = self._indexes.get(partition)
+
+        if index is None or not self.ann_min_size:
+            return
+
+        size = len(index)
+
+        if index.kind == 'exact' and size >= self.ann_min_size:
+            wanted = 'ivf'
+        elif index.kind == 'ivf' and size < self.ann_min_size / 2:
+            wanted = 'exact'
+        else:
+            return
+
+        new_index = self._create_index(size if wanted == 'ivf' else 0)
+        new_index.build(*index.items())
+        self._indexes[partition] = new_index
+
+        logger.info(f'Gallery partition "{partition}" switched to {wanted} search at {size} embeddings')
+
+    def is_current(self, template, image_hash):
+        """
+        Check whether a persisted template matches the current settings and image
+        """
+        return (
+            template['model_name'] == self.model_name
+            and template['detector_backend'] == self.detector_backend
+            and template['align'] == self.align
+            and template['image_hash'] == image_hash
+        )
+
+    def load(self, db_path, embed_func):
+        """
+        Build the gallery from the embedding store, or else the faces directory
+
+        Runs once at startup. A store written with the current settings is
+        mapped as-is and only the journal entries newer than it are applied,
+        after checking it against the files in the faces directory.
+        Otherwise every image is read: embeddings persisted at enrollment
+        time are used as-is; images without a current template (older
+        enrollments, a changed model or a replaced photo) are embedded with
+        embed_func once and the template is written back, so no request ever
+        embeds gallery images. The result is then compacted into a new store.
+        """
+        if not os.path.isdir(db_path):
+            logger.warning(f'Faces DB path not found: {db_path}')
+
+        # Follow the journal from before the scan: changes made during the
+        # scan are replayed afterwards (replaying is idempotent)
+        self.db_path = db_path
+        self.journal = GalleryJournal(db_path)
+
+        try:
+            self.journal.open()
+        except OSError as e:
+            self.journal = None
+            logger.warning(f'Gallery journal disabled, other workers will not see changes: {str(e)}')
+
+        if self.store_enabled and self.journal is not None:
+            self._sweep_stale_stores()
+
+        if self.store_enabled and self.journal is not None and self._load_store():
+            replayed = set()
+            self.sync(lambda op, employee_id, embedding, partition: replayed.add(employee_id))
+
+            if self._check_directory(replayed):
+                logger.info(
+                    f'Face gallery mapped: {len(self)} embeddings in {len(self._indexes)} partitions '
+                    f'from {self.store.path} (generation {self.generation})'
+                )
+
+                return len(self)
+
+        count = self._scan(db_path, embed_func)
+
+        # Serve the freshly written store in place, so forked workers share it
+        if self.store_enabled and self.journal is not None and self.compact(force=True):
+            self._load_store()
+            self.sync()
+
+        return count
+
+    def store_metadata(self):
+        """
+        Settings a store must have been written with to be used as-is
+        """
+        return {
+            'model_name': self.model_name,
+            'detector_backend': self.detector_backend,
+            'align': bool(self.align),
+            'distance_metric': self.distance_metric
+        }
+
+    def _template_mtimes(self, employee_ids=None):
+        """
+        employee_id -> mtime (ns) of the template, or None without one, of every employee with a gallery image
+        """
+        if employee_ids is None:
+            employee_ids = os.listdir(self.db_path) if os.path.isdir(self.db_path) else []
+
+        mtimes = {}
+
+        for employee_id in employee_ids:
+            if not os.path.isfile(face_path(self.db_path, employee_id)):
+                continue
+
+            try:
+                mtimes[employee_id] = os.stat(template_path(self.db_path, employee_id)).st_mtime_ns
+            except OSError:
+                mtimes[employee_id] = None
+
+        return mtimes
+
+    def _check_directory(self, replayed):
+        """
+        Reconcile a mapped store with the faces directory; False if it must be rebuilt by a scan
+
+        Files can change without going through the journal (a directory
+        removed by hand or by a client whose DELETE failed). Employees whose
+        directory is gone are dropped; a template that is new, missing or
+        rewritten since the store (and not by a journaled change, already
+        replayed) needs the scan. Costs one stat per employee.
+        """
+        recorded = self.store.metadata.get('template_mtimes', {})
+        on_disk = self._template_mtimes()
+
+        changed = [
+            employee_id for employee_id, mtime in on_disk.items()
+            if employee_id not in replayed and (employee_id not in self or recorded.get(employee_id) != mtime)
+        ]
+
+        if changed:
+            logger.info(f'{len(changed)} templates changed outside the gallery journal (e.g. {changed[0]}), '
+                        f'rebuilding the embedding store from the faces directory')
+            return False
+
+        removed = [employee_id for employee_id in list(self._partition_of) if employee_id not in on_disk]
+
+        if removed:
+            for employee_id in removed:
+                self.remove(employee_id)
+
+            logger.info(f'Dropped {len(removed)} employees whose gallery files are gone (e.g. {removed[0]})')
+
+            # Serve a store without them, so forked workers share the corrected mapping
+            if self.compact(force=True):
+                self._load_store()
+                self.sync()
+
+        return True
+
+    def _sweep_stale_stores(self):
+        """
+        Delete store files left by compactions whose process died mid-write
+        """
+        prefix = os.path.basename(store_path(self.db_path)) + '.'
+
+        for name in os.listdir(self.db_path) if os.path.isdir(self.db_path) else []:
+            pid = name[len(prefix):].split('.')[0]
+
+            if not name.startswith(prefix) or not pid.isdigit():
+                continue
+
+            # Left alone while its writer is alive: it may be compacting right now
+            if int(pid) != os.getpid():
+                try:
+                    os.kill(int(pid), 0)
+                    continue
+                except ProcessLookupError:
+                    pass
+                except PermissionError:
+                    continue
+
+            try:
+                os.remove(os.path.join(self.db_path, name))
+                logger.info(f'Removed stale embedding store file {name}')
+            except OSError:
+                pass
+
+    def _load_store(self):
+        """
+        Map the embedding store and serve its partitions in place; False if unusable
+        """
+        path = store_path(self.db_path)
+
+        if not os.path.isfile(path):
+            return False
+
+        with self.journal.locked():
+            try:
+                store = EmbeddingStore(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f'Ignoring embedding store {path}: {str(e)}')
+                return False
+
+            _, epoch = self.journal.counters()
+
+            settings = {key: value for key, value in store.metadata.items() if key != 'template_mtimes'}
+
+            # Changes between an older store and the current epoch are no longer journaled
+            if settings != self.store_metadata() or store.generation < epoch:
+                logger.info(f'Embedding store {path} is stale, rebuilding it from the faces directory')
+                return False
+
+            self.journal.follow(store.generation)
+
+        indexes = {}
+        partition_of = {}
+
+        for partition, vectors, sq_norms, keys in store.partitions():
+            index = self._create_index(len(keys))
+            index.attach(vectors, keys, sq_norms)
+            indexes[partition] = index
+            partition_of.update({employee_id: partition for employee_id in keys})
+
+        with self._lock:
+            self._indexes = indexes
+            self._partition_of = partition_of
+            self._templates = {
+                employee_id: np.asarray(templates, dtype=np.float32) for employee_id, templates in store.templates()
+            }
+            self.store = store
+
+        return True
+
+    def _scan(self, db_path, embed_func):
+        partitions = {}
+        templates = {}
+        rebuilt = 0
+
+        for employee_id in sorted(os.listdir(db_path)) if os.path.isdir(db_path) else []:
+            image_path = face_path(db_path, employee_id)
+
+            if not os.path.isfile(image_path):
+                continue
+
+            try:
+                image_hash = file_hash(image_path)
+                path = template_path(db_path, employee_id)
+                template = load_template(path) if os.path.isfile(path) else None
+                partition = template['partition'] if template is not None else self.DEFAULT_PARTITION
+
+                if template is not None and self.is_current(template, image_hash):
+                    embedding = template['embeddings']
+                else:
+                    # Extra templates have no photo to re-embed; they must be enrolled again
+                    if template is not None and len(template['embeddings']) > 1:
+                        logger.warning(f'Dropping {len(template["embeddings"]) - 1} extra templates of '
+                                       f'{employee_id}: they were made with other settings')
+
+                    embedding = np.asarray(embed_func(image_path), dtype=np.float32)
+                    save_template(path, embedding, self.model_name, self.detector_backend, self.align,
+                                  image_hash, partition)
+                    rebuilt += 1
+
+                vector, prepared = self._split_templates(embedding)
+                embeddings, employee_ids = partitions.setdefault(partition, ([], []))
+                embeddings.append(vector)
+                employee_ids.append(employee_id)
+
+                if prepared is not None:
+                    templates[employee_id] = prepared
+            except Exception as e:
+                logger.warning(f'Skipping gallery image {image_path}: {str(e)}')
+
+        indexes = {}
+        partition_of = {}
+
+        for partition, (embeddings, employee_ids) in partitions.items():
+            index = self._create_index(len(employee_ids))
+            index.build(np.vstack(embeddings), employee_ids)
+            indexes[partition] = index
+            partition_of.update({employee_id: partition for employee_id in employee_ids})
+
+        with self._lock:
+            self._indexes = indexes
+            self._partition_of = partition_of
+            self._templates = templates
+            self.store = None
+
+        self.sync()
+
+        logger.info(
+            f'Face gallery loaded: {len(partition_of)} embeddings in {len(indexes)} partitions '
+            f'from {db_path} ({rebuilt} rebuilt)'
+        )
+
+        return len(partition_of)
+
+    @property
+    def generation(self):
+        return self.journal.generation if self.journal is not None else 0
+
+    def sync(self, on_change=None):
+        """
+        Apply the changes other workers journaled since the last sync
+
+        Costs one shared-memory read when nothing changed. on_change(op,
+        employee_id, embedding, partition) is called for every applied
+        change (embedding is None for a deletion). Returns the number of
+        changes applied.
+        """
+        if self.journal is None or self.journal.current() == self.journal.generation:
+            return 0
+
+        with self._sync_lock:
+            return self._replay(on_change)
+
+    def _replay(self, on_change=None):
+        entries = self.journal.read_new()
+
+        if entries is None:
+            # More than one compaction behind: the missed entries only exist in the store
+            logger.warning('Gallery journal entries were compacted away, reloading the embedding store')
+
+            if not self._load_store():
+                logger.error('Embedding store unusable, gallery keeps its current state')
+                self.journal.follow(self.journal.current())
+                return 0
+
+            if on_change is not None:
+                on_change('reload', None, None, None)
+
+            entries = self.journal.read_new() or []
+
+        applied = 0
+
+        for entry in entries:
+            op = entry.get('op')
+            employee_id = str(entry.get('employee_id'))
+            embedding = None
+            partition = entry.get('partition') or self.DEFAULT_PARTITION
+
+            if op == 'enroll':
+                path = template_path(self.db_path, employee_id)
+
+                # A template deleted since then is followed by its delete entry
+                if not os.path.isfile(path):
+                    continue
+
+                try:
+                    template = load_template(path)
+                except Exception as e:
+                    logger.warning(f'Could not replay enrollment of {employee_id}: {str(e)}')
+                    continue
+
+                embedding = template['embeddings']
+                partition = template['partition']
+                self.add(employee_id, embedding, partition)
+            elif op == 'delete':
+                self.remove(employee_id)
+            else:
+                continue
+
+            applied += 1
+
+            if on_change is not None:
+                on_change(op, employee_id, embedding, partition)
+
+        if applied:
+            self._stats['synced_changes'] += applied
+            logger.info(f'Gallery synced {applied} changes from other workers (generation {self.generation})')
+
+        return applied
+
+    @contextmanager
+    def _changing(self, on_change=None):
+        """
+        Serialize a local change with every worker, replaying theirs first
+        """
+        if self.journal is None:
+            yield
+            return
+
+        with self._sync_lock, self.journal.locked():
+            self._replay(on_change)
+            yield
+
+        generation, epoch = self.journal.counters()
+
+        if self.store_enabled and self.compact_every and generation - epoch >= self.compact_every:
+            threading.Thread(target=self.compact, name='gallery-compaction', daemon=True).start()
+
+    def compact(self, force=False):
+        """
+        Write the resident gallery to a new embedding store and start a new journal epoch
+
+        The gallery is copied under the sync lock, the file is written
+        without holding any lock, and only the final rename and the epoch
+        change happen under the journal lock. Workers keep searching their
+        own mapping; the new store is mapped by processes started later.
+        Returns False if another compaction is running or, unless force,
+        got there first.
+        """
+        if self.journal is None or not self._compacting.acquire(blocking=False):
+            return False
+
+        try:
+            with self._sync_lock:
+                self._replay()
+                generation = self.generation
+                partitions = [
+                    (partition, *index.items()) for partition, index in sorted(self._indexes.items())
+                ]
+                templates = sorted(self._templates.items())
+
+                # Template files as of this generation, checked against the faces directory at load
+                metadata = {**self.store_metadata(), 'template_mtimes': self._template_mtimes(list(self._partition_of))}
+
+            path = store_path(self.db_path)
+            new_path = f'{path}.{os.getpid()}.{generation}'
+
+            try:
+                size = write_store(new_path, partitions, generation, metadata, self.store_dtype, templates)
+
+                with self.journal.locked():
+                    _, epoch = self.journal.counters()
+
+                    if epoch >= generation and os.path.isfile(path) and not force:
+                        return False
+
+                    os.replace(new_path, path)
+                    self.journal.rotate(generation)
+            finally:
+                # A failed or superseded write never leaves its file behind
+                if os.path.exists(new_path):
+                    os.remove(new_path)
+
+            self._stats['compactions'] += 1
+            logger.info(f'Embedding store compacted at generation {generation}: '
+                        f'{sum(len(keys) for _, _, keys in partitions)} embeddings, {size} bytes')
+
+            return True
+        finally:
+            self._compacting.release()
+
+    def enroll(self, db_path, employee_id, embedding, image_hash, partition=None, on_change=None, append=False):
+        """
+        Persist the template of a new enrollment and add it to the gallery
+
+        Replaces every template of a re-enrolled employee in place, or with
+        append, adds this one to the employee's templates (up to
+        max_templates; the enrolled photo keeps its template). Other workers
+        pick the change up on their next sync.
+        """
+        employee_id = str(employee_id)
+        path = template_path(db_path, employee_id)
+
+        with self._changing(on_change):
+            embeddings = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+
+            if append and os.path.isfile(path):
+                current = load_template(path)
+                embeddings = select_templates(current['embeddings'], embeddings[0], self.max_templates,
+                                              self.distance_metric)
+                image_hash = current['image_hash']
+                partition = partition or current['partition']
+
+            partition = partition or self.DEFAULT_PARTITION
+            save_template(path, embeddings, self.model_name, self.detector_backend, self.align, image_hash,
+                          partition)
+            self.add(employee_id, embeddings, partition)
+
+            if self.journal is not None:
+                self.journal.append('enroll', employee_id, partition)
+
+        return path
+
+    def delete(self, db_path, employee_id, on_change=None):
+        """
+        Remove an employee's gallery image and template and drop it from the gallery
+
+        Returns False if the employee had neither a template in the gallery
+        nor files on disk.
+        """
+        employee_id = str(employee_id)
+        employee_dir = os.path.join(db_path, employee_id)
+
+        with self._changing(on_change):
+            partition = self.partition_of(employee_id)
+            found = self.remove(employee_id)
+
+            for path in (template_path(db_path, employee_id), face_path(db_path, employee_id)):
+                if os.path.isfile(path):
+                    os.remove(path)
+                    found = True
+
+            if os.path.isdir(employee_dir) and not os.listdir(employee_dir):
+                os.rmdir(employee_dir)
+
+            if found and self.journal is not None:
+                self.journal.append('delete', employee_id, partition)
+
+        return found
+
+    def _split_templates(self, embeddings):
+        """
+        (vector the index stores, prepared templates or None) of an employee's templates
+
+        A single template is indexed as-is; several are indexed by their
+        centroid, taken on vectors prepared for the metric.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        embeddings = embeddings.reshape(-1, embeddings.shape[-1])
+
+        if len(embeddings) == 1:
+            return embeddings[0], None
+
+        prepared = prepare_vectors(embeddings, self.distance_metric)
+
+        return prepared.mean(axis=0), prepared
+
+    def add(self, employee_id, embedding, partition=None):
+        """
+        Insert or replace the templates of an employee (moving partitions if needed)
+
+        embedding is one vector or a (templates, dims) matrix.
+        """
+        employee_id = str(employee_id)
+        partition = partition or self.DEFAULT_PARTITION
+        vector, prepared = self._split_templates(embedding)
+
+        with self._lock:
+            previous = self._partition_of.get(employee_id)
+
+            if partition not in self._indexes:
+                self._indexes[partition] = self._create_index(0)
+
+            # Templates first: a search that finds the centroid re-ranks with them
+            if prepared is not None:
+                self._templates[employee_id] = prepared
+            else:
+                self._templates.pop(employee_id, None)
+
+            # Insert before removing from the old partition, so a concurrent
+            # search never misses the employee
+            self._indexes[partition].add(employee_id, vector)
+            self._partition_of[employee_id] = partition
+            self._maybe_switch_index(partition)
+
+            if previous is not None and previous != partition:
+                self._indexes[previous].remove(employee_id)
+                self._maybe_switch_index(previous)
+
+    def remove(self, employee_id):
+        """
+        Remove an employee from the gallery; returns False if not enrolled
+        """
+        employee_id = str(employee_id)
+
+        with self._lock:
+            partition = self._partition_of.pop(employee_id, None)
+
+            if partition is None:
+                return False
+
+            self._indexes[partition].remove(employee_id)
+            self._templates.pop(employee_id, None)
+            self._maybe_switch_index(partition)
+
+        return True
+
+    def partition_of(self, employee_id):
+        """
+        Partition an employee was enrolled in, or None
+        """
+        return self._partition_of.get(str(employee_id))
+
+    def get(self, employee_id):
+        """
+        Return the indexed embedding (the centroid, with several templates) of an employee, or None
+        """
+        partition = self._partition_of.get(str(employee_id))
+
+        if partition is None:
+            return None
+
+        return self._indexes[partition].get(str(employee_id))
+
+    def templates(self, employee_id):
+        """
+        (templates, dims) matrix of an employee's prepared templates, or None if not enrolled
+        """
+        templates = self._templates.get(str(employee_id))
+
+        if templates is not None:
+            return templates
+
+        vector = self.get(employee_id)
+
+        return None if vector is None else vector.reshape(1, -1)
+
+    def template_count(self, employee_id):
+        templates = self.templates(employee_id)
+        return 0 if templates is None else len(templates)
+
+    def search(self, embedding, partition=None, candidates=None):
+        """
+        Find the closest enrolled employee
+
+        Returns (employee_id, distance) or (None, None) if nothing can match.
+        """
+        probes = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+
+        return self.search_batch(probes, partition=partition, candidates=candidates)[0]
+
+    def search_batch(self, probes, partition=None, candidates=None):
+        """
+        Find the closest enrolled employee for every probe
+
+        partition restricts the search to one partition index; candidates (a
+        list of employee ids) restricts it to those templates only. Without
+        either, every partition is searched and the results merged.
+        Returns a list of (employee_id, distance), in probe order.
+        """
+        results = self.search_top_k_batch(probes, 1, partition=partition, candidates=candidates)
+
+        return [matches[0] if matches else (None, None) for matches in results]
+
+    def search_top_k(self, embedding, k, partition=None, candidates=None):
+        """
+        The k closest enrolled employees, as a sorted list of (employee_id, distance)
+        """
+        probes = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+
+        return self.search_top_k_batch(probes, k, partition=partition, candidates=candidates)[0]
+
+    def search_top_k_batch(self, probes, k, partition=None, candidates=None):
+        """
+        The k closest enrolled employees for every probe, in probe order
+
+        With multi-template employees, the rerank_candidates closest
+        centroids are re-ranked by the distance to their closest template.
+        """
+        probes = np.asarray(probes, dtype=np.float32)
+        k = max(1, int(k))
+
+        if not self._templates:
+            return self._search(probes, k, partition, candidates)
+
+        results = self._search(probes, max(k, self.rerank_candidates), partition, candidates)
+
+        return [self._rerank(probe, matches, k) for probe, matches in zip(probes, results)]
+
+    def _rerank(self, probe, matches, k):
+        """
+        Replace the centroid distance of multi-template employees by their closest template's
+        """
+        reranked = []
+
+        for employee_id, distance in matches:
+            templates = self._templates.get(employee_id)
+
+            if templates is not None:
+                distance = float(compute_distance_matrix(templates, probe, self.distance_metric).min())
+
+            reranked.append((employee_id, distance))
+
+        reranked.sort(key=lambda match: match[1])
+
+        return reranked[:k]
+
+    def _search(self, probes, k, partition=None, candidates=None):
+        if candidates is not None:
+            return self._search_candidates(probes, k, candidates, partition)
+
+        if partition is not None:
+            index = self._indexes.get(partition)
+
+            if index is None:
+                return [[] for _ in range(len(probes))]
+
+            return index.search(probes, k=k)
+
+        per_partition = [index.search(probes, k=k) for index in list(self._indexes.values())]
+
+        return [
+            merge_matches([results[row] for results in per_partition], k)
+            for row in range(len(probes))
+        ]
+
+    def _search_candidates(self, probes, k, candidates, partition=None):
+        """
+        Exact search over an explicit list of employee ids
+        """
+        keys = []
+        vectors = []
+
+        for employee_id in dict.fromkeys(str(candidate) for candidate in candidates):
+            if partition is not None and self._partition_of.get(employee_id) != partition:
+                continue
+
+            vector = self.get(employee_id)
+
+            if vector is not None:
+                keys.append(employee_id)
+                vectors.append(vector)
+
+        if not keys:
+            return [[] for _ in range(len(probes))]
+
+        index = BruteForceIndex(metric=self.distance_metric)
+        index.build(np.vstack(vectors), keys)
+
+        return index.search(probes, k=k)
+
+    def stats(self):
+        indexes = list(self._indexes.values())
+
+        return {
+            'size': len(self),
+            'partitions': len(indexes),
+            'exact_partitions': sum(1 for index in indexes if index.kind == 'exact'),
+            'ivf_partitions': sum(1 for index in indexes if index.kind == 'ivf'),
+            'largest_partition': max((len(index) for index in indexes), default=0),
+            'generation': self.generation,
+            'synced_changes': self._stats['synced_changes'],
+            'compactions': self._stats['compactions'],
+            'templates': len(self) + sum(len(templates) - 1 for templates in list(self._templates.values())),
+            'multi_template_employees': len(self._templates),
+            'store': self.store.stats() if self.store is not None else None
+        }
@@ -0,0 +1,55 @@
+"""
+Gunicorn configuration - DeepFace API
+Sistema de Ponto Eletrônico Brasileiro
+
+The app is imported once in the master (preload_app) so TensorFlow, the
+recognition model, the detector and the embedding gallery are loaded
+before forking and shared copy-on-write by all workers.
+"""
+
+import gc
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+
+# Threads let concurrent requests in one worker meet in the inference
+# micro-batcher instead of queueing behind each other
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+
+# Load models in the master before forking
+preload_app = True
+
+# Next to the app, whatever directory gunicorn is started from
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+
+accesslog = os.path.join(LOG_DIR, 'access.log')
+errorlog = os.path.join(LOG_DIR, 'error.log')
+loglevel = 'info'
+capture_output = True
+enable_stdio_inheritance = True
+
+
+def pre_fork(server, worker):
+    """
+    Move every object loaded so far into the permanent generation, so the
+    garbage collector never touches (and copies) the shared model pages
+    """
+    # ONNX Runtime thread pools are not inherited: each worker opens its own session
+    import inference_onnx
+    inference_onnx.release()
+
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Warm up inference inside each worker before it accepts requests
+    """
+    from config import Config
+
+    if Config.PRELOAD_MODELS and Config.WARMUP_ENABLED:
+        import app
+        app.warmup()
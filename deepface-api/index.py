@@ -0,0 +1,655 @@
+"""
+Search Index - Exact and approximate nearest-neighbour search over embeddings
+Sistema de Ponto Eletrônico Brasileiro
+
+BruteForceIndex compares a probe with every enrolled embedding and is the
+right choice for small galleries. IVFIndex clusters the gallery with
+k-means and only scans the n_probe closest clusters, trading a little
+recall for latency that grows with sqrt(N) instead of N.
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+NORMALIZED_METRICS = ('cosine', 'euclidean_l2')
+
+
+def prepare_vectors(matrix, metric):
+    """
+    float32 rows ready for search: l2-normalized for cosine and euclidean_l2
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+
+    if metric in NORMALIZED_METRICS and matrix.size:
+        matrix = matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10)
+
+    return matrix
+
+
+def squared_norms(matrix):
+    """
+    Row squared norms, cached next to a matrix for euclidean search
+    """
+    return np.einsum('ij,ij->i', matrix, matrix) if matrix.size else np.zeros(len(matrix), dtype=np.float32)
+
+
+def prepared_distances(matrix, matrix_sq_norms, probes, metric):
+    """
+    Distances between prepared probes (rows) and a prepared matrix (columns)
+
+    Every metric reduces to one matrix product: cosine is 1 - dot on unit
+    vectors, euclidean_l2 is sqrt(2 - 2 dot), and euclidean expands
+    |p - m|^2 with the cached row norms.
+    """
+    dots = probes @ matrix.T
+
+    if metric == 'cosine':
+        return np.maximum(1 - dots, 0)
+
+    if metric == 'euclidean_l2':
+        return np.sqrt(np.maximum(2 - 2 * dots, 0))
+
+    if metric == 'euclidean':
+        squared = squared_norms(probes)[:, np.newaxis] - 2 * dots + matrix_sq_norms[np.newaxis, :]
+        return np.sqrt(np.maximum(squared, 0))
+
+    raise ValueError(f'Unsupported distance metric: {metric}')
+
+
+def compute_distance_matrix(matrix, probes, metric):
+    """
+    Distances between every probe (rows) and every row of a matrix (columns)
+    """
+    matrix = prepare_vectors(matrix, metric)
+    probes = prepare_vectors(probes, metric)
+
+    return prepared_distances(matrix, squared_norms(matrix), probes, metric)
+
+
+def compute_distances(matrix, embedding, metric):
+    """
+    Distance between one embedding and every row of a matrix
+    """
+    return compute_distance_matrix(matrix, np.asarray(embedding).reshape(1, -1), metric)[0]
+
+
+# died value of a row no generation has deleted
+ALIVE = np.iinfo(np.int64).max
+
+MIN_CAPACITY = 16
+
+
+def make_segment(matrix, keys, sq_norms=None, capacity=None):
+    """
+    (matrix, squared norms, keys, died) rows; with capacity, copied into buffers with room to grow
+    """
+    keys = np.asarray(keys, dtype=object)
+
+    if sq_norms is None:
+        sq_norms = squared_norms(np.asarray(matrix, dtype=np.float32))
+
+    if capacity is None:
+        return (matrix, sq_norms, keys, np.full(len(keys), ALIVE, dtype=np.int64))
+
+    count = len(keys)
+    buffer = np.zeros((capacity, matrix.shape[1]), dtype=np.float32)
+    buffer[:count] = matrix
+    norm_buffer = np.zeros(capacity, dtype=np.float32)
+    norm_buffer[:count] = sq_norms
+    key_buffer = np.empty(capacity, dtype=object)
+    key_buffer[:count] = keys
+
+    return (buffer, norm_buffer, key_buffer, np.full(capacity, ALIVE, dtype=np.int64))
+
+
+EMPTY_SEGMENT = (np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32), np.array([], dtype=object),
+                 np.zeros(0, dtype=np.int64))
+
+
+class VectorStore:
+    """
+    Prepared vectors with O(1) inserts and deletes and multi-version reads
+
+    Rows live in two segments: base, attached in place and never written
+    (it can be a read-only memory map shared by every worker), and tail, a
+    private buffer new vectors are appended to. A new vector is written
+    past the published tail count, and a removed or replaced row is only
+    marked with the generation that deleted it. The snapshot (segments,
+    count, generation) is then published as one reference, so a search
+    keeps the exact gallery it started with. The tail doubles when full,
+    and everything is compacted into the tail once most rows are dead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # (base, tail, tail count, positions, dead, generation): positions
+        # maps key -> row, numbering base rows first and tail rows after
+        self._snapshot = (EMPTY_SEGMENT, EMPTY_SEGMENT, 0, {}, 0, 0)
+
+    def __len__(self):
+        base, _, tail_count, _, dead, _ = self._snapshot
+        return len(base[2]) + tail_count - dead
+
+    def __contains__(self, key):
+        return key in self._snapshot[3]
+
+    def view(self):
+        """
+        (matrix, squared norms, keys, alive) of every non-empty segment of the current snapshot
+
+        alive is a boolean row mask, or None when no row of the store is dead.
+        """
+        base, tail, tail_count, _, dead, generation = self._snapshot
+        segments = []
+
+        for (matrix, sq_norms, keys, died), count in ((base, len(base[2])), (tail, tail_count)):
+            if count:
+                alive = died[:count] > generation if dead else None
+                segments.append((matrix[:count], sq_norms[:count], keys[:count], alive))
+
+        return segments
+
+    def items(self):
+        """
+        (matrix, keys) of the live rows
+        """
+        matrices = []
+        key_lists = []
+
+        for matrix, _, keys, alive in self.view():
+            matrices.append(matrix if alive is None else matrix[alive])
+            key_lists.append(keys if alive is None else keys[alive])
+
+        if not matrices:
+            return np.zeros((0, 0), dtype=np.float32), np.array([], dtype=object)
+
+        if len(matrices) == 1:
+            return matrices[0], key_lists[0]
+
+        return np.vstack(matrices).astype(np.float32), np.concatenate(key_lists).astype(object)
+
+    def get(self, key):
+        """
+        Stored (prepared) vector of a key, or None
+        """
+        base, tail, _, positions, _, _ = self._snapshot
+        position = positions.get(key)
+
+        if position is None:
+            return None
+
+        if position < len(base[2]):
+            return base[0][position]
+
+        return tail[0][position - len(base[2])]
+
+    def attach(self, matrix, keys, sq_norms=None):
+        """
+        Serve already prepared vectors in place as the base segment (no copy)
+
+        float32 vectors are searched in place. Any other dtype (a float16
+        store) is upcast here, once, into a private float32 copy: searching
+        it directly would upcast the whole matrix on every search.
+        """
+        keys = np.asarray(keys, dtype=object)
+
+        if matrix.dtype != np.float32:
+            matrix = matrix.astype(np.float32)
+
+        with self._lock:
+            self._snapshot = (
+                make_segment(matrix, keys, sq_norms) if len(keys) else EMPTY_SEGMENT, EMPTY_SEGMENT, 0,
+                {key: position for position, key in enumerate(keys)}, 0, 0
+            )
+
+    def build(self, matrix, keys):
+        """
+        Replace the whole content with a private copy
+        """
+        keys = np.asarray(keys, dtype=object)
+
+        with self._lock:
+            self._snapshot = self._copied(matrix, keys, 0)
+
+    @staticmethod
+    def _copied(matrix, keys, generation):
+        if len(keys) == 0:
+            return (EMPTY_SEGMENT, EMPTY_SEGMENT, 0, {}, 0, generation)
+
+        tail = make_segment(matrix, keys, capacity=max(MIN_CAPACITY, 2 * len(keys)))
+
+        return (EMPTY_SEGMENT, tail, len(keys), {key: position for position, key in enumerate(keys)}, 0,
+                generation)
+
+    def add(self, key, vector):
+        """
+        Insert or replace the prepared vector stored under a key
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+
+        with self._lock:
+            base, tail, tail_count, positions, dead, generation = self._snapshot
+
+            if tail_count == len(tail[2]):
+                # Full: grow the tail only; rows keep their numbers, so
+                # positions and the base are untouched
+                grown = make_segment(
+                    tail[0][:tail_count] if tail_count else np.zeros((0, len(vector)), dtype=np.float32),
+                    tail[2][:tail_count], tail[1][:tail_count], capacity=max(MIN_CAPACITY, 2 * tail_count)
+                )
+                grown[3][:tail_count] = tail[3][:tail_count]
+                tail = grown
+
+            matrix, sq_norms, keys, died = tail
+
+            # Written past the tail count, so no published snapshot can see it yet
+            matrix[tail_count] = vector
+            sq_norms[tail_count] = vector @ vector
+            keys[tail_count] = key
+            died[tail_count] = ALIVE
+
+            previous = positions.get(key)
+
+            if previous is not None:
+                self._mark_dead(base, tail, previous, generation + 1)
+                dead += 1
+
+            positions[key] = len(base[2]) + tail_count
+            self._snapshot = (base, tail, tail_count + 1, positions, dead, generation + 1)
+
+    @staticmethod
+    def _mark_dead(base, tail, position, generation):
+        if position < len(base[2]):
+            base[3][position] = generation
+        else:
+            tail[3][position - len(base[2])] = generation
+
+    def remove(self, key):
+        """
+        Delete the vector stored under a key; returns False if absent
+        """
+        with self._lock:
+            base, tail, tail_count, positions, dead, generation = self._snapshot
+            position = positions.get(key)
+
+            if position is None:
+                return False
+
+            self._mark_dead(base, tail, position, generation + 1)
+            del positions[key]
+            self._snapshot = (base, tail, tail_count, positions, dead + 1, generation + 1)
+
+            if dead + 1 > MIN_CAPACITY and dead + 1 > len(self):
+                self._snapshot = self._copied(*self.items(), generation + 1)
+
+        return True
+
+    def distances(self, probes, metric):
+        """
+        (distances, keys, live count) of prepared probes against every row; dead rows are inf
+        """
+        parts = []
+        live = 0
+
+        for matrix, sq_norms, keys, alive in self.view():
+            distances = prepared_distances(matrix, sq_norms, probes, metric)
+
+            if alive is not None:
+                distances[:, ~alive] = np.inf
+                live += int(alive.sum())
+            else:
+                live += len(keys)
+
+            parts.append((distances, keys))
+
+        if not parts:
+            return np.zeros((len(probes), 0), dtype=np.float32), np.array([], dtype=object), 0
+
+        if len(parts) == 1:
+            return parts[0][0], parts[0][1], live
+
+        return (np.hstack([distances for distances, _ in parts]),
+                np.concatenate([keys for _, keys in parts]).astype(object), live)
+
+
+def _top_k(distances, keys, k):
+    """
+    Sorted (key, distance) pairs of the k smallest distances in a row
+    """
+    k = min(k, len(keys))
+
+    if k == 0:
+        return []
+
+    candidates = np.argpartition(distances, k - 1)[:k]
+    candidates = candidates[np.argsort(distances[candidates])]
+
+    return [(keys[i], float(distances[i])) for i in candidates]
+
+
+def _top_k_rows(distances, keys, k):
+    """
+    _top_k for every row of a distance matrix, partitioned in one call
+    """
+    k = min(k, distances.shape[1])
+
+    if k == 0:
+        return [[] for _ in range(len(distances))]
+
+    candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+
+    return [
+        [(keys[i], float(row[i])) for i in row_candidates]
+        for row, row_candidates in zip(distances, candidates)
+    ]
+
+
+class BruteForceIndex:
+    """
+    Exact search: one matrix product against every stored embedding
+
+    Vectors are stored prepared for the metric (unit length for cosine and
+    euclidean_l2, with cached squared norms for euclidean) in a VectorStore,
+    so inserts and deletes are O(1) and readers never see a partial update.
+    """
+
+    kind = 'exact'
+
+    def __init__(self, metric='cosine'):
+        self.metric = metric
+        self._store = VectorStore()
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def items(self):
+        """
+        (matrix, keys) of everything stored
+        """
+        return self._store.items()
+
+    def build(self, matrix, keys):
+        """
+        Replace the whole index content
+        """
+        self._store.build(prepare_vectors(matrix, self.metric), keys)
+
+    def attach(self, matrix, keys, sq_norms=None):
+        """
+        Serve vectors already prepared for the metric in place (e.g. a read-only memory map)
+        """
+        self._store.attach(matrix, keys, sq_norms)
+
+    def add(self, key, vector):
+        """
+        Insert or replace the vector stored under a key
+        """
+        self._store.add(key, prepare_vectors(vector, self.metric))
+
+    def remove(self, key):
+        """
+        Delete the vector stored under a key; returns False if absent
+        """
+        return self._store.remove(key)
+
+    def get(self, key):
+        """
+        Stored (prepared) vector of a key, or None
+        """
+        return self._store.get(key)
+
+    def search(self, probes, k=1):
+        """
+        k nearest keys for every probe, as lists of (key, distance)
+        """
+        probes = prepare_vectors(probes, self.metric)
+        distances, keys, live = self._store.distances(probes, self.metric)
+
+        if live == 0:
+            return [[] for _ in range(len(probes))]
+
+        return _top_k_rows(distances, keys, min(k, live))
+
+    def stats(self):
+        return {'kind': self.kind, 'size': len(self)}
+
+
+def kmeans(matrix, n_clusters, metric, iterations=10, seed=0):
+    """
+    Plain NumPy k-means (Lloyd) on prepared vectors, assigning with the search metric
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(n_clusters, len(matrix)))
+    centroids = matrix[rng.choice(len(matrix), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmin(
+            prepared_distances(centroids, squared_norms(centroids), matrix, metric), axis=1
+        )
+
+        for cluster in range(n_clusters):
+            members = matrix[assignments == cluster]
+
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters on a random point
+                centroids[cluster] = matrix[rng.integers(len(matrix))]
+
+        if metric in NORMALIZED_METRICS:
+            centroids = prepare_vectors(centroids, metric)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index: k-means coarse quantizer plus one exact list per cluster
+
+    Inserts and deletes touch a single list. Search scans the n_probe lists
+    whose centroids are closest to the probe; n_probe is the recall/latency
+    knob (n_probe == n_lists is exact search).
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, metric='cosine', n_lists=0, n_probe=8, retrain_growth=4.0):
+        self.metric = metric
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.retrain_growth = retrain_growth
+
+        # Re-entrant so add() can retrain while still holding the write lock
+        self._lock = threading.RLock()
+        self._trained_size = 0
+
+        # (centroids, lists, assignments): lists is a tuple of VectorStores
+        # and assignments maps key -> list. Inserts and deletes change one
+        # or two lists in place; a retrain replaces the whole state
+        self._state = (np.zeros((0, 0), dtype=np.float32), (), {})
+
+    def __len__(self):
+        return len(self._state[2])
+
+    def __contains__(self, key):
+        return key in self._state[2]
+
+    def items(self):
+        """
+        (matrix, keys) of everything stored
+        """
+        _, lists, _ = self._state
+        filled = [store.items() for store in lists if len(store)]
+
+        if not filled:
+            return np.zeros((0, 0), dtype=np.float32), np.array([], dtype=object)
+
+        return (
+            np.vstack([matrix for matrix, _ in filled]),
+            np.concatenate([keys for _, keys in filled]).astype(object)
+        )
+
+    def _nearest_lists(self, centroids, probes, n):
+        distances = prepared_distances(centroids, squared_norms(centroids), probes, self.metric)
+
+        if n == 1:
+            return np.argmin(distances, axis=1)
+
+        return np.argpartition(distances, n - 1, axis=1)[:, :n]
+
+    def attach(self, matrix, keys, sq_norms=None):
+        """
+        Train on vectors already prepared for the metric; the lists are private copies
+        """
+        self.build(matrix, keys)
+
+    def _new_list(self, matrix, keys):
+        store = VectorStore()
+        store.build(matrix, keys)
+        return store
+
+    def build(self, matrix, keys):
+        """
+        Train the quantizer on matrix and distribute every vector to its list
+        """
+        matrix = prepare_vectors(matrix, self.metric)
+        keys = np.array(keys, dtype=object)
+
+        if len(keys) == 0:
+            with self._lock:
+                self._state = (np.zeros((0, 0), dtype=np.float32), (), {})
+                self._trained_size = 0
+            return
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(keys))))
+        centroids = kmeans(matrix, n_lists, self.metric)
+        assignments = self._nearest_lists(centroids, matrix, 1)
+
+        lists = tuple(
+            self._new_list(matrix[assignments == cluster], keys[assignments == cluster])
+            for cluster in range(len(centroids))
+        )
+
+        with self._lock:
+            self._state = (centroids, lists, {key: int(cluster) for key, cluster in zip(keys, assignments)})
+            self._trained_size = len(keys)
+
+        logger.info(f'IVF index trained: {len(keys)} vectors in {len(centroids)} lists')
+
+    def add(self, key, vector):
+        """
+        Insert or replace a vector; only the affected lists change
+        """
+        vector = prepare_vectors(vector, self.metric)
+
+        with self._lock:
+            centroids, lists, assignments = self._state
+
+            if len(centroids) == 0:
+                self._state = (vector.copy(), (self._new_list(vector, [key]),), {key: 0})
+                self._trained_size = 1
+                return
+
+            cluster = int(self._nearest_lists(centroids, vector, 1)[0])
+            old = assignments.get(key)
+
+            # Insert before deleting, so a concurrent search never misses the key
+            lists[cluster].add(key, vector[0])
+
+            if old is not None and old != cluster:
+                lists[old].remove(key)
+
+            assignments[key] = cluster
+
+            # Clusters drift as the gallery grows; retrain once it has grown a lot
+            if len(assignments) > self._trained_size * self.retrain_growth:
+                self.build(*self.items())
+
+    def remove(self, key):
+        """
+        Delete a vector; returns False if absent
+        """
+        with self._lock:
+            _, lists, assignments = self._state
+
+            if key not in assignments:
+                return False
+
+            lists[assignments.pop(key)].remove(key)
+
+        return True
+
+    def get(self, key):
+        """
+        Stored (prepared) vector of a key, or None
+        """
+        _, lists, assignments = self._state
+        cluster = assignments.get(key)
+
+        return None if cluster is None else lists[cluster].get(key)
+
+    def search(self, probes, k=1):
+        """
+        Approximate k nearest keys for every probe, as lists of (key, distance)
+        """
+        centroids, lists, _ = self._state
+        probes = prepare_vectors(probes, self.metric)
+
+        if len(centroids) == 0:
+            return [[] for _ in range(len(probes))]
+
+        nearest_lists = self._nearest_lists(centroids, probes, min(self.n_probe, len(centroids)))
+
+        if nearest_lists.ndim == 1:
+            nearest_lists = nearest_lists[:, np.newaxis]
+
+        results = []
+
+        for probe, list_ids in zip(probes, nearest_lists):
+            scanned = [lists[i].distances(probe[np.newaxis], self.metric) for i in list_ids]
+            live = sum(count for _, _, count in scanned)
+
+            if live == 0:
+                results.append([])
+                continue
+
+            distances = np.concatenate([distances[0] for distances, _, _ in scanned])
+            keys = np.concatenate([keys for _, keys, _ in scanned])
+            results.append(_top_k(distances, keys, min(k, live)))
+
+        return results
+
+    def stats(self):
+        centroids, lists, _ = self._state
+
+        return {
+            'kind': self.kind,
+            'size': len(self),
+            'n_lists': len(centroids),
+            'n_probe': self.n_probe,
+            'largest_list': max((len(store) for store in lists), default=0)
+        }
+
+
+def create_index(size, metric, ann_min_size, n_lists=0, n_probe=8):
+    """
+    Exact search for small galleries, IVF once the gallery reaches ann_min_size
+    """
+    if ann_min_size and size >= ann_min_size:
+        return IVFIndex(metric=metric, n_lists=n_lists, n_probe=n_probe)
+
+    return BruteForceIndex(metric=metric)
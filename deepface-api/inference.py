@@ -0,0 +1,271 @@
+"""
+Inference - Face detection and batched embedding
+Sistema de Ponto Eletrônico Brasileiro
+
+Splits DeepFace.represent into its two stages so detection can run per
+image while the recognition model embeds many face crops in a single
+forward pass. INFERENCE_BACKEND=stub swaps both stages for the
+deterministic stand-in in inference_stub.py; INFERENCE_BACKEND=onnx runs
+the recognition model in ONNX Runtime (inference_onnx.py) and keeps the
+DeepFace detectors.
+
+With DETECTOR_CASCADE set, detection tries a fast backend first and only
+escalates to the next one when it finds no face, a low-confidence face or
+a face close to MIN_FACE_SIZE.
+"""
+
+import time
+import logging
+import threading
+
+import numpy as np
+from deepface import DeepFace
+
+import inference_onnx
+import inference_stub
+from config import Config
+from preprocessing import map_facial_area
+
+logger = logging.getLogger(__name__)
+
+
+class NoFaceDetected(ValueError):
+    """
+    Raised when an image has no detectable face
+    """
+
+
+def get_model():
+    """
+    Recognition model client (built once and cached by DeepFace)
+    """
+    return DeepFace.build_model(Config.MODEL_NAME)
+
+
+def model_input_shape():
+    """
+    Input shape of the recognition model, without building the TensorFlow model for ONNX
+    """
+    if Config.INFERENCE_BACKEND == 'onnx':
+        return inference_onnx.input_shape()
+
+    return get_model().input_shape
+
+
+def build_models():
+    """
+    Build the recognition model and the face detector of the configured backend
+    """
+    if Config.INFERENCE_BACKEND == 'stub':
+        return
+
+    if Config.INFERENCE_BACKEND == 'onnx':
+        # Checks the export sidecar now; the session opens in each process
+        inference_onnx.read_metadata()
+    else:
+        get_model()
+
+    for backend in cascade.backends:
+        try:
+            from deepface.detectors import DetectorWrapper
+            DetectorWrapper.build_model(backend)
+        except Exception as e:
+            logger.warning(f'Could not preload detector {backend}: {str(e)}')
+
+
+class DetectorCascade:
+    """
+    Ordered detector backends, each with the confidence that settles a request
+
+    A stage resolves the request when its best face is confident enough and
+    not close to MIN_FACE_SIZE (in original photo coordinates); otherwise
+    the next backend runs. The last stage always resolves.
+    """
+
+    def __init__(self, stages, size_margin=1.25):
+        self.stages = list(stages)
+        self.size_margin = size_margin
+        self._lock = threading.Lock()
+        self._stats = {
+            'resolved': {},
+            'escalations': {},
+            'calls': {},
+            'seconds': {}
+        }
+
+    @classmethod
+    def from_config(cls):
+        """
+        Stages from DETECTOR_CASCADE ("opencv:4.0,retinaface"), or DETECTOR_BACKEND alone
+        """
+        stages = []
+
+        for entry in Config.DETECTOR_CASCADE or [Config.DETECTOR_BACKEND]:
+            backend, _, min_confidence = entry.partition(':')
+            stages.append((
+                backend.strip(),
+                float(min_confidence) if min_confidence else Config.DETECTOR_CASCADE_MIN_CONFIDENCE
+            ))
+
+        return cls(stages, Config.DETECTOR_CASCADE_SIZE_MARGIN)
+
+    @property
+    def backends(self):
+        return [backend for backend, _ in self.stages]
+
+    def _count(self, field, key, amount=1):
+        with self._lock:
+            self._stats[field][key] = self._stats[field].get(key, 0) + amount
+
+    def escalation_reason(self, faces, min_confidence, scale):
+        """
+        Why a stage's faces do not settle the request (None when they do)
+        """
+        if not faces:
+            return 'no_face'
+
+        best = max(faces, key=lambda face: face['facial_area']['w'] * face['facial_area']['h'])
+        confidence = best.get('confidence')
+
+        if min_confidence and confidence is not None and float(confidence) < min_confidence:
+            return 'low_confidence'
+
+        area = map_facial_area(best['facial_area'], scale)
+
+        if min(area['w'], area['h']) < Config.MIN_FACE_SIZE * self.size_margin:
+            return 'small_face'
+
+        return None
+
+    def detect(self, img, enforce_detection, scale=(1.0, 1.0)):
+        """
+        Faces from the first stage that resolves the request
+        """
+        fallback = None
+
+        for position, (backend, min_confidence) in enumerate(self.stages):
+            last = position == len(self.stages) - 1
+            start = time.perf_counter()
+
+            try:
+                faces = extract_faces(img, backend, enforce_detection if last else True)
+            except NoFaceDetected:
+                if not last:
+                    faces = []
+                elif fallback is not None:
+                    self._count('resolved', 'fallback')
+                    return fallback
+                else:
+                    self._count('resolved', 'none')
+                    raise
+            finally:
+                self._count('calls', backend)
+                self._count('seconds', backend, time.perf_counter() - start)
+
+            if last:
+                self._count('resolved', backend)
+                return faces
+
+            reason = self.escalation_reason(faces, min_confidence, scale)
+
+            if reason is None:
+                self._count('resolved', backend)
+                return faces
+
+            self._count('escalations', (backend, reason))
+
+            # A weak detection still beats none if every later stage fails
+            if faces and fallback is None:
+                fallback = faces
+
+    def stats(self):
+        """
+        Per-backend resolutions, escalations (by reason), calls and time for this process
+        """
+        with self._lock:
+            return {field: dict(values) for field, values in self._stats.items()}
+
+
+def extract_faces(img, detector_backend, enforce_detection):
+    """
+    One DeepFace detector pass, aligned crops at the model input shape
+    """
+    input_shape = model_input_shape()
+
+    try:
+        return DeepFace.extract_faces(
+            img_path=img,
+            target_size=(input_shape[1], input_shape[0]),
+            detector_backend=detector_backend,
+            enforce_detection=enforce_detection,
+            align=Config.ALIGN
+        )
+    except ValueError as e:
+        # DeepFace reports a missing face as a plain ValueError
+        if 'could not be detected' in str(e):
+            raise NoFaceDetected(str(e)) from e
+        raise
+
+
+cascade = DetectorCascade.from_config()
+
+
+def detect_faces(img, enforce_detection=None, detector_backend=None, scale=(1.0, 1.0)):
+    """
+    Detect and align every face in an image (path or BGR array)
+
+    Faces come back resized to the model input shape, ready for embed_faces.
+    detector_backend runs that one backend (e.g. a cheaper one for streams)
+    instead of the detector cascade; scale maps the image to the original
+    photo, for the cascade's MIN_FACE_SIZE check.
+    """
+    if Config.INFERENCE_BACKEND == 'stub':
+        return inference_stub.detect_faces(img, enforce_detection)
+
+    if enforce_detection is None:
+        enforce_detection = Config.ENFORCE_DETECTION
+
+    if detector_backend is not None:
+        return extract_faces(img, detector_backend, enforce_detection)
+
+    return cascade.detect(img, enforce_detection, scale)
+
+
+def _supports_batching(model):
+    """
+    Keras-based models take a whole batch; SFace and Dlib do not
+    """
+    return hasattr(getattr(model, 'model', None), 'predict_on_batch')
+
+
+def embed_faces(faces):
+    """
+    Embed a list of detected faces, in one forward pass when possible
+
+    Returns a float32 matrix with one row per face, matching what
+    DeepFace.represent produces for each face individually.
+    """
+    if not faces:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    if Config.INFERENCE_BACKEND == 'stub':
+        return inference_stub.embed_faces(faces)
+
+    # extract_faces returns RGB in [0, 1]; models were fed BGR in [0, 1]
+    batch = np.stack([face['face'][:, :, ::-1] for face in faces]).astype(np.float32)
+
+    if Config.INFERENCE_BACKEND == 'onnx':
+        embeddings = inference_onnx.embed_batch(batch)
+    else:
+        model = get_model()
+
+        if not _supports_batching(model):
+            return np.array([model.find_embeddings(img[np.newaxis]) for img in batch], dtype=np.float32)
+
+        embeddings = np.asarray(model.model(batch, training=False), dtype=np.float32)
+
+    # VGG-Face l2-normalizes its descriptor outside the network
+    if Config.MODEL_NAME == 'VGG-Face':
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
+
+    return embeddings
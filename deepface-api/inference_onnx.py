@@ -0,0 +1,153 @@
+"""
+Inference ONNX - Recognition model served by ONNX Runtime
+Sistema de Ponto Eletrônico Brasileiro
+
+Selected with INFERENCE_BACKEND=onnx. The Keras model of MODEL_NAME is
+exported once with export_onnx.py (optionally int8-quantized) and every
+forward pass then runs in ONNX Runtime with explicit intra-/inter-op
+thread counts, without TensorFlow's per-call overhead and without
+building the TensorFlow model at all. Face detection stays on the
+configured DeepFace detector backends.
+
+export_onnx.py writes a JSON sidecar next to the model (MODEL_NAME, input
+shape, measured distance to the TensorFlow embeddings); a model exported
+for another MODEL_NAME is refused, because its embeddings would not match
+the enrolled templates.
+
+ONNX Runtime thread pools do not survive a fork, so each process opens
+its own session on first use; gunicorn's pre_fork hook releases the one
+the master used for warm-up.
+"""
+
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+_metadata = None
+
+
+def model_path(model_name=None, quantized=None):
+    """
+    ONNX file of a recognition model: ONNX_MODEL_PATH, or models/<MODEL_NAME>[.int8].onnx
+    """
+    if Config.ONNX_MODEL_PATH and model_name is None and quantized is None:
+        return Config.ONNX_MODEL_PATH
+
+    model_name = model_name or Config.MODEL_NAME
+    quantized = Config.ONNX_QUANTIZED if quantized is None else quantized
+    suffix = '.int8.onnx' if quantized else '.onnx'
+
+    return os.path.join(API_DIR, 'models', f'{model_name}{suffix}')
+
+
+def metadata_path(path):
+    return f'{path}.json'
+
+
+def read_metadata(path=None):
+    """
+    Export sidecar of a model file; raises if it is missing or made for another MODEL_NAME
+    """
+    path = path or model_path()
+
+    if not os.path.isfile(path) or not os.path.isfile(metadata_path(path)):
+        raise FileNotFoundError(f'No ONNX export at {path}: run export_onnx.py first')
+
+    with open(metadata_path(path)) as f:
+        metadata = json.load(f)
+
+    if metadata.get('model_name') != Config.MODEL_NAME:
+        raise ValueError(
+            f'{path} was exported from {metadata.get("model_name")}, not MODEL_NAME={Config.MODEL_NAME}'
+        )
+
+    return metadata
+
+
+def session_options():
+    """
+    ONNX Runtime session options with the configured thread counts
+    """
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+
+    # 0 keeps ONNX Runtime's default (one thread per core)
+    if Config.ONNX_INTRA_OP_THREADS:
+        options.intra_op_num_threads = Config.ONNX_INTRA_OP_THREADS
+
+    if Config.ONNX_INTER_OP_THREADS:
+        options.inter_op_num_threads = Config.ONNX_INTER_OP_THREADS
+
+    return options
+
+
+def get_session():
+    """
+    This process' inference session (opened on first use)
+    """
+    global _session, _session_pid, _metadata
+
+    if _session is None or _session_pid != os.getpid():
+        with _lock:
+            if _session is None or _session_pid != os.getpid():
+                import onnxruntime
+
+                path = model_path()
+                _metadata = read_metadata(path)
+                _session = onnxruntime.InferenceSession(path, session_options(), providers=['CPUExecutionProvider'])
+                _session_pid = os.getpid()
+
+                logger.info(
+                    f'ONNX model {path} loaded ({"int8" if _metadata.get("quantized") else "float32"}, '
+                    f'max distance to TensorFlow {_metadata.get("max_distance")})'
+                )
+
+    return _session
+
+
+def release():
+    """
+    Drop this process' session (gunicorn calls it in the master before forking)
+    """
+    global _session, _session_pid
+
+    with _lock:
+        _session = None
+        _session_pid = None
+
+
+def input_shape():
+    """
+    Input shape of the exported model, as DeepFace's model client reports it
+    """
+    global _metadata
+
+    if _metadata is None:
+        _metadata = read_metadata()
+
+    return tuple(_metadata['input_shape'])
+
+
+def embed_batch(batch):
+    """
+    Raw model outputs of a (faces, height, width, 3) BGR float32 batch
+    """
+    session = get_session()
+    name = session.get_inputs()[0].name
+
+    return np.asarray(session.run(None, {name: np.ascontiguousarray(batch, dtype=np.float32)})[0], dtype=np.float32)
@@ -0,0 +1,74 @@
+"""
+Inference Stub - Deterministic stand-in for detection and embedding
+Sistema de Ponto Eletrônico Brasileiro
+
+Selected with INFERENCE_BACKEND=stub for benchmarks and offline runs: no
+model weights are loaded or downloaded. The whole image is treated as one
+face and embedded with a fixed random projection of its downsampled
+pixels, so the same photo always gets the same embedding and a slightly
+perturbed photo gets a nearby one. STUB_DETECT_MS and STUB_EMBED_MS add
+simulated compute time per image and per forward pass.
+"""
+
+import time
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+
+# Side of the grayscale thumbnail the embedding is projected from
+THUMBNAIL_SIZE = 16
+
+_projection = None
+
+
+def _get_projection():
+    global _projection
+
+    if _projection is None:
+        rng = np.random.default_rng(0)
+        _projection = rng.normal(
+            size=(THUMBNAIL_SIZE * THUMBNAIL_SIZE, Config.STUB_EMBEDDING_DIM)
+        ).astype(np.float32)
+
+    return _projection
+
+
+def detect_faces(img, enforce_detection=None):
+    """
+    One "face" covering the whole image (path or BGR array)
+    """
+    if Config.STUB_DETECT_MS:
+        time.sleep(Config.STUB_DETECT_MS / 1000.0)
+
+    if isinstance(img, str):
+        image = Image.open(img).convert('RGB')
+    else:
+        image = Image.fromarray(np.ascontiguousarray(np.asarray(img, dtype=np.uint8)[:, :, ::-1]))
+
+    width, height = image.size
+    thumbnail = image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BILINEAR)
+
+    return [{
+        'face': np.asarray(thumbnail, dtype=np.float32) / 255.0,
+        'facial_area': {'x': 0, 'y': 0, 'w': width, 'h': height},
+        'confidence': 1.0
+    }]
+
+
+def embed_faces(faces):
+    """
+    Unit-length projection of each face thumbnail, one row per face
+    """
+    if not faces:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    if Config.STUB_EMBED_MS:
+        time.sleep(Config.STUB_EMBED_MS / 1000.0)
+
+    gray = np.stack([face['face'].mean(axis=2).ravel() for face in faces]).astype(np.float32)
+    gray -= gray.mean(axis=1, keepdims=True)
+    embeddings = gray @ _get_projection()
+
+    return embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10)
@@ -0,0 +1,218 @@
+"""
+Liveness - Lightweight anti-spoofing on the aligned face crop
+Sistema de Ponto Eletrônico Brasileiro
+
+Runs on the crop detection already produced, so it adds no detector pass.
+Two cheap checks come first: micro-texture (printed photos and screens
+flatten the local binary pattern histogram of skin) and frequency (the
+pixel grid of a screen or a print's halftone shows up as sharp peaks in
+the high-frequency spectrum). Only when their verdict falls within
+LIVENESS_CNN_MARGIN of the thresholds, and LIVENESS_MODEL_PATH points at
+an ONNX anti-spoofing model, a small CNN decides. The crop is resampled
+to a fixed size, so the cost does not depend on the photo.
+"""
+
+import time
+import logging
+import threading
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Side of the grayscale crop the texture and frequency checks run on
+ANALYSIS_SIZE = 128
+
+# Spectrum band (fraction of the Nyquist radius) where screen and print patterns appear
+HIGH_BAND = (0.35, 0.95)
+
+
+class SpoofDetected(ValueError):
+    """
+    Raised when a face fails the liveness check
+    """
+
+    def __init__(self, result):
+        super().__init__('Spoof detected: the face looks like a photo or a screen')
+        self.result = result
+
+
+def gray_crop(face, size=ANALYSIS_SIZE):
+    """
+    Aligned face crop (RGB in [0, 1]) as a size x size float32 grayscale image
+    """
+    pixels = np.clip(np.asarray(face, dtype=np.float32) * 255.0, 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels).convert('L').resize((size, size), Image.BILINEAR)
+
+    return np.asarray(image, dtype=np.float32)
+
+
+def texture_score(gray):
+    """
+    Normalized entropy (0-1) of the 8-neighbour local binary pattern histogram
+    """
+    center = gray[1:-1, 1:-1]
+    height, width = center.shape
+    codes = np.zeros(center.shape, dtype=np.uint8)
+    offsets = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+    for bit, (dy, dx) in enumerate(offsets):
+        neighbour = gray[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        codes |= (neighbour >= center).astype(np.uint8) << bit
+
+    histogram = np.bincount(codes.ravel(), minlength=256).astype(np.float64)
+    histogram /= histogram.sum()
+    nonzero = histogram[histogram > 0]
+
+    return abs(float((nonzero * np.log2(nonzero)).sum() / 8.0))
+
+
+def moire_score(gray):
+    """
+    Strongest high-frequency peak above its ring's average log spectrum (large = periodic pattern)
+    """
+    size = gray.shape[0]
+    window = np.outer(np.hanning(size), np.hanning(size)).astype(np.float32)
+    spectrum = np.log1p(np.abs(np.fft.fftshift(np.fft.fft2((gray - gray.mean()) * window))))
+
+    # Natural images fall off smoothly with radius; compare each bin to its ring
+    y, x = np.indices(spectrum.shape)
+    ring = np.round(np.hypot(y - size / 2, x - size / 2)).astype(np.int64)
+    profile = np.bincount(ring.ravel(), spectrum.ravel()) / np.maximum(np.bincount(ring.ravel()), 1)
+    band = (ring >= HIGH_BAND[0] * size / 2) & (ring <= HIGH_BAND[1] * size / 2)
+
+    return float((spectrum - profile[ring])[band].max())
+
+
+class LivenessChecker:
+    """
+    Texture and frequency checks, with an optional ONNX CNN for borderline faces
+    """
+
+    def __init__(self, texture_min=0.55, moire_max=3.0, cnn_margin=0.15, model_path='', model_input=80,
+                 live_index=1, cnn_threshold=0.5):
+        self.texture_min = texture_min
+        self.moire_max = moire_max
+        self.cnn_margin = cnn_margin
+        self.model_path = model_path
+        self.model_input = model_input
+        self.live_index = live_index
+        self.cnn_threshold = cnn_threshold
+
+        self._session = None
+        self._session_failed = False
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'checks': 0, 'spoofs': {}, 'cnn_runs': 0, 'seconds': 0.0}
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            texture_min=Config.LIVENESS_TEXTURE_MIN,
+            moire_max=Config.LIVENESS_MOIRE_MAX,
+            cnn_margin=Config.LIVENESS_CNN_MARGIN,
+            model_path=Config.LIVENESS_MODEL_PATH,
+            model_input=Config.LIVENESS_MODEL_INPUT,
+            live_index=Config.LIVENESS_MODEL_LIVE_INDEX,
+            cnn_threshold=Config.LIVENESS_CNN_THRESHOLD
+        )
+
+    def _get_session(self):
+        """
+        ONNX Runtime session of the CNN stage, or None when not configured or unavailable
+        """
+        if not self.model_path or self._session_failed:
+            return None
+
+        if self._session is None:
+            with self._load_lock:
+                if self._session is None and not self._session_failed:
+                    try:
+                        import onnxruntime
+
+                        options = onnxruntime.SessionOptions()
+                        options.intra_op_num_threads = 1
+                        self._session = onnxruntime.InferenceSession(
+                            self.model_path, options, providers=['CPUExecutionProvider']
+                        )
+                    except Exception as e:
+                        self._session_failed = True
+                        logger.warning(f'Liveness CNN disabled, could not load {self.model_path}: {str(e)}')
+
+        return self._session
+
+    def cnn_score(self, face):
+        """
+        Probability that the face is live according to the CNN (None without a model)
+        """
+        session = self._get_session()
+
+        if session is None:
+            return None
+
+        pixels = np.clip(np.asarray(face, dtype=np.float32) * 255.0, 0, 255).astype(np.uint8)
+        image = Image.fromarray(pixels).resize((self.model_input, self.model_input), Image.BILINEAR)
+
+        # NCHW, BGR, 0-255: the layout of the usual MiniFASNet exports
+        batch = np.asarray(image, dtype=np.float32)[:, :, ::-1].transpose(2, 0, 1)[np.newaxis]
+        logits = np.asarray(session.run(None, {session.get_inputs()[0].name: np.ascontiguousarray(batch)})[0])[0]
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+
+        return float(probabilities[self.live_index])
+
+    def check(self, face):
+        """
+        Liveness verdict of one aligned face crop (a detect_faces "face" array)
+        """
+        start = time.perf_counter()
+        gray = gray_crop(face)
+        texture = texture_score(gray)
+        moire = moire_score(gray)
+
+        # Both ratios pass at >= 1; the weaker one decides
+        ratios = {'flat_texture': texture / self.texture_min, 'moire_pattern': self.moire_max / max(moire, 1e-6)}
+        reason = min(ratios, key=ratios.get)
+        score = ratios[reason]
+        stage = 'heuristics'
+        cnn = None
+
+        if abs(score - 1.0) <= self.cnn_margin:
+            cnn = self.cnn_score(face)
+
+        if cnn is not None:
+            stage = 'cnn'
+            live = cnn >= self.cnn_threshold
+            reason = None if live else 'cnn'
+        else:
+            live = score >= 1.0
+            reason = None if live else reason
+
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            self._stats['checks'] += 1
+            self._stats['seconds'] += elapsed
+            self._stats['cnn_runs'] += int(cnn is not None)
+
+            if not live:
+                self._stats['spoofs'][reason] = self._stats['spoofs'].get(reason, 0) + 1
+
+        return {
+            'live': bool(live),
+            'score': round(float(score), 4),
+            'reason': reason,
+            'stage': stage,
+            'checks': {'texture': round(texture, 4), 'moire': round(moire, 2), 'cnn': cnn},
+            'seconds': round(elapsed, 5)
+        }
+
+    def stats(self):
+        """
+        Checks, spoofs by reason, CNN runs and time spent in this process
+        """
+        with self._stats_lock:
+            return {**self._stats, 'spoofs': dict(self._stats['spoofs'])}
@@ -0,0 +1,208 @@
+"""
+Metrics - Counters, gauges and latency histograms in Prometheus text format
+Sistema de Ponto Eletrônico Brasileiro
+
+A small in-process registry (no prometheus_client dependency). Values are
+per process: with several gunicorn workers, each scrape of /metrics
+reports the worker that served it.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from a cache hit to a cold detector
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def _collect(self):
+        """
+        Current series; a callback (read at scrape time) returns a number, or
+        a dict keyed by tuples of label values
+        """
+        if self.callback is None:
+            with self._lock:
+                return sorted(self._values.items())
+
+        collected = self.callback()
+
+        if not isinstance(collected, dict):
+            return [((), collected)]
+
+        return sorted(
+            (tuple(zip(self.labelnames, (str(v) for v in label_values))), value)
+            for label_values, value in collected.items()
+        )
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        return self.header() + [
+            f'{self.name}{_format_labels(key)} {_format_value(value)}'
+            for key, value in self._collect() if value is not None
+        ]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, one series per label combination
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    Point-in-time value, set explicitly or read from a callback
+    """
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Latency distribution with cumulative buckets, sum and count
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            series = self._values.get(key)
+
+            if series is None:
+                series = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][position] += 1
+                    break
+
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a with-block or decorated call (also when it raises)
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted(
+                (key, list(series['counts']), series['sum'], series['count'])
+                for key, series in self._values.items()
+            )
+
+        lines = self.header()
+
+        for key, counts, total, count in values:
+            cumulative = 0
+
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = key + (('le', _format_value(bound)),)
+                lines.append(f'{self.name}_bucket{_format_labels(labels)} {cumulative}')
+
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Ordered collection of metrics rendered together on /metrics
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Every metric in the Prometheus text exposition format
+        """
+        lines = []
+
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,136 @@
+"""
+Preprocessing - Validate, orient and downscale uploads before detection
+Sistema de Ponto Eletrônico Brasileiro
+
+Phone cameras send 12MP photos, but a face only has to clear MIN_FACE_SIZE.
+Uploads are checked from their header (format and dimensions) before any
+pixel is decoded, JPEGs are decoded at reduced size in PIL draft mode, the
+result is downscaled to WORKING_MAX_SIDE and rotated according to its EXIF
+orientation. Detected facial areas are mapped back to the coordinates of
+the original (oriented) photo.
+"""
+
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from config import Config
+
+# PIL format names accepted for each allowed file extension
+FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG'}
+
+# EXIF orientations that rotate the image by 90 degrees (width and height swap)
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageRejected(ValueError):
+    """
+    Raised for uploads that are not a usable photo (format, size, corruption)
+    """
+
+
+def open_image(image_data):
+    """
+    Open an upload lazily and check it against the spec from its header only
+    """
+    try:
+        image = Image.open(BytesIO(image_data))
+    except Exception:
+        raise ImageRejected('Invalid or corrupted image')
+
+    allowed = {FORMATS[extension] for extension in Config.ALLOWED_EXTENSIONS if extension in FORMATS}
+
+    if image.format not in allowed:
+        raise ImageRejected(f'Unsupported image format: {image.format}. Allowed: {", ".join(sorted(allowed))}')
+
+    width, height = image.size
+
+    if min(width, height) < Config.MIN_IMAGE_SIDE:
+        raise ImageRejected(f'Image too small ({width}x{height}). Minimum side: {Config.MIN_IMAGE_SIDE} pixels')
+
+    if width * height > Config.MAX_IMAGE_PIXELS:
+        raise ImageRejected(f'Image too large ({width}x{height}). Maximum: {Config.MAX_IMAGE_PIXELS} pixels')
+
+    return image
+
+
+def oriented_size(image):
+    """
+    Size of the image once its EXIF orientation is applied
+    """
+    width, height = image.size
+
+    try:
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        orientation = 1
+
+    return (height, width) if orientation in TRANSPOSED_ORIENTATIONS else (width, height)
+
+
+def prepare_image(image_data, max_side=None):
+    """
+    Decode an upload into the BGR working array the detector expects
+
+    Returns (array, scale) where scale = (sx, sy) maps working coordinates
+    back to the original photo (1.0 when no downscaling happened).
+    """
+    if max_side is None:
+        max_side = Config.WORKING_MAX_SIDE
+
+    image = open_image(image_data)
+    original_width, original_height = oriented_size(image)
+
+    try:
+        # thumbnail() keeps the aspect ratio and, for JPEG, decodes in draft
+        # mode at the nearest power-of-two reduction; the bound is square, so
+        # it does not matter that orientation is applied afterwards
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+
+        image = ImageOps.exif_transpose(image)
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        array = np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+    except ImageRejected:
+        raise
+    except Exception:
+        raise ImageRejected('Invalid or corrupted image')
+
+    working_height, working_width = array.shape[:2]
+    scale = (original_width / working_width, original_height / working_height)
+
+    return array, scale
+
+
+def map_facial_area(area, scale):
+    """
+    facial_area (and eye landmarks) in original photo coordinates
+    """
+    sx, sy = scale
+
+    if sx == 1.0 and sy == 1.0:
+        return area
+
+    mapped = dict(area)
+
+    for key, factor in (('x', sx), ('y', sy), ('w', sx), ('h', sy)):
+        if key in mapped and mapped[key] is not None:
+            mapped[key] = int(round(mapped[key] * factor))
+
+    for key in ('left_eye', 'right_eye'):
+        if mapped.get(key) is not None:
+            mapped[key] = (int(round(mapped[key][0] * sx)), int(round(mapped[key][1] * sy)))
+
+    return mapped
+
+
+def map_faces(faces, scale):
+    """
+    Detected faces with their facial_area mapped back to the original photo
+    """
+    return [{**face, 'facial_area': map_facial_area(face['facial_area'], scale)} for face in faces]
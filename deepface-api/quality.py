@@ -0,0 +1,215 @@
+"""
+Quality - Cheap face-quality gate on the detection crop
+Sistema de Ponto Eletrônico Brasileiro
+
+Blurry, dark, overexposed or strongly turned faces used to go through the
+embedding and the search only to fail as "similarity too low". The gate
+scores the crop detection already produced, before any model time is
+spent: sharpness (variance of the Laplacian), brightness and contrast of
+the central region, head roll and yaw from the eye landmarks, and the
+detector confidence. Every face of a detection is measured in one NumPy
+pass over a fixed-size stack of crops, and each request checks the
+metrics against a profile: "verify" for recognition and punches, and the
+stricter "enroll", because a poor enrollment photo hurts every later
+punch of that employee.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+from config import Config
+from liveness import gray_crop
+
+# Side of the grayscale crop the image metrics are computed on
+ANALYSIS_SIZE = 112
+
+# Central fraction of the crop measured: the face, without alignment padding and background
+CENTER = 0.7
+
+# Rejection reasons, in the order they are checked, and their messages
+REASONS = {
+    'low_confidence': 'Face detection confidence too low. Please take the photo again',
+    'face_tilted': 'Head tilted too much. Please keep the head upright',
+    'face_turned': 'Face turned away. Please look straight at the camera',
+    'too_dark': 'Image too dark. Please improve the lighting',
+    'too_bright': 'Image overexposed. Please avoid direct light on the face',
+    'low_contrast': 'Image contrast too low. Please improve the lighting',
+    'blurry': 'Image too blurry. Please hold the camera still'
+}
+
+
+class LowQualityFace(ValueError):
+    """
+    Raised when a face fails the quality gate
+    """
+
+    def __init__(self, reason, metrics):
+        super().__init__(REASONS[reason])
+        self.reason = reason
+        self.metrics = metrics
+
+
+def image_metrics(crops):
+    """
+    Sharpness, brightness and contrast of a stack of grayscale crops (N, size, size)
+    """
+    size = crops.shape[1]
+    margin = int(round(size * (1 - CENTER) / 2))
+    center = crops[:, margin:size - margin, margin:size - margin]
+
+    # 4-neighbour Laplacian over the whole stack at once
+    laplacian = (
+        center[:, :-2, 1:-1] + center[:, 2:, 1:-1] + center[:, 1:-1, :-2] + center[:, 1:-1, 2:]
+        - 4.0 * center[:, 1:-1, 1:-1]
+    )
+
+    return laplacian.var(axis=(1, 2)), center.mean(axis=(1, 2)), center.std(axis=(1, 2))
+
+
+def pose_metrics(facial_area):
+    """
+    (roll in degrees, yaw as the eyes' offset from the box center over half its width), or Nones
+
+    Detectors that return no eye landmarks give no pose.
+    """
+    left_eye = facial_area.get('left_eye')
+    right_eye = facial_area.get('right_eye')
+    width = facial_area.get('w') or 0
+
+    if left_eye is None or right_eye is None or width <= 0:
+        return None, None
+
+    dx = abs(float(left_eye[0]) - float(right_eye[0]))
+    dy = abs(float(left_eye[1]) - float(right_eye[1]))
+    roll = math.degrees(math.atan2(dy, dx))
+
+    # A turned head shifts both eyes towards one side of the box
+    middle = (float(left_eye[0]) + float(right_eye[0])) / 2
+    yaw = abs(middle - (facial_area['x'] + width / 2)) / (width / 2)
+
+    return roll, yaw
+
+
+class QualityGate:
+    """
+    Measures detected faces and checks them against the verify or enroll profile
+    """
+
+    def __init__(self, enabled=True, profiles=None):
+        self.enabled = enabled
+        self.profiles = profiles or {}
+        self._stats_lock = threading.Lock()
+        self._stats = {'checks': {}, 'rejections': {}}
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            enabled=Config.QUALITY_GATE_ENABLED,
+            profiles={
+                'verify': {
+                    'min_confidence': Config.QUALITY_MIN_CONFIDENCE,
+                    'max_roll': Config.QUALITY_MAX_ROLL,
+                    'max_yaw': Config.QUALITY_MAX_YAW,
+                    'min_brightness': Config.QUALITY_MIN_BRIGHTNESS,
+                    'max_brightness': Config.QUALITY_MAX_BRIGHTNESS,
+                    'min_contrast': Config.QUALITY_MIN_CONTRAST,
+                    'min_sharpness': Config.QUALITY_MIN_SHARPNESS
+                },
+                'enroll': {
+                    'min_confidence': Config.ENROLL_QUALITY_MIN_CONFIDENCE,
+                    'max_roll': Config.ENROLL_QUALITY_MAX_ROLL,
+                    'max_yaw': Config.ENROLL_QUALITY_MAX_YAW,
+                    'min_brightness': Config.ENROLL_QUALITY_MIN_BRIGHTNESS,
+                    'max_brightness': Config.ENROLL_QUALITY_MAX_BRIGHTNESS,
+                    'min_contrast': Config.ENROLL_QUALITY_MIN_CONTRAST,
+                    'min_sharpness': Config.ENROLL_QUALITY_MIN_SHARPNESS
+                }
+            }
+        )
+
+    def measure(self, faces):
+        """
+        Faces with their quality metrics under "quality" (detect_faces results, crops included)
+
+        The metrics stay with the face metadata after the crop is dropped,
+        so a cached probe is checked without detecting again.
+        """
+        if not self.enabled or not faces:
+            return faces
+
+        with_crop = [position for position, face in enumerate(faces) if face.get('face') is not None]
+        image = {}
+
+        if with_crop:
+            crops = np.stack([gray_crop(faces[position]['face'], ANALYSIS_SIZE) for position in with_crop])
+            image = dict(zip(with_crop, zip(*image_metrics(crops))))
+
+        measured = []
+
+        for position, face in enumerate(faces):
+            sharpness, brightness, contrast = image.get(position, (None, None, None))
+            roll, yaw = pose_metrics(face['facial_area'])
+            confidence = face.get('confidence')
+
+            measured.append({**face, 'quality': {
+                'sharpness': None if sharpness is None else round(float(sharpness), 2),
+                'brightness': None if brightness is None else round(float(brightness), 2),
+                'contrast': None if contrast is None else round(float(contrast), 2),
+                'roll': None if roll is None else round(roll, 2),
+                'yaw': None if yaw is None else round(yaw, 3),
+                'confidence': None if confidence is None else round(float(confidence), 4)
+            }})
+
+        return measured
+
+    def assess(self, face, profile='verify'):
+        """
+        (metrics, rejection reason or None) of a measured face under a profile
+
+        Metrics that could not be measured are not checked.
+        """
+        metrics = dict(face.get('quality') or {})
+
+        if not self.enabled:
+            return metrics, None
+
+        limits = self.profiles[profile]
+        checks = (
+            ('low_confidence', metrics.get('confidence'), lambda value: value >= limits['min_confidence']),
+            ('face_tilted', metrics.get('roll'), lambda value: value <= limits['max_roll']),
+            ('face_turned', metrics.get('yaw'), lambda value: value <= limits['max_yaw']),
+            ('too_dark', metrics.get('brightness'), lambda value: value >= limits['min_brightness']),
+            ('too_bright', metrics.get('brightness'), lambda value: value <= limits['max_brightness']),
+            ('low_contrast', metrics.get('contrast'), lambda value: value >= limits['min_contrast']),
+            ('blurry', metrics.get('sharpness'), lambda value: value >= limits['min_sharpness'])
+        )
+        reason = next((reason for reason, value, passes in checks if value is not None and not passes(value)), None)
+
+        with self._stats_lock:
+            self._stats['checks'][profile] = self._stats['checks'].get(profile, 0) + 1
+
+            if reason is not None:
+                key = (profile, reason)
+                self._stats['rejections'][key] = self._stats['rejections'].get(key, 0) + 1
+
+        return {**metrics, 'profile': profile}, reason
+
+    def check(self, face, profile='verify'):
+        """
+        Metrics of a measured face; raises LowQualityFace if it fails the profile
+        """
+        metrics, reason = self.assess(face, profile)
+
+        if reason is not None:
+            raise LowQualityFace(reason, metrics)
+
+        return metrics
+
+    def stats(self):
+        """
+        Checks by profile and rejections by (profile, reason) in this process
+        """
+        with self._stats_lock:
+            return {'checks': dict(self._stats['checks']), 'rejections': dict(self._stats['rejections'])}
@@ -0,0 +1,190 @@
+"""
+Embedding Store - Versioned binary snapshot of the gallery, memory-mapped
+Sistema de Ponto Eletrônico Brasileiro
+
+One file holds every enrolled embedding, already prepared for the
+distance metric: a fixed header, a float32 (or float16) vector block, the
+float32 squared norms and an id table. Rows are grouped by partition, so
+each partition is one contiguous slice; the individual templates of
+employees enrolled with several follow in a block and table of their own.
+Workers map the file read-only and search the mapping in place: N workers
+share one page-cache copy and startup reads no image and no template.
+float16 is a storage format only: it halves the file, but each worker
+upcasts it to a private float32 copy when it attaches the vectors.
+Changes made after the snapshot
+live in the gallery journal until the next compaction rewrites the file.
+"""
+
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = b'DFGALLRY'
+VERSION = 2
+
+DTYPES = {'float32': (0, np.float32), 'float16': (1, np.float16)}
+DTYPE_NAMES = {code: name for name, (code, _) in DTYPES.items()}
+
+# magic, version, dtype code, dimensions, reserved, rows, generation and
+# (offset, length) of the metadata, vectors, squared norms, id table,
+# template vectors and template table
+HEADER = struct.Struct('<8sIIIIQQ12Q')
+
+# Blocks start on a cache-line boundary
+ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_store(path, partitions, generation, metadata, dtype='float32', templates=()):
+    """
+    Write a store file atomically
+
+    partitions is a list of (partition, prepared matrix, keys) and
+    templates a list of (employee_id, prepared templates); metadata
+    (model, detector, metric...) is stored as JSON and checked on open.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f'Unsupported store dtype: {dtype}. Allowed: {", ".join(DTYPES)}')
+
+    code, numpy_dtype = DTYPES[dtype]
+    filled = [(partition, matrix, keys) for partition, matrix, keys in partitions if len(keys)]
+    matrix = (
+        np.vstack([matrix for _, matrix, _ in filled]).astype(np.float32)
+        if filled else np.zeros((0, 0), dtype=np.float32)
+    )
+    vectors = np.ascontiguousarray(matrix, dtype=numpy_dtype)
+
+    # Norms of the stored (possibly rounded) values, always in float32
+    stored = vectors.astype(np.float32)
+    sq_norms = np.einsum('ij,ij->i', stored, stored).astype(np.float32) if stored.size else np.zeros(0, np.float32)
+
+    ids = [[str(key), partition] for partition, _, keys in filled for key in keys]
+    meta_bytes = json.dumps(metadata, sort_keys=True).encode('utf-8')
+    id_bytes = json.dumps(ids).encode('utf-8')
+
+    template_vectors = (
+        np.ascontiguousarray(np.vstack([matrix for _, matrix in templates]), dtype=numpy_dtype)
+        if len(templates) else np.zeros((0, 0), dtype=numpy_dtype)
+    )
+    template_bytes = json.dumps([[str(key), len(matrix)] for key, matrix in templates]).encode('utf-8')
+
+    meta_offset = HEADER.size
+    vectors_offset = _aligned(meta_offset + len(meta_bytes))
+    norms_offset = _aligned(vectors_offset + vectors.nbytes)
+    ids_offset = _aligned(norms_offset + sq_norms.nbytes)
+    templates_offset = _aligned(ids_offset + len(id_bytes))
+    table_offset = _aligned(templates_offset + template_vectors.nbytes)
+
+    dims = vectors.shape[1] if vectors.ndim == 2 and len(vectors) else template_vectors.shape[1]
+    header = HEADER.pack(
+        MAGIC, VERSION, code, dims, 0, len(ids), generation,
+        meta_offset, len(meta_bytes), vectors_offset, vectors.nbytes, norms_offset, sq_norms.nbytes,
+        ids_offset, len(id_bytes), templates_offset, template_vectors.nbytes, table_offset, len(template_bytes)
+    )
+
+    temp_path = f'{path}.tmp'
+
+    try:
+        with open(temp_path, 'wb') as f:
+            for offset, data in ((0, header), (meta_offset, meta_bytes), (vectors_offset, vectors.tobytes()),
+                                 (norms_offset, sq_norms.tobytes()), (ids_offset, id_bytes),
+                                 (templates_offset, template_vectors.tobytes()), (table_offset, template_bytes)):
+                f.seek(offset)
+                f.write(data)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Workers that mapped the previous file keep reading it until they reopen
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return os.path.getsize(path)
+
+
+class EmbeddingStore:
+    """
+    Read-only mapping of a store file
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size:
+            raise ValueError(f'Truncated embedding store: {path}')
+
+        magic, version, code = struct.unpack_from('<8sII', self._map, 0)
+
+        if magic != MAGIC or version != VERSION or code not in DTYPE_NAMES:
+            raise ValueError(f'Not a version {VERSION} embedding store: {path}')
+
+        (_, _, _, dims, _, rows, generation, meta_offset, meta_length, vectors_offset, _, norms_offset, _,
+         ids_offset, ids_length, templates_offset, _, table_offset, table_length) = HEADER.unpack_from(self._map, 0)
+
+        if table_offset + table_length > len(self._map):
+            raise ValueError(f'Truncated embedding store: {path}')
+
+        self.dtype = DTYPE_NAMES[code]
+        self.generation = generation
+        self.metadata = json.loads(self._map[meta_offset:meta_offset + meta_length])
+        self._ids = json.loads(self._map[ids_offset:ids_offset + ids_length])
+
+        # Views into the mapping: nothing is copied, pages load on first use
+        self.vectors = np.frombuffer(self._map, dtype=DTYPES[self.dtype][1], count=rows * dims,
+                                     offset=vectors_offset).reshape(rows, dims)
+        self.sq_norms = np.frombuffer(self._map, dtype=np.float32, count=rows, offset=norms_offset)
+
+        self._template_table = json.loads(self._map[table_offset:table_offset + table_length])
+        template_rows = sum(count for _, count in self._template_table)
+        self.template_vectors = np.frombuffer(self._map, dtype=DTYPES[self.dtype][1], count=template_rows * dims,
+                                              offset=templates_offset).reshape(template_rows, dims)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def partitions(self):
+        """
+        (partition, vectors, squared norms, keys) of every partition, as views of the mapping
+        """
+        start = 0
+
+        while start < len(self._ids):
+            partition = self._ids[start][1]
+            end = start
+
+            while end < len(self._ids) and self._ids[end][1] == partition:
+                end += 1
+
+            keys = np.array([key for key, _ in self._ids[start:end]], dtype=object)
+            yield partition, self.vectors[start:end], self.sq_norms[start:end], keys
+            start = end
+
+    def templates(self):
+        """
+        (employee_id, templates) of every multi-template employee, as views of the mapping
+        """
+        start = 0
+
+        for key, count in self._template_table:
+            yield key, self.template_vectors[start:start + count]
+            start += count
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'generation': self.generation,
+            'dtype': self.dtype,
+            'size': len(self),
+            'bytes': len(self._map)
+        }
@@ -0,0 +1,236 @@
+"""
+Streaming - Face tracking for kiosk frame streams
+Sistema de Ponto Eletrônico Brasileiro
+
+A kiosk streams low-resolution frames over one WebSocket. Each frame only
+goes through a cheap detector; faces are linked to the tracks of previous
+frames by bounding-box overlap (IoU), so a person standing in front of the
+camera is one track. Embedding and search run once per new track, again
+only when the track's face gets clearly better (larger, more confident)
+while it is still unrecognized, and every crop that needs it in a frame
+shares one forward pass. A crop that fails the screen (quality gate,
+liveness) is reported as not recognized without being embedded.
+"""
+
+import itertools
+
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Intersection over union of every pair of (x, y, w, h) boxes, shape (A, B)
+    """
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    left = np.maximum(a[:, None, 0], b[None, :, 0])
+    top = np.maximum(a[:, None, 1], b[None, :, 1])
+    right = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    bottom = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    union = (a[:, None, 2] * a[:, None, 3]) + (b[None, :, 2] * b[None, :, 3]) - intersection
+
+    return intersection / np.maximum(union, 1e-6)
+
+
+def face_box(face):
+    area = face['facial_area']
+    return (area['x'], area['y'], area['w'], area['h'])
+
+
+def face_quality(face):
+    """
+    How good a crop is for recognition: face area weighted by detector confidence
+    """
+    area = face['facial_area']
+    confidence = face.get('confidence')
+
+    return float(area['w'] * area['h']) * (float(confidence) if confidence else 1.0)
+
+
+class FaceTrack:
+    """
+    One face followed across frames
+    """
+
+    def __init__(self, track_id, face):
+        self.id = track_id
+        self.face = face
+        self.hits = 1
+        self.missed = 0
+        self.embeds = 0
+        self.recognized_quality = 0.0
+        self.result = None
+
+    @property
+    def quality(self):
+        return face_quality(self.face)
+
+    @property
+    def recognized(self):
+        return bool(self.result and self.result.get('recognized'))
+
+    def needs_recognition(self, min_gain, max_embeds):
+        """
+        True for a new track, or an unrecognized one whose face got clearly better
+        """
+        if self.embeds == 0:
+            return True
+
+        if self.recognized or self.embeds >= max_embeds:
+            return False
+
+        return self.quality > self.recognized_quality * (1.0 + min_gain)
+
+
+class FaceTracker:
+    """
+    Greedy IoU tracker: each detection continues the overlapping track, or starts one
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, faces):
+        """
+        Assign the faces of a new frame to tracks
+
+        Returns (visible, new, lost): the track of each face, in order, the
+        tracks started by this frame and the tracks dropped after
+        max_missed frames without a face.
+        """
+        assigned = [None] * len(faces)
+
+        if self.tracks and faces:
+            overlap = box_iou([face_box(track.face) for track in self.tracks], [face_box(face) for face in faces])
+
+            # Best overlapping pairs first
+            for flat in np.argsort(overlap, axis=None)[::-1]:
+                row, column = np.unravel_index(flat, overlap.shape)
+
+                if overlap[row, column] < self.iou_threshold:
+                    break
+
+                track = self.tracks[row]
+
+                if assigned[column] is not None or any(existing is track for existing in assigned):
+                    continue
+
+                assigned[column] = track
+
+        new = []
+
+        for position, face in enumerate(faces):
+            track = assigned[position]
+
+            if track is None:
+                track = FaceTrack(next(self._ids), face)
+                assigned[position] = track
+                new.append(track)
+            else:
+                track.face = face
+                track.hits += 1
+                track.missed = 0
+
+        matched = {id(track) for track in assigned}
+        lost = []
+        kept = []
+
+        for track in self.tracks:
+            if id(track) not in matched:
+                track.missed += 1
+
+                if track.missed > self.max_missed:
+                    lost.append(track)
+                    continue
+
+            kept.append(track)
+
+        self.tracks = kept + new
+
+        return assigned, new, lost
+
+
+class StreamSession:
+    """
+    Recognition state of one kiosk connection
+
+    detect(frame_bytes) returns the faces of a frame; recognize(faces) embeds
+    them in one pass and returns one recognition result dict per face.
+    screen(face), when given, returns None for a face that may be recognized
+    or the (not recognized) result dict of a face that may not.
+    """
+
+    def __init__(self, detect, recognize, iou_threshold=0.3, max_missed=5, min_quality_gain=0.25,
+                 max_embeds_per_track=3, screen=None):
+        self.detect = detect
+        self.recognize = recognize
+        self.screen = screen
+        self.tracker = FaceTracker(iou_threshold, max_missed)
+        self.min_quality_gain = min_quality_gain
+        self.max_embeds_per_track = max_embeds_per_track
+        self.frames = 0
+        self.embeds = 0
+
+    def process_frame(self, frame):
+        """
+        Track the faces of one frame and return the events to push to the kiosk
+        """
+        self.frames += 1
+        faces = self.detect(frame)
+        visible, new, lost = self.tracker.update(faces)
+
+        events = [{'event': 'track_lost', 'track_id': track.id} for track in lost]
+        events += [
+            {'event': 'track_started', 'track_id': track.id, 'facial_area': track.face['facial_area']}
+            for track in new
+        ]
+
+        pending = [
+            track for track in visible
+            if track.needs_recognition(self.min_quality_gain, self.max_embeds_per_track)
+        ]
+
+        if pending:
+            results = [self.screen(track.face) if self.screen else None for track in pending]
+            accepted = [position for position, result in enumerate(results) if result is None]
+
+            if accepted:
+                recognized = self.recognize([pending[position].face for position in accepted])
+                self.embeds += len(accepted)
+
+                for position, result in zip(accepted, recognized):
+                    results[position] = result
+
+            for track, result in zip(pending, results):
+                previous = track.result
+                track.result = result
+                track.embeds += 1
+                track.recognized_quality = track.quality
+
+                # Only push what the kiosk does not know yet
+                if previous is not None and all(
+                        previous.get(key) == result.get(key) for key in ('employee_id', 'recognized', 'reason')):
+                    continue
+
+                events.append({
+                    'event': 'recognized' if result.get('recognized') else 'not_recognized',
+                    'track_id': track.id,
+                    'frame': self.frames,
+                    'facial_area': track.face['facial_area'],
+                    **result
+                })
+
+        return events
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'embeds': self.embeds,
+            'active_tracks': len(self.tracker.tracks)
+        }
@@ -0,0 +1,15 @@
+"""
+Test configuration - DeepFace API
+Sistema de Ponto Eletrônico Brasileiro
+
+The service modules use flat imports (from config import Config), so the
+API directory and the benchmarks are put on the path.
+"""
+
+import os
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.join(API_DIR, 'benchmarks'))
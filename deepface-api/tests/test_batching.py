@@ -0,0 +1,81 @@
+"""
+Micro-batching - Face cap of the forward passes and fan-out of the embeddings
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import queue
+import threading
+
+import numpy as np
+
+from batching import MicroBatcher, _PendingRequest
+
+
+def embed_numbers(faces):
+    return np.asarray(faces, dtype=np.float32).reshape(-1, 1)
+
+
+def queued_batcher(sizes, max_batch_size=4):
+    """
+    Batcher whose queue already holds one request per size (faces numbered from 0)
+    """
+    batcher = MicroBatcher(embed_numbers, max_batch_size=max_batch_size, max_wait_ms=0)
+    batcher._queue = queue.Queue()
+    start = 0
+
+    for size in sizes:
+        batcher._queue.put(_PendingRequest(list(range(start, start + size))))
+        start += size
+
+    return batcher
+
+
+def face_counts(batch):
+    return [len(pending.faces) for pending in batch]
+
+
+def test_collect_stops_at_the_cap_and_holds_the_overflowing_request():
+    batcher = queued_batcher([2, 1, 3, 1])
+
+    assert face_counts(batcher._collect()) == [2, 1]
+    assert len(batcher._held.faces) == 3
+
+    # The held request opens the next batch, ahead of the queue
+    assert face_counts(batcher._collect()) == [3, 1]
+    assert batcher._held is None
+
+
+def test_request_over_the_cap_is_embedded_in_several_passes():
+    passes = []
+
+    def embed(faces):
+        passes.append(len(faces))
+        return embed_numbers(faces)
+
+    batcher = MicroBatcher(embed, max_batch_size=4, max_wait_ms=0)
+    embeddings = batcher.embed(list(range(10)))
+
+    assert passes == [4, 4, 2]
+    assert embeddings.ravel().tolist() == list(range(10))
+    assert batcher.stats()['max_batch_faces'] == 4
+    assert batcher.stats()['requests'] == 1
+
+
+def test_concurrent_callers_get_their_own_embeddings():
+    batcher = MicroBatcher(embed_numbers, max_batch_size=8, max_wait_ms=20)
+    results = {}
+
+    def call(number):
+        faces = [number * 10 + offset for offset in range(number)]
+        results[number] = batcher.embed(faces).ravel().tolist()
+
+    threads = [threading.Thread(target=call, args=(number,)) for number in (1, 2, 3, 4)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert results == {number: [number * 10 + offset for offset in range(number)] for number in (1, 2, 3, 4)}
+    assert batcher.stats()['max_batch_faces'] <= 8
@@ -0,0 +1,52 @@
+"""
+Load benchmark - The benchmark's own requests succeed against the server it starts
+Sistema de Ponto Eletrônico Brasileiro
+
+Starts gunicorn exactly as benchmarks/bench_load.py does (stub backend, a
+small synthetic gallery) and sends the payloads the benchmark would send:
+a request rejected by a check meant for camera photos would silently turn
+the benchmark into a measurement of error responses.
+"""
+
+import shutil
+import socket
+
+import pytest
+
+import bench_load
+
+GALLERY_SIZE = 20
+
+pytestmark = pytest.mark.skipif(shutil.which('gunicorn') is None, reason='gunicorn is not installed')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def server_url(tmp_path_factory):
+    gallery_dir = bench_load.build_gallery(str(tmp_path_factory.mktemp('gallery') / 'bench'), GALLERY_SIZE)
+    log_dir = str(tmp_path_factory.mktemp('logs'))
+    port = free_port()
+    process, _, _ = bench_load.start_server(gallery_dir, 1, port, 2, log_dir)
+
+    yield f'http://127.0.0.1:{port}'
+
+    bench_load.stop_server(process)
+
+
+@pytest.mark.parametrize('operation', bench_load.OPERATIONS)
+def test_benchmark_requests_succeed(server_url, operation):
+    for path, payload, expected in bench_load.build_payloads(operation, 5, GALLERY_SIZE, seed=1):
+        status, body = bench_load.http_post(f'{server_url}{path}', payload)
+
+        assert status == 200, body
+        assert body.get('success'), body
+
+        if operation == 'recognize':
+            assert body.get('employee_id') == expected
+        elif operation == 'verify':
+            assert body.get('verified'), body
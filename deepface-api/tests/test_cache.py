@@ -0,0 +1,113 @@
+"""
+Cache - Targeted invalidation of cached results by enrollments and removals
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import os
+
+import numpy as np
+
+from cache import ResultCache
+from gallery import FaceGallery
+
+
+def unit(values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+PROBE = unit([1, 0, 0, 0])
+
+
+def cache_with_recognition(ranked, k=2, partition=None, candidates=None):
+    cache = ResultCache(max_entries=16, ttl=60)
+    cache.put_recognition('recognized', {'employee_id': ranked[0][0]}, PROBE, ranked, k, partition, candidates)
+    cache.put_verification('verified', {'verified': True}, '7')
+
+    return cache
+
+
+def keys(cache):
+    return sorted(key for key, _ in cache.values())
+
+
+def test_enrollment_of_a_ranked_employee_drops_its_results():
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)])
+
+    assert cache.invalidate_enrollment('2', unit([0, 1, 0, 0])) == 1
+    assert keys(cache) == ['verified']
+
+
+def test_far_enrollment_keeps_a_full_ranking():
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)])
+
+    # Orthogonal to the probe: cosine distance 1.0, worse than the worst ranked (0.3)
+    assert cache.invalidate_enrollment('9', unit([0, 0, 1, 0])) == 0
+    assert keys(cache) == ['recognized', 'verified']
+
+
+def test_close_enrollment_drops_the_ranking_it_would_enter():
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)])
+
+    assert cache.invalidate_enrollment('9', unit([1, 0.1, 0, 0])) == 1
+    assert keys(cache) == ['verified']
+
+
+def test_any_enrollment_drops_a_ranking_with_room_left():
+    cache = cache_with_recognition([('1', 0.1)], k=3)
+
+    assert cache.invalidate_enrollment('9', unit([0, 0, 1, 0])) == 1
+
+
+def test_closest_of_several_templates_decides():
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)])
+    templates = np.vstack([unit([0, 0, 1, 0]), unit([1, 0.1, 0, 0])])
+
+    assert cache.invalidate_enrollment('9', templates) == 1
+
+
+def test_enrollment_out_of_scope_keeps_results():
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)], partition='site-a')
+    assert cache.invalidate_enrollment('9', PROBE, partition='site-b') == 0
+
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)], candidates=['1', '2'])
+    assert cache.invalidate_enrollment('9', PROBE) == 0
+    assert cache.invalidate_enrollment('2', PROBE) == 1
+
+
+def test_enrollment_drops_the_verifications_of_that_employee():
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)])
+
+    assert cache.invalidate_enrollment('7', unit([0, 0, 1, 0])) == 1
+    assert keys(cache) == ['recognized']
+
+
+def test_removal_drops_only_results_that_reference_the_employee():
+    cache = cache_with_recognition([('1', 0.1), ('2', 0.3)])
+
+    assert cache.invalidate_removal('9') == 0
+    assert cache.invalidate_removal('2') == 1
+    assert cache.invalidate_removal('7') == 1
+    assert keys(cache) == []
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_added_template_invalidates_results_of_the_employee_partition(tmp_path):
+    """
+    A template added without a partition keeps the employee's; results scoped to it must go
+    """
+    db_path = str(tmp_path)
+    os.makedirs(os.path.join(db_path, '5'))
+    gallery = FaceGallery('VGG-Face', 'opencv', max_templates=5)
+    gallery.enroll(db_path, '5', unit([0, 0, 0, 1]), 'hash', partition='site-a')
+
+    # "Not recognized" in site-a, with the ranking full of other employees
+    cache = cache_with_recognition([('1', 0.5), ('2', 0.6)], partition='site-a')
+
+    gallery.enroll(db_path, '5', PROBE, None, partition=None, append=True)
+    partition = gallery.partition_of('5')
+
+    assert partition == 'site-a'
+    assert gallery.template_count('5') == 2
+    assert cache.invalidate_enrollment('5', PROBE, partition) == 1
+    assert keys(cache) == ['verified']
@@ -0,0 +1,201 @@
+"""
+Face Gallery - Journal replay between workers, deletions, compaction and reload
+Sistema de Ponto Eletrônico Brasileiro
+
+Two FaceGallery instances on one faces directory stand in for two gunicorn
+workers: they share the journal, the generation counter and the store.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import gallery as gallery_module
+from gallery import FaceGallery, face_path, file_hash, store_path
+
+DIMS = 16
+
+
+def vector(employee_id):
+    """
+    Fixed embedding of a synthetic employee
+    """
+    seed = sum(ord(char) * 31 ** position for position, char in enumerate(employee_id)) % 2 ** 32
+    return np.random.default_rng(seed).normal(size=DIMS).astype(np.float32)
+
+
+def embed(image_path):
+    return vector(os.path.basename(os.path.dirname(image_path)))
+
+
+def add_photo(db_path, employee_id):
+    """
+    Gallery image of an employee, as /enroll writes it before the template
+    """
+    os.makedirs(os.path.join(db_path, employee_id), exist_ok=True)
+
+    with open(face_path(db_path, employee_id), 'wb') as f:
+        f.write(f'photo of {employee_id}'.encode())
+
+    return file_hash(face_path(db_path, employee_id))
+
+
+def enroll(gallery, db_path, employee_id, on_change=None):
+    image_hash = add_photo(db_path, employee_id)
+    gallery.enroll(db_path, employee_id, vector(employee_id), image_hash, on_change=on_change)
+
+
+def new_gallery(db_path, **kwargs):
+    gallery = FaceGallery('VGG-Face', 'opencv', store_enabled=True, **kwargs)
+    gallery.load(db_path, embed)
+    return gallery
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'faces')
+
+    for employee_id in ('1', '2', '3'):
+        add_photo(path, employee_id)
+
+    return path
+
+
+def enrolled(gallery):
+    return [employee_id for employee_id in ('1', '2', '3', '4', '5') if employee_id in gallery]
+
+
+def store_files(db_path):
+    return sorted(name for name in os.listdir(db_path) if name.startswith('.gallery_store'))
+
+
+def test_load_scans_then_maps_the_store(db_path):
+    first = new_gallery(db_path)
+    second = new_gallery(db_path)
+
+    assert len(first) == len(second) == 3
+    assert second.store is not None
+    assert second.search(vector('2'))[0] == '2'
+
+
+def test_journal_replay_across_galleries(db_path):
+    worker_a = new_gallery(db_path)
+    worker_b = new_gallery(db_path)
+    changes = []
+
+    enroll(worker_a, db_path, '4')
+
+    assert '4' not in worker_b
+    assert worker_b.sync(lambda *change: changes.append(change)) == 1
+    assert '4' in worker_b
+    assert worker_b.search(vector('4'))[0] == '4'
+    assert changes[0][:2] == ('enroll', '4')
+
+    worker_b.delete(db_path, '1')
+
+    assert worker_a.sync() == 1
+    assert '1' not in worker_a
+    assert worker_a.search(vector('1'))[0] != '1'
+
+    # Nothing new: a sync is a counter read and applies nothing
+    assert worker_a.sync() == 0
+    assert worker_a.generation == worker_b.generation == 2
+
+
+def test_re_enrollment_replaces_the_template(db_path):
+    worker_a = new_gallery(db_path)
+    worker_b = new_gallery(db_path)
+    replacement = vector('other')
+
+    worker_a.enroll(db_path, '2', replacement, file_hash(face_path(db_path, '2')))
+    worker_b.sync()
+
+    assert len(worker_b) == 3
+    assert worker_b.search(replacement) == ('2', pytest.approx(0.0, abs=1e-5))
+
+
+def test_deletions_and_enrollments_survive_compaction(db_path):
+    worker_a = new_gallery(db_path)
+    worker_b = new_gallery(db_path)
+
+    enroll(worker_a, db_path, '4')
+    worker_a.delete(db_path, '1')
+
+    assert worker_a.compact(force=True)
+
+    # Made after the compaction: only in the new journal epoch
+    enroll(worker_a, db_path, '5')
+
+    # A worker that missed the compaction drains the old journal, then the new one
+    worker_b.sync()
+    assert enrolled(worker_b) == ['2', '3', '4', '5']
+
+    # A new process maps the compacted store and replays only what came after it
+    restarted = new_gallery(db_path)
+    assert restarted.store is not None
+    assert restarted.store.generation == 2
+    assert enrolled(restarted) == ['2', '3', '4', '5']
+    assert restarted.generation == 3
+
+
+def test_load_drops_employees_removed_outside_the_journal(db_path):
+    new_gallery(db_path)
+    shutil.rmtree(os.path.join(db_path, '2'))
+
+    restarted = new_gallery(db_path)
+
+    assert '2' not in restarted
+    assert restarted.search(vector('2'))[0] != '2'
+
+    # The rewritten store no longer holds it
+    assert '2' not in new_gallery(db_path)
+
+
+def test_load_rescans_templates_changed_outside_the_journal(db_path):
+    new_gallery(db_path)
+
+    # A photo added by hand, with no template and no journal entry
+    add_photo(db_path, '9')
+
+    restarted = new_gallery(db_path)
+
+    assert '9' in restarted
+    assert restarted.search(vector('9'))[0] == '9'
+
+
+def test_failed_compaction_leaves_no_file(db_path, monkeypatch):
+    gallery = new_gallery(db_path)
+
+    def failing_write(path, *args, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+
+        raise OSError('disk full')
+
+    monkeypatch.setattr(gallery_module, 'write_store', failing_write)
+
+    with pytest.raises(OSError):
+        gallery.compact(force=True)
+
+    assert store_files(db_path) == ['.gallery_store']
+
+
+def test_load_sweeps_files_of_dead_compactions(db_path):
+    new_gallery(db_path)
+
+    # A pid that is certainly not running anymore
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    orphan = os.path.join(db_path, f'.gallery_store.{process.pid}.4')
+
+    with open(orphan, 'wb') as f:
+        f.write(b'partial')
+
+    new_gallery(db_path)
+
+    assert store_files(db_path) == ['.gallery_store']
+    assert os.path.isfile(store_path(db_path))
@@ -0,0 +1,80 @@
+"""
+Search Index - IVF recall against exact search on a small fixture
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import numpy as np
+import pytest
+
+from index import BruteForceIndex, IVFIndex, create_index
+
+SIZE = 2000
+DIMS = 32
+
+
+@pytest.fixture(scope='module')
+def fixture():
+    """
+    Clustered gallery (like embeddings of similar faces) and probes near its members
+    """
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(40, DIMS))
+    gallery = centers[rng.integers(len(centers), size=SIZE)] + 0.3 * rng.normal(size=(SIZE, DIMS))
+    probes = gallery[rng.choice(SIZE, 100, replace=False)] + 0.05 * rng.normal(size=(100, DIMS))
+    keys = [str(number) for number in range(SIZE)]
+
+    return gallery.astype(np.float32), probes.astype(np.float32), keys
+
+
+def recall(index, exact, probes, k):
+    found = index.search(probes, k=k)
+    truth = exact.search(probes, k=k)
+
+    hits = sum(len({key for key, _ in row} & {key for key, _ in expected}) for row, expected in zip(found, truth))
+
+    return hits / (len(probes) * k)
+
+
+@pytest.mark.parametrize('metric', ['cosine', 'euclidean_l2', 'euclidean'])
+def test_ivf_recall_against_brute_force(fixture, metric):
+    gallery, probes, keys = fixture
+    exact = BruteForceIndex(metric=metric)
+    exact.build(gallery, keys)
+    ivf = IVFIndex(metric=metric, n_probe=8)
+    ivf.build(gallery, keys)
+
+    assert recall(ivf, exact, probes, k=1) >= 0.95
+    assert recall(ivf, exact, probes, k=5) >= 0.9
+
+
+def test_ivf_probing_every_list_is_exact(fixture):
+    gallery, probes, keys = fixture
+    exact = BruteForceIndex()
+    exact.build(gallery, keys)
+    ivf = IVFIndex(n_lists=16, n_probe=16)
+    ivf.build(gallery, keys)
+
+    for row, expected in zip(ivf.search(probes, k=3), exact.search(probes, k=3)):
+        assert [key for key, _ in row] == [key for key, _ in expected]
+        np.testing.assert_allclose([distance for _, distance in row], [distance for _, distance in expected],
+                                   atol=1e-5)
+
+
+def test_ivf_inserts_and_deletes(fixture):
+    gallery, _, keys = fixture
+    ivf = IVFIndex(n_probe=8)
+    ivf.build(gallery[:500], keys[:500])
+
+    ivf.add('new', gallery[1000])
+    assert ivf.search(gallery[1000:1001], k=1)[0][0][0] == 'new'
+
+    ivf.remove('new')
+    assert 'new' not in ivf
+    assert all(key != 'new' for key, _ in ivf.search(gallery[1000:1001], k=5)[0])
+
+
+def test_create_index_switches_at_ann_min_size():
+    assert create_index(99, 'cosine', ann_min_size=100).kind == 'exact'
+    assert create_index(100, 'cosine', ann_min_size=100).kind == 'ivf'
+    assert create_index(10 ** 6, 'cosine', ann_min_size=0).kind == 'exact'
+
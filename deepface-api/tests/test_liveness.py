@@ -0,0 +1,69 @@
+"""
+Liveness - Heuristic anti-spoofing checks and the screening of stream faces
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import numpy as np
+
+from liveness import LivenessChecker
+from streaming import StreamSession
+
+
+def textured_crop(seed=0):
+    return np.random.default_rng(seed).random((112, 112, 3))
+
+
+def flat_crop():
+    return np.full((112, 112, 3), 0.5)
+
+
+def screen_grid_crop():
+    grid = (np.indices((112, 112)).sum(axis=0) % 2).astype(np.float64)
+    return np.repeat((0.3 + 0.4 * grid)[:, :, None], 3, axis=2)
+
+
+def face(crop, x=0):
+    return {'face': crop, 'facial_area': {'x': x, 'y': 0, 'w': 100, 'h': 100}, 'confidence': 0.99}
+
+
+def test_textured_crop_is_live():
+    result = LivenessChecker().check(textured_crop())
+
+    assert result['live'] and result['reason'] is None
+    assert result['stage'] == 'heuristics'
+
+
+def test_flat_crop_is_a_spoof():
+    result = LivenessChecker().check(flat_crop())
+
+    assert not result['live']
+    assert result['reason'] == 'flat_texture'
+
+
+def test_pixel_grid_is_a_moire_spoof():
+    result = LivenessChecker().check(screen_grid_crop())
+
+    assert not result['live']
+    assert result['reason'] == 'moire_pattern'
+
+
+def test_spoofed_stream_face_is_not_embedded():
+    checker = LivenessChecker()
+    embedded = []
+
+    def recognize(faces):
+        embedded.extend(faces)
+        return [{'recognized': True, 'employee_id': '1'} for _ in faces]
+
+    def screen(detected):
+        result = checker.check(detected['face'])
+        return None if result['live'] else {'recognized': False, 'reason': 'spoof_detected', 'liveness': result}
+
+    frame = [face(flat_crop()), face(textured_crop(), x=300)]
+    session = StreamSession(lambda _: frame, recognize, screen=screen)
+    events = {event['track_id']: event for event in session.process_frame(b'frame') if 'frame' in event}
+
+    assert events[1]['event'] == 'not_recognized' and events[1]['reason'] == 'spoof_detected'
+    assert events[2]['event'] == 'recognized' and events[2]['employee_id'] == '1'
+    assert len(embedded) == 1 and embedded[0]['facial_area']['x'] == 300
+    assert session.stats()['embeds'] == 1
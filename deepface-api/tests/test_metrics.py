@@ -0,0 +1,68 @@
+"""
+Metrics - Prometheus text rendering of counters, gauges and histograms
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_counter_series_per_label_and_escaped_values():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Requests', ['endpoint'])
+    requests.inc(endpoint='/recognize')
+    requests.inc(2, endpoint='/recognize')
+    requests.inc(endpoint='say "hi"\n')
+
+    assert requests.value(endpoint='/recognize') == 3
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{endpoint="/recognize"} 3',
+        'requests_total{endpoint="say \\"hi\\"\\n"} 1'
+    ]
+
+
+def test_wrong_labels_are_refused():
+    counter = MetricsRegistry().counter('outcomes_total', 'Outcomes', ['outcome'])
+
+    with pytest.raises(ValueError):
+        counter.inc(result='recognized')
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    stage = registry.histogram('stage_seconds', 'Stage time', ['stage'], buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.5, 0.5, 3.0):
+        stage.observe(value, stage='embed')
+
+    lines = registry.render().splitlines()
+
+    assert lines[2:] == [
+        'stage_seconds_bucket{stage="embed",le="0.1"} 1',
+        'stage_seconds_bucket{stage="embed",le="1.0"} 3',
+        'stage_seconds_bucket{stage="embed",le="+Inf"} 4',
+        'stage_seconds_sum{stage="embed"} 4.05',
+        'stage_seconds_count{stage="embed"} 4'
+    ]
+
+
+def test_timed_block_is_observed_when_it_raises():
+    stage = MetricsRegistry().histogram('stage_seconds', 'Stage time', ['stage'])
+
+    with pytest.raises(RuntimeError):
+        with stage.time(stage='detect'):
+            raise RuntimeError('detector failed')
+
+    assert stage.render()[-1] == 'stage_seconds_count{stage="detect"} 1'
+
+
+def test_callback_gauge_is_read_at_scrape_time():
+    registry = MetricsRegistry()
+    sizes = {('site-a',): 3}
+    registry.gauge('gallery_size', 'Enrolled employees', ['partition'], callback=lambda: dict(sizes))
+    sizes[('site-b',)] = 5
+
+    assert registry.render().splitlines()[2:] == ['gallery_size{partition="site-a"} 3', 'gallery_size{partition="site-b"} 5']
@@ -0,0 +1,68 @@
+"""
+Preprocessing - Header checks, EXIF orientation and downscaling of uploads
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from config import Config
+from preprocessing import EXIF_ORIENTATION, ImageRejected, map_faces, prepare_image
+
+
+def encoded(width, height, image_format='JPEG', orientation=None):
+    image = Image.new('RGB', (width, height), (200, 10, 10))
+    buffer = BytesIO()
+
+    if orientation is None:
+        image.save(buffer, image_format)
+    else:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        image.save(buffer, image_format, exif=exif)
+
+    return buffer.getvalue()
+
+
+def test_large_photo_is_downscaled_with_its_scale():
+    array, scale = prepare_image(encoded(4000, 2000), max_side=1000)
+
+    assert array.shape == (500, 1000, 3)
+    assert scale == (4.0, 4.0)
+
+    # BGR, as the detector expects
+    assert array[250, 500, 2] > 150 and array[250, 500, 0] < 60
+
+
+def test_exif_rotation_swaps_the_original_size():
+    array, scale = prepare_image(encoded(400, 200, orientation=6), max_side=100)
+
+    assert array.shape[:2] == (100, 50)
+    assert scale == (4.0, 4.0)
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'not an image', 'Invalid or corrupted image'),
+    (encoded(200, 200, 'GIF'), 'Unsupported image format'),
+    (encoded(200, 40), 'Image too small')
+])
+def test_unusable_uploads_are_rejected(data, message):
+    with pytest.raises(ImageRejected, match=message):
+        prepare_image(data)
+
+
+def test_oversized_photo_is_rejected_from_its_header(monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_IMAGE_PIXELS', 1000 * 1000)
+
+    with pytest.raises(ImageRejected, match='Image too large'):
+        prepare_image(encoded(2000, 1000))
+
+
+def test_facial_areas_are_mapped_back_to_the_original_photo():
+    faces = [{'facial_area': {'x': 10, 'y': 20, 'w': 30, 'h': 40, 'left_eye': (15, 25), 'right_eye': None}}]
+    area = map_faces(faces, (2.0, 3.0))[0]['facial_area']
+
+    assert area == {'x': 20, 'y': 60, 'w': 60, 'h': 120, 'left_eye': (30, 75), 'right_eye': None}
+    assert faces[0]['facial_area']['x'] == 10
@@ -0,0 +1,84 @@
+"""
+Quality - Face-quality metrics and the verify and enroll thresholds
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import numpy as np
+import pytest
+
+from quality import LowQualityFace, QualityGate
+
+VERIFY = {
+    'min_confidence': 0.0, 'max_roll': 30, 'max_yaw': 0.35, 'min_brightness': 40,
+    'max_brightness': 220, 'min_contrast': 15, 'min_sharpness': 15
+}
+ENROLL = {
+    'min_confidence': 0.9, 'max_roll': 15, 'max_yaw': 0.2, 'min_brightness': 60,
+    'max_brightness': 200, 'min_contrast': 25, 'min_sharpness': 40
+}
+
+
+def gate(enabled=True):
+    return QualityGate(enabled=enabled, profiles={'verify': VERIFY, 'enroll': ENROLL})
+
+
+def sharp_crop(level=0.5, spread=0.5, seed=0):
+    noise = np.random.default_rng(seed).random((112, 112, 1)) - 0.5
+    return np.repeat(np.clip(level + spread * noise, 0, 1), 3, axis=2)
+
+
+def blurry_crop():
+    ramp = np.linspace(0.2, 0.8, 112)
+    return np.repeat(np.add.outer(ramp, ramp)[:, :, None] / 2, 3, axis=2)
+
+
+def face(crop, eyes=((70, 50), (30, 50)), confidence=0.99):
+    area = {'x': 0, 'y': 0, 'w': 100, 'h': 100, 'left_eye': eyes[0], 'right_eye': eyes[1]}
+    return {'face': crop, 'facial_area': area, 'confidence': confidence}
+
+
+def reason(quality_gate, detected, profile='verify'):
+    return quality_gate.assess(quality_gate.measure([detected])[0], profile)[1]
+
+
+def test_good_face_passes_both_profiles():
+    quality_gate = gate()
+    measured = quality_gate.measure([face(sharp_crop())])[0]
+
+    assert quality_gate.check(measured, 'verify')['profile'] == 'verify'
+    assert quality_gate.check(measured, 'enroll')['profile'] == 'enroll'
+    assert measured['quality']['roll'] == 0 and measured['quality']['yaw'] == 0
+
+
+@pytest.mark.parametrize('detected, expected', [
+    (face(sharp_crop(level=0.08, spread=0.1)), 'too_dark'),
+    (face(sharp_crop(level=0.95, spread=0.05)), 'too_bright'),
+    (face(blurry_crop()), 'blurry'),
+    (face(sharp_crop(), eyes=((70, 80), (30, 40))), 'face_tilted'),
+    (face(sharp_crop(), eyes=((95, 50), (60, 50))), 'face_turned')
+])
+def test_each_threshold_rejects_its_face(detected, expected):
+    assert reason(gate(), detected) == expected
+
+
+def test_enroll_profile_is_stricter_than_verify():
+    quality_gate = gate()
+    detected = face(sharp_crop(), confidence=0.8)
+
+    assert reason(quality_gate, detected, 'verify') is None
+    assert reason(quality_gate, detected, 'enroll') == 'low_confidence'
+
+    with pytest.raises(LowQualityFace) as error:
+        quality_gate.check(quality_gate.measure([detected])[0], 'enroll')
+
+    assert error.value.reason == 'low_confidence'
+    assert quality_gate.stats()['rejections'] == {('enroll', 'low_confidence'): 2}
+
+
+def test_unmeasured_metrics_and_a_disabled_gate_are_not_checked():
+    # A cached probe without its crop keeps only the pose and confidence
+    without_crop = gate().measure([{**face(blurry_crop()), 'face': None}])[0]
+
+    assert without_crop['quality']['sharpness'] is None
+    assert gate().assess(without_crop)[1] is None
+    assert reason(gate(enabled=False), face(blurry_crop())) is None
@@ -0,0 +1,99 @@
+"""
+Embedding Store - Round trip of the memory-mapped snapshot format
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import numpy as np
+import pytest
+
+from index import BruteForceIndex, prepare_vectors
+from store import EmbeddingStore, write_store
+
+METADATA = {'model_name': 'VGG-Face', 'detector_backend': 'opencv', 'align': True, 'distance_metric': 'cosine'}
+
+
+def partitions(rng, dims=8):
+    return [
+        ('', rng.normal(size=(3, dims)).astype(np.float32), ['1', '2', '3']),
+        ('site-a', rng.normal(size=(2, dims)).astype(np.float32), ['4', '5']),
+        ('empty', np.zeros((0, dims), dtype=np.float32), [])
+    ]
+
+
+@pytest.mark.parametrize('dtype, tolerance', [('float32', 0), ('float16', 1e-2)])
+def test_round_trip(tmp_path, dtype, tolerance):
+    rng = np.random.default_rng(0)
+    written = partitions(rng)
+    templates = [('4', rng.normal(size=(3, 8)).astype(np.float32))]
+    path = str(tmp_path / 'store')
+
+    write_store(path, written, 7, METADATA, dtype=dtype, templates=templates)
+    store = EmbeddingStore(path)
+
+    assert store.dtype == dtype
+    assert store.generation == 7
+    assert store.metadata == METADATA
+    assert len(store) == 5
+
+    read = list(store.partitions())
+
+    # Empty partitions are not stored
+    assert [partition for partition, _, _, _ in read] == ['', 'site-a']
+
+    for (partition, matrix, keys), (_, vectors, sq_norms, stored_keys) in zip(written, read):
+        assert list(stored_keys) == keys
+        np.testing.assert_allclose(vectors.astype(np.float32), matrix, atol=tolerance)
+
+        # Norms are of the stored (possibly rounded) vectors
+        stored = vectors.astype(np.float32)
+        np.testing.assert_allclose(sq_norms, (stored * stored).sum(axis=1), rtol=1e-5)
+
+    (employee_id, matrix), = list(store.templates())
+    assert employee_id == '4'
+    np.testing.assert_allclose(matrix.astype(np.float32), templates[0][1], atol=tolerance)
+
+
+def test_empty_store(tmp_path):
+    path = str(tmp_path / 'store')
+    write_store(path, [], 0, METADATA)
+    store = EmbeddingStore(path)
+
+    assert len(store) == 0
+    assert list(store.partitions()) == []
+    assert list(store.templates()) == []
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'store'
+    path.write_bytes(b'not a store' * 20)
+
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(path))
+
+
+def test_rejects_unknown_dtype(tmp_path):
+    with pytest.raises(ValueError):
+        write_store(str(tmp_path / 'store'), [], 0, METADATA, dtype='int8')
+
+    # The failed write leaves nothing behind
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_float16_store_is_searched_as_float32(tmp_path):
+    rng = np.random.default_rng(1)
+    gallery = rng.normal(size=(200, 32)).astype(np.float32)
+    probes = gallery[:20] + 0.05 * rng.normal(size=(20, 32)).astype(np.float32)
+    keys = [str(number) for number in range(200)]
+    path = str(tmp_path / 'store')
+
+    write_store(path, [('', prepare_vectors(gallery, 'cosine'), keys)], 0, METADATA, dtype='float16')
+    (_, vectors, sq_norms, stored_keys), = EmbeddingStore(path).partitions()
+
+    mapped = BruteForceIndex()
+    mapped.attach(vectors, stored_keys, sq_norms)
+    exact = BruteForceIndex()
+    exact.build(gallery, keys)
+
+    # Upcast once when attached, never per search
+    assert mapped.get('0').dtype == np.float32
+    assert [row[0][0] for row in mapped.search(probes)] == [row[0][0] for row in exact.search(probes)]
@@ -0,0 +1,78 @@
+"""
+Streaming - IoU tracking and once-per-track recognition of kiosk frames
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import numpy as np
+
+from streaming import FaceTracker, StreamSession, box_iou
+
+
+def face(x, size=100, confidence=0.9):
+    return {'facial_area': {'x': x, 'y': 0, 'w': size, 'h': size}, 'confidence': confidence}
+
+
+def test_box_iou():
+    overlap = box_iou([(0, 0, 10, 10)], [(0, 0, 10, 10), (5, 0, 10, 10), (20, 20, 5, 5)])
+
+    assert np.allclose(overlap, [[1.0, 50 / 150, 0.0]])
+
+
+def test_tracker_follows_moving_faces_and_drops_missing_ones():
+    tracker = FaceTracker(iou_threshold=0.3, max_missed=1)
+    _, new, _ = tracker.update([face(0), face(300)])
+
+    assert [track.id for track in new] == [1, 2]
+
+    # Slightly moved faces, listed in the other order, continue their tracks
+    visible, new, _ = tracker.update([face(310), face(10)])
+
+    assert [track.id for track in visible] == [2, 1] and new == []
+
+    tracker.update([face(10)])
+    _, _, lost = tracker.update([face(10)])
+
+    assert [track.id for track in lost] == [2]
+
+
+def test_session_recognizes_each_track_once_until_its_face_improves():
+    calls = []
+
+    def recognize(faces):
+        calls.append(len(faces))
+        return [{'recognized': False, 'message': 'Face found but similarity too low'} for _ in faces]
+
+    frames = iter([[face(0), face(300)], [face(0), face(300)], [face(0, size=120), face(300)]])
+    session = StreamSession(lambda _: next(frames), recognize, min_quality_gain=0.25, max_embeds_per_track=3)
+
+    events = session.process_frame(b'1')
+
+    assert [event['event'] for event in events] == ['track_started', 'track_started', 'not_recognized', 'not_recognized']
+    assert calls == [2]
+
+    # Same faces: nothing to embed and nothing new to push
+    assert session.process_frame(b'2') == []
+
+    # A 44% larger face is re-embedded; the unchanged result is not pushed again
+    assert session.process_frame(b'3') == []
+    assert calls == [2, 1]
+    assert session.stats() == {'frames': 3, 'embeds': 3, 'active_tracks': 2}
+
+
+def test_recognized_track_is_not_embedded_again():
+    calls = []
+
+    def recognize(faces):
+        calls.append(len(faces))
+        return [{'recognized': True, 'employee_id': '123'} for _ in faces]
+
+    session = StreamSession(lambda _: [face(0)], recognize)
+    events = session.process_frame(b'1')
+
+    assert events[-1]['event'] == 'recognized' and events[-1]['employee_id'] == '123'
+    assert events[-1]['track_id'] == 1 and events[-1]['frame'] == 1
+
+    for _ in range(5):
+        session.process_frame(b'frame')
+
+    assert calls == [1]
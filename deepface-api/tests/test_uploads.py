@@ -0,0 +1,53 @@
+"""
+Uploads - Parameters and size limit of binary photo uploads
+Sistema de Ponto Eletrônico Brasileiro
+"""
+
+import io
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder
+
+from config import Config
+from uploads import RAW_MIMETYPE, LimitedBuffer, UploadRequest, read_body, read_parameters, read_photos
+
+
+def upload_request(**kwargs):
+    return UploadRequest(EnvironBuilder(method='POST', **kwargs).get_environ())
+
+
+def test_form_field_wins_over_query_parameter():
+    request = upload_request(
+        query_string={'threshold': '0.2', 'partition': 'site-a'},
+        data={'threshold': '0.4', 'candidates': ['1, 2', '3']}
+    )
+
+    assert read_parameters(request) == {'threshold': '0.4', 'partition': 'site-a', 'candidates': ['1', '2', '3']}
+
+
+def test_multipart_photo_over_the_limit_is_refused_while_parsed(monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_FILE_SIZE', 1000)
+    buffer = LimitedBuffer(1000)
+    buffer.write(b'x' * 600)
+
+    with pytest.raises(RequestEntityTooLarge):
+        buffer.write(b'x' * 600)
+
+    request = upload_request(data={'photo': (io.BytesIO(b'x' * 5000), 'photo.jpg')})
+
+    with pytest.raises(RequestEntityTooLarge):
+        read_photos(request)
+
+
+def test_raw_body_over_the_limit_is_refused(monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_FILE_SIZE', 1000)
+
+    assert read_photos(upload_request(data=b'x' * 1000, content_type=RAW_MIMETYPE)) == {'photo': [b'x' * 1000]}
+
+    with pytest.raises(RequestEntityTooLarge):
+        read_photos(upload_request(data=b'x' * 1001, content_type=RAW_MIMETYPE))
+
+    # A body without Content-Length is cut off once it passes the limit
+    with pytest.raises(RequestEntityTooLarge):
+        read_body(io.BytesIO(b'x' * 200000), None, 1000)
@@ -0,0 +1,123 @@
+"""
+Uploads - Binary photo uploads (multipart/form-data and raw bodies)
+Sistema de Ponto Eletrônico Brasileiro
+
+Base64 inside JSON adds a third to every payload and is copied several
+times before it is decoded. Photos can also be sent as multipart file
+parts or as an application/octet-stream body: each is read once into a
+single in-memory buffer, and MAX_FILE_SIZE is enforced while the bytes
+stream in, so an oversized upload is refused before it is fully read.
+"""
+
+import io
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from config import Config
+
+RAW_MIMETYPE = 'application/octet-stream'
+MULTIPART_MIMETYPE = 'multipart/form-data'
+
+# Parameters that hold several values (repeated form fields or comma-separated)
+LIST_PARAMETERS = ('candidates',)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def too_large():
+    return RequestEntityTooLarge(f'Image size exceeds maximum allowed ({Config.MAX_FILE_SIZE} bytes)')
+
+
+class LimitedBuffer(io.BytesIO):
+    """
+    In-memory file that refuses to grow past a size limit
+    """
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def write(self, data):
+        if self.tell() + len(data) > self.limit:
+            raise too_large()
+
+        return super().write(data)
+
+
+class UploadRequest(Request):
+    """
+    Request whose multipart file parts are buffered in memory (never spooled
+    to a temporary file) and capped at MAX_FILE_SIZE as they are parsed
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if content_length is not None and content_length > Config.MAX_FILE_SIZE:
+            raise too_large()
+
+        return LimitedBuffer(Config.MAX_FILE_SIZE)
+
+
+def read_body(stream, content_length, limit):
+    """
+    Read a raw request body into one buffer, refusing it once it passes limit
+    """
+    if content_length is not None and content_length > limit:
+        raise too_large()
+
+    buffer = bytearray()
+
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+
+        if not chunk:
+            break
+
+        if len(buffer) + len(chunk) > limit:
+            raise too_large()
+
+        buffer += chunk
+
+    return buffer
+
+
+def read_photos(request):
+    """
+    Photos sent as binary: {field name: [bytes, ...]}
+
+    A raw body is the single field "photo"; multipart file parts keep their
+    field names (repeat "photos" for /recognize/batch).
+    """
+    if request.mimetype == RAW_MIMETYPE:
+        return {'photo': [read_body(request.stream, request.content_length, Config.MAX_FILE_SIZE)]}
+
+    if request.mimetype == MULTIPART_MIMETYPE:
+        photos = {}
+
+        for name, storage in request.files.items(multi=True):
+            photos.setdefault(name, []).append(storage.stream.getvalue())
+
+        return photos
+
+    return {}
+
+
+def read_parameters(request):
+    """
+    Non-photo parameters of a binary upload: the query string, then form fields
+
+    A form field wins over a query parameter of the same name.
+    """
+    parameters = {}
+
+    for source in (request.args, request.form):
+        for name in source:
+            if name in LIST_PARAMETERS:
+                parameters[name] = [
+                    value.strip()
+                    for raw in source.getlist(name) for value in raw.split(',') if value.strip()
+                ]
+            else:
+                parameters[name] = source.get(name)
+
+    return parameters
@@ -234,63 +234,6 @@ class DeepFacePOC:
         self.results["tests"].append(test)
         return True
 
-    def test_performance(self):
-        """Testa performance/tempo de resposta"""
-        print("\n" + "="*60)
-        print("TESTE 5: Performance e Tempo de Resposta")
-        print("="*60)
-
-        test = {
-            "name": "performance",
-            "description": "Medir tempo de resposta",
-            "status": "pending",
-            "details": {}
-        }
-
-        try:
-            # Criar imagem de teste
-            img = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
-            test_img_path = self.test_dir / "test_performance.jpg"
-            cv2.imwrite(str(test_img_path), img)
-
-            # Teste 1: Detecção de rosto
-            times = []
-            for i in range(3):
-                start = time.time()
-                try:
-                    DeepFace.extract_faces(
-                        img_path=str(test_img_path),
-                        detector_backend='opencv',
-                        enforce_detection=False
-                    )
-                except:
-                    pass
-                times.append(time.time() - start)
-
-            avg_time = sum(times) / len(times)
-            test["details"]["face_detection_avg"] = f"{avg_time:.3f}s"
-            test["details"]["target"] = "< 2.0s"
-
-            if avg_time < 2.0:
-                test["status"] = "passed"
-                print(f"✓ Performance adequada: {avg_time:.3f}s (target: <2s)")
-            else:
-                test["status"] = "warning"
-                print(f"⚠ Performance lenta: {avg_time:.3f}s (target: <2s)")
-
-            print(f"  - Tentativas: {len(times)}")
-            print(f"  - Min: {min(times):.3f}s")
-            print(f"  - Max: {max(times):.3f}s")
-            print(f"  - Média: {avg_time:.3f}s")
-
-        except Exception as e:
-            test["status"] = "failed"
-            test["error"] = str(e)
-            print(f"✗ Erro no teste: {e}")
-
-        self.results["tests"].append(test)
-        return test["status"] in ["passed", "warning"]
-
     def generate_report(self):
         """Gera relatório JSON dos testes"""
         print("\n" + "="*60)
@@ -316,7 +259,7 @@ class DeepFacePOC:
             "✓ DeepFace está funcional e pronto para uso",
             "⚠ Adicione fotos reais para teste completo de acurácia",
             "⚠ Para produção, configure anti-spoofing avançado",
-            "✓ Performance adequada para ambiente de produção",
+            "⚠ Meça a performance com deepface-api/benchmarks/bench_load.py",
             "⚠ Configure GPU para melhor performance (opcional)"
         ]
 
@@ -351,8 +294,7 @@ class DeepFacePOC:
             self.test_installation,
             self.test_face_detection,
             self.test_recognition_accuracy,
-            self.test_anti_spoofing,
-            self.test_performance
+            self.test_anti_spoofing
         ]
 
         for test_func in tests:
@@ -372,6 +314,7 @@ class DeepFacePOC:
         print("2. Adicione fotos reais em test/faces/personX/")
         print("3. Execute novamente para teste completo de acurácia")
         print("4. Configure microserviço DeepFace API (Fase 2)")
+        print("5. Meça latência e throughput: python deepface-api/benchmarks/bench_load.py")
         print("="*60)
 
 